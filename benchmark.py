@@ -0,0 +1,335 @@
+import os
+import sys
+import argparse
+import json
+import time
+import random
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import faiss
+from src.utils import Retriever, recall_report, concat
+from src.embedding import EMBEDDING_BACKENDS, make_embedder, compare_embeddings
+
+
+def print_rows(rows, columns):
+    widths = {c: max(len(c), *(len(fmt(r[c])) for r in rows)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for r in rows:
+        print("  ".join(fmt(r[c]).ljust(widths[c]) for c in columns))
+
+
+def fmt(v):
+    return f"{v:.4f}" if isinstance(v, float) else str(v)
+
+
+def load_questions(path, limit=None):
+    """Questions from a JSONL file; each line needs a `question` (or `body`/`title`) field."""
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            rec = json.loads(line)
+            text = rec.get("question") or rec.get("body") or rec.get("title")
+            if text:
+                questions.append({"id": rec.get("id") or rec.get("request_id") or str(len(questions)),
+                                  "question": text})
+            if limit and len(questions) >= limit:
+                break
+    return questions
+
+
+def question_texts(path, n):
+    """n question strings from a JSONL file, or synthetic ones without a file."""
+    if path:
+        return [q["question"] for q in load_questions(path, n)]
+    return [f"side effects and drug interactions of medication number {i}" for i in range(n)]
+
+
+# -----------------------------
+# recall@k vs. latency
+# -----------------------------
+def run_recall(args):
+    retriever = Retriever(chunk_dir=args.chunk_dir)
+    print(f"🔄 Encoding a sample of {args.sample + args.queries} chunks...")
+    vectors, _ = retriever.sample_embeddings(args.sample + args.queries)
+    xb, xq = vectors[:args.sample], vectors[args.sample:]
+
+    if args.questions:
+        questions = [q["question"] for q in load_questions(args.questions)]
+        xq = retriever.model.encode(questions, convert_to_numpy=True).astype(np.float32)
+        faiss.normalize_L2(xq)
+
+    configs = [
+        ("hnsw", {}),
+        ("ivf", {}),
+        ("ivfpq", {}),
+        ("opq", {}),
+    ]
+    rows = recall_report(
+        xb, xq, k=args.k, configs=configs,
+        train_size=args.train_size, nlist=args.nlist, pq_m=args.pq_m
+    )
+    print(f"\nrecall@{args.k} against exact search ({len(xb)} vectors, {len(xq)} queries)\n")
+    print_rows(rows, ["index", "setting", "recall", "ms_per_query", "bytes_per_vector"])
+
+
+# -----------------------------
+# Concurrent query throughput (micro-batching)
+# -----------------------------
+def run_concurrency(args):
+    retriever = Retriever(chunk_dir=args.chunk_dir, cache_size=0, batch_window=None)
+    questions = question_texts(args.questions, args.queries)
+    # Warm up the model and the index pages
+    retriever.get_relevant_documents(questions[0], k=args.k)
+
+    rows = []
+    for window_ms in [None] + args.windows:
+        retriever.set_batching(None if window_ms is None else window_ms / 1000, args.max_batch)
+        for threads in args.threads:
+            latencies = []
+
+            def query(q):
+                t0 = time.perf_counter()
+                retriever.get_relevant_documents(q, k=args.k)
+                latencies.append(time.perf_counter() - t0)
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(threads) as pool:
+                list(pool.map(query, questions))
+            elapsed = time.perf_counter() - start
+            stats = retriever.cache_stats()["batching"]
+            rows.append({
+                "window_ms": "off" if window_ms is None else window_ms,
+                "threads": threads,
+                "qps": len(questions) / elapsed,
+                "p50_ms": float(np.percentile(latencies, 50) * 1000),
+                "p95_ms": float(np.percentile(latencies, 95) * 1000),
+                "mean_batch": stats["mean_batch"] if stats else 1.0,
+            })
+            if window_ms is not None:
+                # Fresh counters for the next thread count
+                retriever.set_batching(window_ms / 1000, args.max_batch)
+
+    print(f"\nQuery throughput over {len(questions)} queries (k={args.k})\n")
+    print_rows(rows, ["window_ms", "threads", "qps", "p50_ms", "p95_ms", "mean_batch"])
+
+
+# -----------------------------
+# Embedding backends: equivalence + speed
+# -----------------------------
+def sample_texts(chunk_dir, n):
+    texts = []
+    for fname in sorted(os.listdir(chunk_dir)):
+        if not fname.endswith(".jsonl"):
+            continue
+        with open(os.path.join(chunk_dir, fname), "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    t = json.loads(line)
+                    texts.append(concat(t["title"], t["content"]))
+                    if len(texts) >= n:
+                        return texts
+    return texts
+
+
+def run_embed(args):
+    texts = sample_texts(args.chunk_dir, args.sample)
+    questions = question_texts(args.questions, args.queries)
+    reference = make_embedder("torch")
+
+    rows, failed = [], []
+    for backend in args.backends:
+        model = reference if backend == "torch" else make_embedder(backend, threads=args.threads)
+        report = compare_embeddings(reference, model, texts, batch_size=args.batch_size)
+
+        model.encode(questions[:1], convert_to_numpy=True)
+        t0 = time.perf_counter()
+        for q in questions:
+            model.encode([q], convert_to_numpy=True)
+        query_ms = (time.perf_counter() - t0) / len(questions) * 1000
+
+        ok = report["min_cosine"] >= args.min_cosine
+        if not ok:
+            failed.append(backend)
+        rows.append({
+            "backend": backend,
+            "chunks_per_s": len(texts) / report["candidate_s"],
+            "ms_per_query": query_ms,
+            "min_cosine": report["min_cosine"],
+            "max_abs_diff": report["max_abs_diff"],
+            "equivalent": "yes" if ok else "NO",
+        })
+
+    print(f"\nEmbedding backends vs. torch reference ({len(texts)} chunks, {len(questions)} single queries)\n")
+    print_rows(rows, ["backend", "chunks_per_s", "ms_per_query", "min_cosine", "max_abs_diff", "equivalent"])
+    if failed:
+        raise SystemExit(f"❌ Below min cosine {args.min_cosine}: {', '.join(failed)}")
+
+
+# -----------------------------
+# Cold start: eager vs. lazy MedRAG
+# -----------------------------
+STARTUP_SCRIPT = """
+import json, sys, time
+t0 = time.perf_counter()
+from src.medrag import MedRAG
+t1 = time.perf_counter()
+model = MedRAG(llm_name=sys.argv[1], db_dir=sys.argv[2], concept_cache_size=0,
+               lazy=sys.argv[3] == "lazy", build_index=False)
+t2 = time.perf_counter()
+model.retrieval_system.get_relevant_documents(sys.argv[4], k=5)
+t3 = time.perf_counter()
+print(json.dumps({"import_s": t1 - t0, "construct_s": t2 - t1, "first_query_s": t3 - t2}))
+"""
+
+
+def run_startup(args):
+    rows = []
+    for mode in ("eager", "lazy"):
+        runs = []
+        for _ in range(args.runs):
+            # A fresh interpreter per run: module imports and model loads are the cost being measured
+            out = subprocess.run(
+                [sys.executable, "-c", STARTUP_SCRIPT, args.llm, args.db_dir, mode, args.question],
+                capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+            )
+            if out.returncode != 0:
+                raise SystemExit(f"❌ {mode} startup failed:\n{out.stderr}")
+            runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+        med = {k: float(np.median([r[k] for r in runs])) for k in runs[0]}
+        rows.append({
+            "mode": mode,
+            "import_s": med["import_s"],
+            "construct_s": med["construct_s"],
+            "ready_s": med["import_s"] + med["construct_s"],
+            "first_query_s": med["first_query_s"],
+        })
+    print(f"\nMedRAG cold start, median of {args.runs} fresh process(es)\n")
+    print_rows(rows, ["mode", "import_s", "construct_s", "ready_s", "first_query_s"])
+
+
+# -----------------------------
+# Two-stage retrieval: quality vs. latency per N
+# -----------------------------
+def known_item_queries(retriever, n, words=12, seed=0):
+    """(query, phrase) pairs: a random window of `words` words from a random chunk. A retrieved
+    chunk is relevant if it contains the phrase, so identical label text elsewhere counts too."""
+    rng = random.Random(seed)
+    rows = rng.sample(range(retriever.index.ntotal), min(n * 2, retriever.index.ntotal))
+    queries = []
+    for row in rows:
+        doc = retriever.metadatas.get(row)
+        tokens = doc["content"].split() if doc else []
+        if len(tokens) < words:
+            continue
+        start = rng.randrange(len(tokens) - words + 1)
+        phrase = " ".join(tokens[start:start + words])
+        queries.append((phrase, phrase))
+        if len(queries) >= n:
+            break
+    return queries
+
+
+def run_rerank(args):
+    retriever = Retriever(chunk_dir=args.chunk_dir, batch_window=None, rerank=True,
+                          rerank_threshold=args.threshold, rerank_gap=args.gap, rerank_min_k=args.min_k)
+    retriever.reranker.batch_size = args.batch_size
+    retriever.warmup(background=False)
+    queries = known_item_queries(retriever, args.queries, args.words)
+
+    configs = [("dense", args.k, False, False)]
+    for n in args.candidates:
+        configs.append((f"rerank N={n}", n, True, False))
+        configs.append((f"rerank N={n} adaptive", n, True, True))
+
+    rows = []
+    for name, n, rerank, adaptive in configs:
+        retriever.rerank_candidates = n
+        retriever.rerank_threshold = args.threshold if adaptive else None
+        retriever.rerank_gap = args.gap if adaptive else None
+        # Cold caches: every config pays for its own searches and cross-encoder passes
+        retriever.result_cache.clear()
+        retriever.reranker.clear()
+        latencies, hits, rr, kept = [], 0, 0.0, []
+        for query, phrase in queries:
+            t0 = time.perf_counter()
+            docs = retriever.get_relevant_documents(query, k=args.k, rerank=rerank)
+            latencies.append(time.perf_counter() - t0)
+            kept.append(len(docs))
+            ranks = [i for i, d in enumerate(docs, 1) if phrase in " ".join(d["content"].split())]
+            if ranks:
+                hits += 1
+                rr += 1 / ranks[0]
+        rows.append({
+            "config": name,
+            f"hit@{args.k}": hits / len(queries),
+            "mrr": rr / len(queries),
+            "mean_docs": float(np.mean(kept)),
+            "p50_ms": float(np.percentile(latencies, 50) * 1000),
+            "p95_ms": float(np.percentile(latencies, 95) * 1000),
+        })
+
+    print(f"\nTwo-stage retrieval over {len(queries)} known-item queries "
+          f"(k={args.k}, threshold={args.threshold}, gap={args.gap})\n")
+    print_rows(rows, ["config", f"hit@{args.k}", "mrr", "mean_docs", "p50_ms", "p95_ms"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MedRAG benchmarks.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("recall", help="recall@k vs. latency of compressed indexes against exact Flat search")
+    p.add_argument("--chunk-dir", default="./corpus/openfda/chunk")
+    p.add_argument("--sample", type=int, default=50000, help="Corpus vectors to index")
+    p.add_argument("--queries", type=int, default=500, help="Held-out chunks used as queries")
+    p.add_argument("--questions", default=None, help="Optional JSONL with a `question` field to use as queries")
+    p.add_argument("--k", type=int, default=10)
+    p.add_argument("--nlist", type=int, default=256)
+    p.add_argument("--pq-m", type=int, default=48)
+    p.add_argument("--train-size", type=int, default=50000)
+    p.set_defaults(func=run_recall)
+
+    p = sub.add_parser("concurrency", help="query throughput with and without micro-batching")
+    p.add_argument("--chunk-dir", default="./corpus/openfda/chunk")
+    p.add_argument("--queries", type=int, default=512)
+    p.add_argument("--questions", default=None, help="Optional JSONL with a `question` field")
+    p.add_argument("--k", type=int, default=5)
+    p.add_argument("--threads", type=int, nargs="+", default=[1, 4, 16])
+    p.add_argument("--windows", type=float, nargs="+", default=[1.0, 5.0], help="Batch windows (ms)")
+    p.add_argument("--max-batch", type=int, default=32)
+    p.set_defaults(func=run_concurrency)
+
+    p = sub.add_parser("embed", help="embedding backend equivalence and encode speed")
+    p.add_argument("--chunk-dir", default="./corpus/openfda/chunk")
+    p.add_argument("--backends", nargs="+", choices=EMBEDDING_BACKENDS, default=list(EMBEDDING_BACKENDS))
+    p.add_argument("--sample", type=int, default=2000, help="Chunks encoded in batches")
+    p.add_argument("--queries", type=int, default=200, help="Single-question encodes")
+    p.add_argument("--questions", default=None, help="Optional JSONL with a `question` field")
+    p.add_argument("--batch-size", type=int, default=64)
+    p.add_argument("--threads", type=int, default=None, help="ONNX Runtime intra-op threads")
+    p.add_argument("--min-cosine", type=float, default=0.99, help="Equivalence tolerance vs. torch")
+    p.set_defaults(func=run_embed)
+
+    p = sub.add_parser("rerank", help="quality vs. latency of cross-encoder reranking per candidate count N")
+    p.add_argument("--chunk-dir", default="./corpus/openfda/chunk")
+    p.add_argument("--queries", type=int, default=200, help="Known-item queries cut from random chunks")
+    p.add_argument("--words", type=int, default=12, help="Words per known-item query")
+    p.add_argument("--k", type=int, default=5)
+    p.add_argument("--candidates", type=int, nargs="+", default=[10, 20, 50, 100])
+    p.add_argument("--threshold", type=float, default=0.05, help="Adaptive cut: minimum rerank score")
+    p.add_argument("--gap", type=float, default=None, help="Adaptive cut: largest allowed score drop")
+    p.add_argument("--min-k", type=int, default=1)
+    p.add_argument("--batch-size", type=int, default=32, help="Cross-encoder pairs per forward pass")
+    p.set_defaults(func=run_rerank)
+
+    p = sub.add_parser("startup", help="cold-start time of an eager vs. lazy MedRAG")
+    p.add_argument("--db-dir", default="./corpus")
+    p.add_argument("--llm", default="stub", help="`stub` or a Gemini model name")
+    p.add_argument("--question", default="warfarin aspirin interaction")
+    p.add_argument("--runs", type=int, default=3)
+    p.set_defaults(func=run_startup)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -1,7 +1,50 @@
-from src.utils import Retriever
+import argparse
+from src.utils import Retriever, INDEX_TYPES
+from src.embedding import EMBEDDING_BACKENDS
 
-print("🔄 Building FAISS index (one-time)...")
+parser = argparse.ArgumentParser(description="Build or incrementally update the FAISS index.")
+parser.add_argument("--chunk-dir", default="./corpus/openfda/chunk")
+parser.add_argument("--rebuild", action="store_true", help="Re-embed every chunk file from scratch")
+parser.add_argument("--index-type", choices=INDEX_TYPES, default=None,
+                    help="flat | hnsw | ivf | ivfpq | opq (default: keep the existing index type, else flat)")
+parser.add_argument("--hnsw", action="store_true", help="Shortcut for --index-type hnsw")
+parser.add_argument("--nlist", type=int, default=1024, help="IVF lists (IVF types)")
+parser.add_argument("--pq-m", type=int, default=48, help="PQ sub-quantizers (ivfpq/opq)")
+parser.add_argument("--train-size", type=int, default=50000, help="Vectors sampled to train IVF/PQ")
+parser.add_argument("--bm25", action="store_true", help="Also build the BM25 (pyserini) index for hybrid retrieval")
+parser.add_argument("--embedding-backend", choices=EMBEDDING_BACKENDS, default="torch",
+                    help="torch | torch-int8 | onnx | onnx-int8 (quantized backends encode several times faster on CPU)")
+parser.add_argument("--workers", type=int, default=1, help="Encoder processes, each with its own model")
+parser.add_argument("--threads", type=int, default=None, help="Intra-op threads per encoder process")
+parser.add_argument("--batch-size", type=int, default=64, help="Chunks per encode batch (bounds peak memory)")
+parser.add_argument("--keep-embeddings", action="store_true",
+                    help="Keep per-file embedding checkpoints after the build (reused by later rebuilds)")
+parser.add_argument("--keep-snapshots", type=int, default=3,
+                    help="Published index snapshots to keep on disk (the current one included)")
+args = parser.parse_args()
 
-retriever = Retriever(chunk_dir="./corpus/openfda/chunk")
+print("🔄 Updating FAISS index...")
 
+retriever = Retriever(
+    chunk_dir=args.chunk_dir,
+    HNSW=args.hnsw,
+    index_type=args.index_type,
+    nlist=args.nlist,
+    pq_m=args.pq_m,
+    train_size=args.train_size,
+    sparse=args.bm25,
+    embedding_backend=args.embedding_backend,
+    encode_workers=args.workers,
+    encode_threads=args.threads,
+    encode_batch_size=args.batch_size,
+    keep_embeddings=args.keep_embeddings,
+    keep_snapshots=args.keep_snapshots,
+    # update_index below is the only build: the constructor neither loads nor builds
+    lazy=True,
+    allow_build=False
+)
+changes = retriever.update_index(rebuild=args.rebuild)
+
+print(f"   {len(changes['added'])} file(s) embedded, {len(changes['removed'])} file(s) removed")
+print(f"   Current snapshot: {retriever.snapshot}")
 print("✅ Index ready. You can now run Streamlit.")
@@ -0,0 +1,101 @@
+import argparse
+import json
+import time
+import numpy as np
+from src.medrag import MedRAG
+from src.stubllm import StubLLM
+from src.trace import trace
+from benchmark import print_rows, load_questions
+
+# Report order; any other stage that shows up in a trace is appended
+STAGES = ["concepts", "encode", "batch_wait", "search", "sparse_search", "rerank", "evidence", "context", "generate"]
+
+
+def summarize(values):
+    ms = np.asarray(values) * 1000
+    return {
+        "count": len(ms),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+    }
+
+
+def run(args):
+    model = MedRAG(
+        llm_name=args.llm,
+        corpus_name=args.corpus_name,
+        db_dir=args.db_dir,
+        # Stub concepts must never land in the persistent concept cache
+        concept_cache_size=args.concept_cache if args.llm != "stub" else 0,
+        retrieval_mode=args.mode,
+        context_budget=args.context_budget,
+        answer_cache_size=args.answer_cache,
+        rerank=args.rerank
+    )
+    if args.llm == "stub":
+        model.model = StubLLM(latency=args.llm_latency)
+    if model.retrieval_system is None:
+        print("⚠️ No corpus found; answering without retrieval")
+    else:
+        # One question at a time: don't pay the micro-batching window
+        model.retrieval_system.set_batching(None)
+
+    questions = load_questions(args.questions, args.limit)
+    print(f"🔄 Running {len(questions)} question(s) through MedRAG ({args.llm})...")
+
+    stage_times = {}
+    totals = []
+    with open(args.answers, "w", encoding="utf-8") as out:
+        for q in questions:
+            with trace() as t:
+                answer = model.medrag_answer(q["question"], k=args.k)
+            totals.append(t.total)
+            for name, seconds in t.stages.items():
+                stage_times.setdefault(name, []).append(seconds)
+            out.write(json.dumps({
+                "id": q["id"],
+                "question": q["question"],
+                "answer": answer,
+                "total_ms": t.total * 1000,
+                "stages_ms": {name: seconds * 1000 for name, seconds in t.stages.items()}
+            }, ensure_ascii=False) + "\n")
+
+    names = [s for s in STAGES if s in stage_times] + sorted(set(stage_times) - set(STAGES))
+    report = {
+        "questions": len(questions),
+        "llm": args.llm,
+        "k": args.k,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "total": summarize(totals) if totals else None,
+        "stages": {name: summarize(stage_times[name]) for name in names},
+    }
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    if totals:
+        rows = [dict(stage=name, **report["stages"][name]) for name in names]
+        rows.append(dict(stage="total", **report["total"]))
+        print(f"\nPer-stage latency over {len(questions)} question(s)\n")
+        print_rows(rows, ["stage", "count", "mean_ms", "p50_ms", "p95_ms", "p99_ms"])
+    print(f"\n✅ Report written to {args.report}, answers to {args.answers}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a JSONL file of questions through MedRAG and time every stage.")
+    parser.add_argument("--questions", required=True, help="JSONL with a `question` field per line")
+    parser.add_argument("--report", default="eval_report.json")
+    parser.add_argument("--answers", default="eval_answers.jsonl")
+    parser.add_argument("--llm", default="stub", help="`stub` (offline, deterministic) or a Gemini model name")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Simulated seconds per stub LLM call")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--mode", default="dense", choices=["dense", "sparse", "hybrid"])
+    parser.add_argument("--rerank", action="store_true", help="Cross-encoder second retrieval stage")
+    parser.add_argument("--context-budget", type=int, default=3000)
+    parser.add_argument("--concept-cache", type=int, default=10000, help="Concept cache size for real LLM runs")
+    parser.add_argument("--answer-cache", type=int, default=1024, help="Semantic answer cache size, 0 = every question hits the LLM")
+    parser.add_argument("--corpus-name", default="openfda")
+    parser.add_argument("--db-dir", default="./corpus")
+    run(parser.parse_args())
@@ -0,0 +1,161 @@
+import argparse
+import json
+import time
+import socket
+import threading
+import http.client
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from benchmark import print_rows, load_questions
+
+DEFAULT_QUESTIONS = [
+    "What are the side effects of metformin?",
+    "Is it safe to take warfarin with aspirin?",
+    "What is the maximum daily dose of acetaminophen?",
+    "Can ibuprofen be taken during pregnancy?",
+    "Does simvastatin interact with grapefruit juice?",
+    "What are the contraindications of lisinopril?",
+    "How should levothyroxine be taken?",
+    "Can sertraline and tramadol be combined?",
+]
+
+
+# -----------------------------
+# Local server with the stub LLM
+# -----------------------------
+def start_local_server(args):
+    """Runs serve.py's app with the stub LLM on a free port in a background thread."""
+    import uvicorn
+    from serve import build_app
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    args.llm = "stub"
+    config = uvicorn.Config(build_app(args), host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, name="loadtest-server", daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, f"http://127.0.0.1:{port}"
+
+
+def wait_ready(url, timeout=600):
+    """Polls /healthz until the background warm-up has loaded the index."""
+    u = urlparse(url)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        conn = http.client.HTTPConnection(u.hostname, u.port, timeout=5)
+        try:
+            conn.request("GET", "/healthz")
+            health = json.loads(conn.getresponse().read())
+            if health.get("index_loaded") or not health.get("rag"):
+                return health
+        except OSError:
+            pass
+        finally:
+            conn.close()
+        time.sleep(0.5)
+    raise TimeoutError(f"{url} did not load its index within {timeout}s")
+
+
+# -----------------------------
+# Closed-loop load generator
+# -----------------------------
+def run_level(url, endpoint, questions, concurrency, n_requests, k, timeout):
+    """`concurrency` clients each send their next request as soon as the previous one
+    returns, until n_requests have been sent. Keep-alive connection per client."""
+    u = urlparse(url)
+    path = f"/v1/{endpoint}"
+    counter = iter(range(n_requests))
+    lock = threading.Lock()
+    results = []
+
+    def client():
+        conn = http.client.HTTPConnection(u.hostname, u.port, timeout=(timeout or 30) + 30)
+        out = []
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            body = {"question": questions[i % len(questions)], "k": k}
+            if timeout:
+                body["timeout"] = timeout
+            start = time.perf_counter()
+            try:
+                conn.request("POST", path, json.dumps(body), {"Content-Type": "application/json"})
+                resp = conn.getresponse()
+                resp.read()
+                status = resp.status
+            except OSError:
+                conn.close()
+                conn = http.client.HTTPConnection(u.hostname, u.port, timeout=(timeout or 30) + 30)
+                status = "error"
+            out.append((status, time.perf_counter() - start))
+        conn.close()
+        return out
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for out in pool.map(lambda _: client(), range(concurrency)):
+            results.extend(out)
+    wall = time.perf_counter() - start
+
+    ok = np.asarray([s for status, s in results if status == 200]) * 1000
+    statuses = [status for status, _ in results]
+    return {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "ok_qps": len(ok) / wall,
+        "p50_ms": float(np.percentile(ok, 50)) if len(ok) else float("nan"),
+        "p95_ms": float(np.percentile(ok, 95)) if len(ok) else float("nan"),
+        "p99_ms": float(np.percentile(ok, 99)) if len(ok) else float("nan"),
+        "429_rate": statuses.count(429) / len(results),
+        "504_rate": statuses.count(504) / len(results),
+        "other_err": sum(1 for s in statuses if s not in (200, 429, 504)),
+    }
+
+
+def run(args):
+    server = None
+    if args.url:
+        url = args.url.rstrip("/")
+    else:
+        print(f"🔄 Starting a local server with the stub LLM ({args.llm_latency * 1000:.0f} ms per call)...")
+        server, url = start_local_server(args)
+    wait_ready(url)
+
+    questions = ([q["question"] for q in load_questions(args.questions)] if args.questions
+                 else DEFAULT_QUESTIONS)
+    print(f"🔄 Load testing {url}/v1/{args.endpoint} with {len(questions)} distinct question(s)...")
+    rows = []
+    for c in args.concurrency:
+        rows.append(run_level(url, args.endpoint, questions, c, args.requests, args.k, args.request_timeout))
+        print(f"  concurrency={c}: {rows[-1]['ok_qps']:.1f} ok/s")
+
+    print(f"\n{args.endpoint}: {args.requests} requests per level\n")
+    print_rows(rows, ["concurrency", "requests", "ok_qps", "p50_ms", "p95_ms", "p99_ms",
+                      "429_rate", "504_rate", "other_err"])
+    if server is not None:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    from serve import add_server_args
+
+    parser = argparse.ArgumentParser(description="Closed-loop HTTP load test of the MedRAG service.")
+    parser.add_argument("--url", default=None,
+                        help="Running server to test; by default one is started here with the stub LLM")
+    parser.add_argument("--endpoint", default="answer", choices=["answer", "retrieve"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--requests", type=int, default=500, help="Requests per concurrency level")
+    parser.add_argument("--questions", default=None, help="Optional JSONL with a `question` field")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--request-timeout", type=float, default=None, help="Per-request deadline sent to the server (s)")
+    # Local server settings (ignored with --url)
+    add_server_args(parser)
+    # Measure the pipeline, not the semantic answer cache, unless asked to
+    parser.set_defaults(llm_latency=0.5, answer_cache=0)
+    run(parser.parse_args())
@@ -1,6 +1,9 @@
 import os
+import itertools
+from contextlib import nullcontext
 import streamlit as st
 from src.medrag import MedRAG
+from src.trace import trace
 
 # ---------- PAGE CONFIG ----------
 st.set_page_config(
@@ -56,17 +59,27 @@ with st.sidebar:
         - **Model:** Gemini-2.5-Flash
         """)
     
+    show_timings = st.toggle("⏱️ Debug: pipeline timings", value=False)
+
     st.divider()
     st.warning("⚠️ **Disclaimer:** This tool is for informational purposes only. Consult a professional for medical advice.")
 
 # ---------- INITIALIZE MODEL ----------
 @st.cache_resource(show_spinner=False)
 def load_model():
-    return MedRAG(
+    # Lazy: the page renders before torch, the encoder and the index are loaded; they warm up
+    # in the background. The web process never builds an index (run buildindex.py instead);
+    # snapshots it publishes are picked up within 30 s.
+    model = MedRAG(
         llm_name="gemini-2.5-flash",
         rag=True,
-        corpus_name="openfda"
+        corpus_name="openfda",
+        lazy=True,
+        build_index=False,
+        index_watch_interval=30
     )
+    model.warmup(background=True)
+    return model
 
 model = load_model()
 
@@ -86,23 +99,36 @@ if question:
 
     # Display Assistant Response
     with st.chat_message("assistant", avatar="🩺"):
-        with st.spinner("Analyzing medical literature..."):
-            try:
-                # k=0 is passed as per your original code
-                answer= model.medrag_answer(question, k=5)
-                
-                # Split answer into summary and details if applicable
+        try:
+            # Stage timings are only collected while the debug panel is on
+            with (trace("streamlit") if show_timings else nullcontext()) as t:
+                stream = model.medrag_stream(question, k=5)
+                # Retrieval happens before the first delta; keep the spinner up until then
+                with st.spinner("Analyzing medical literature..."):
+                    first = next(stream, "")
+
                 st.markdown("### Clinical Response")
-                st.markdown(answer)
-                
-                
-
-                st.caption("Sources used: OpenFDA Medical Corpus. Response generated via RAG.")
-                
-            except Exception as e:
-                st.error("An error occurred while processing the request.")
-                with st.expander("Technical Error Details"):
-                    st.exception(e)
+                st.write_stream(itertools.chain([first], stream))
+            if t is not None:
+                st.session_state["last_trace"] = t.to_dict()
+
+            st.caption("Sources used: OpenFDA Medical Corpus. Response generated via RAG.")
+
+        except Exception as e:
+            st.error("An error occurred while processing the request.")
+            with st.expander("Technical Error Details"):
+                st.exception(e)
+
+# ---------- DEBUG PANEL ----------
+if show_timings and st.session_state.get("last_trace"):
+    last = st.session_state["last_trace"]
+    with st.sidebar.expander("⏱️ Last query breakdown", expanded=True):
+        st.metric("Total", f"{last['total_s'] * 1000:.0f} ms")
+        stages = {"stage": list(last["stages_s"]), "ms": [round(s * 1000, 1) for s in last["stages_s"].values()]}
+        st.bar_chart(stages, x="stage", y="ms")
+        st.table(stages)
+        if last["counters"]:
+            st.json(last["counters"])
 
 # ---------- EMPTY STATE ----------
 if not question:
@@ -0,0 +1,71 @@
+import argparse
+from src.medrag import MedRAG
+from src.stubllm import StubLLM
+from src.server import MedRAGService, create_app
+
+
+def build_app(args):
+    """One MedRAG, so one Retriever and one index, for the whole process. The index is loaded
+    by the background warm-up at startup, never built here (run buildindex.py first)."""
+    model = MedRAG(
+        llm_name=args.llm,
+        corpus_name=args.corpus_name,
+        db_dir=args.db_dir,
+        concept_cache_size=args.concept_cache if args.llm != "stub" else 0,
+        retrieval_mode=args.mode,
+        context_budget=args.context_budget,
+        answer_cache_size=args.answer_cache,
+        answer_cache_threshold=args.answer_cache_threshold,
+        rerank=args.rerank,
+        index_watch_interval=args.index_watch or None,
+        lazy=True,
+        build_index=False
+    )
+    if args.llm == "stub":
+        model.model = StubLLM(latency=args.llm_latency)
+    if model.retrieval_system is not None:
+        model.retrieval_system.set_batching(args.batch_window / 1000 if args.batch_window else None)
+    service = MedRAGService(
+        model,
+        answer_workers=args.answer_workers,
+        answer_queue=args.answer_queue,
+        retrieve_workers=args.retrieve_workers,
+        retrieve_queue=args.retrieve_queue,
+        default_timeout=args.timeout,
+        max_timeout=args.max_timeout
+    )
+    return create_app(service)
+
+
+def add_server_args(parser):
+    parser.add_argument("--llm", default="gemini-2.5-flash", help="Gemini model name, or `stub` for offline runs")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Simulated seconds per stub LLM call")
+    parser.add_argument("--corpus-name", default="openfda")
+    parser.add_argument("--db-dir", default="./corpus")
+    parser.add_argument("--mode", default="dense", choices=["dense", "sparse", "hybrid"])
+    parser.add_argument("--rerank", action="store_true", help="Cross-encoder second retrieval stage")
+    parser.add_argument("--context-budget", type=int, default=3000)
+    parser.add_argument("--concept-cache", type=int, default=10000)
+    parser.add_argument("--answer-cache", type=int, default=1024, help="Semantic answer cache size, 0 = off")
+    parser.add_argument("--answer-cache-threshold", type=float, default=0.92, help="Question cosine similarity for a hit")
+    parser.add_argument("--answer-workers", type=int, default=16, help="Answers in flight at once")
+    parser.add_argument("--answer-queue", type=int, default=64, help="Answers waiting before 429s")
+    parser.add_argument("--retrieve-workers", type=int, default=4, help="Retrievals in flight at once")
+    parser.add_argument("--retrieve-queue", type=int, default=256, help="Retrievals waiting before 429s")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Default per-request deadline (s)")
+    parser.add_argument("--max-timeout", type=float, default=120.0, help="Cap on a client-requested deadline (s)")
+    parser.add_argument("--index-watch", type=float, default=5.0,
+                        help="Seconds between checks for a newly published index snapshot, 0 = off")
+    parser.add_argument("--batch-window", type=float, default=5.0, help="Query micro-batching window (ms), 0 = off")
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve MedRAG over HTTP (ASGI).")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    add_server_args(parser)
+    args = parser.parse_args()
+    # A single event loop process: every request shares the one in-memory index
+    uvicorn.run(build_app(args), host=args.host, port=args.port, log_level="warning")
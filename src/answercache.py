@@ -0,0 +1,153 @@
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+import faiss
+
+
+# -----------------------------
+# Semantic answer cache
+# -----------------------------
+class SemanticAnswerCache:
+    """Final answers keyed on (question embedding, retrieved evidence).
+
+    Past questions live in a small exact inner-product FAISS index, so a paraphrase is
+    found by cosine similarity >= threshold. Its answer is only reused when the new
+    question retrieves exactly the chunk IDs that answer was generated from. Entries are
+    evicted least recently used beyond maxsize and after ttl seconds, and the whole cache
+    is dropped when the index version it was filled against changes.
+    """
+
+    def __init__(self, maxsize=1024, threshold=0.92, ttl=24 * 3600, neighbors=8):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.ttl = ttl
+        self.neighbors = neighbors
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evidence_misses = 0
+        # Built on the first put, when the embedding dimension is known
+        self._index = None
+        # id -> {"concept_query", "evidence", "answer", "expires"}, in LRU order
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def evidence_key(docs):
+        return frozenset(str(d["id"]) for d in docs)
+
+    def _sync_version(self, version):
+        """False if `version` is older than the cache (a request that started before a reload)."""
+        if version == self.version:
+            return True
+        if self.version is not None and version < self.version:
+            return False
+        self._clear()
+        self.version = version
+        return True
+
+    def _clear(self):
+        if self._index is not None:
+            self._index.reset()
+        self._entries.clear()
+
+    def _remove(self, ids):
+        if ids:
+            self._index.remove_ids(np.asarray(ids, dtype=np.int64))
+            for i in ids:
+                self._entries.pop(i, None)
+
+    def _expired(self, entry, now):
+        return entry["expires"] is not None and entry["expires"] <= now
+
+    def _candidates(self, q_emb, version):
+        with self._lock:
+            if not self._sync_version(version) or not self._entries:
+                return []
+            scores, ids = self._index.search(np.asarray(q_emb, dtype=np.float32).reshape(1, -1),
+                                             min(self.neighbors, len(self._entries)))
+            now = time.monotonic()
+            found, stale = [], []
+            for score, i in zip(scores[0], ids[0]):
+                entry = self._entries.get(int(i))
+                if entry is None or score < self.threshold:
+                    continue
+                if self._expired(entry, now):
+                    stale.append(int(i))
+                    continue
+                found.append((int(i), entry))
+            self._remove(stale)
+            return found
+
+    def get(self, q_emb, version, retrieve):
+        """Cached answer for a question embedded as q_emb, or None.
+
+        retrieve(concept_query) -> docs re-runs retrieval with the concept query a similar
+        past question was answered with (once per distinct query), so a hit costs one
+        search and no LLM call. Returns (answer, concept_query, docs); the last two are
+        None when no similar question is cached.
+        """
+        candidates = self._candidates(q_emb, version)
+        tried = {}
+        for i, entry in candidates:
+            cq = entry["concept_query"]
+            if cq not in tried:
+                docs = retrieve(cq)
+                tried[cq] = (self.evidence_key(docs), docs)
+            if tried[cq][0] == entry["evidence"]:
+                with self._lock:
+                    if i in self._entries:
+                        self._entries.move_to_end(i)
+                    self.hits += 1
+                return entry["answer"], cq, tried[cq][1]
+        with self._lock:
+            self.misses += 1
+            if candidates:
+                self.evidence_misses += 1
+        return None, None, None
+
+    def put(self, q_emb, concept_query, docs, answer, version):
+        if self.maxsize <= 0:
+            return
+        q_emb = np.asarray(q_emb, dtype=np.float32).reshape(1, -1)
+        entry = {
+            "concept_query": concept_query,
+            "evidence": self.evidence_key(docs),
+            "answer": answer,
+            "expires": time.monotonic() + self.ttl if self.ttl else None,
+        }
+        with self._lock:
+            if not self._sync_version(version):
+                return
+            if self._index is None:
+                self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(q_emb.shape[1]))
+            i = self._next_id
+            self._next_id += 1
+            self._index.add_with_ids(q_emb, np.asarray([i], dtype=np.int64))
+            self._entries[i] = entry
+            if len(self._entries) > self.maxsize:
+                now = time.monotonic()
+                self._remove([j for j, e in self._entries.items() if self._expired(e, now)])
+                excess = len(self._entries) - self.maxsize
+                if excess > 0:
+                    self._remove(list(self._entries)[:excess])
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evidence_misses": self.evidence_misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
@@ -0,0 +1,107 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+_STOP = object()
+
+
+# -----------------------------
+# Micro-batching
+# -----------------------------
+class MicroBatcher:
+    """Coalesces concurrent calls into one batched call.
+
+    fn takes a list of items and returns a list of results in the same order.
+    Callers submit single items and get a Future; a background thread collects
+    whatever arrives within `window` seconds of the first item (up to `max_batch`)
+    and calls fn once for the whole group. A lone caller after a batch of one
+    is served straight away, so an idle service does not pay the window.
+    An exception from fn fails every future in that batch.
+    """
+
+    def __init__(self, fn, window=0.005, max_batch=32, name="micro-batcher"):
+        self.fn = fn
+        self.window = window
+        self.max_batch = max_batch
+        self.name = name
+        self.batches = 0
+        self.items = 0
+        self.largest = 0
+        self._last = 1
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+    def submit(self, item):
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"{self.name} is closed")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            self._queue.put((item, future))
+        return future
+
+    def __call__(self, item):
+        return self.submit(item).result()
+
+    def _collect(self, first):
+        batch = [first]
+        if self._last == 1 and self._queue.empty():
+            return batch
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is _STOP:
+                # Finish this batch, then stop
+                self._queue.put(_STOP)
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch = [(item, f) for item, f in self._collect(first) if f.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                results = self.fn([item for item, _ in batch])
+            except BaseException as e:
+                for _, f in batch:
+                    f.set_exception(e)
+                continue
+            for (_, f), result in zip(batch, results):
+                f.set_result(result)
+            self._last = len(batch)
+            self.batches += 1
+            self.items += len(batch)
+            self.largest = max(self.largest, len(batch))
+
+    def close(self):
+        """Stops the worker after the queued items are served."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join()
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch": self.items / self.batches if self.batches else 0.0,
+            "largest": self.largest,
+        }
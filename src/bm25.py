@@ -0,0 +1,87 @@
+import os
+import sys
+import json
+import shutil
+import subprocess
+
+
+# -----------------------------
+# BM25 (pyserini / Lucene) sparse index
+# -----------------------------
+# The Lucene collection is written from the metadata store with the FAISS row id as
+# the Lucene docid, so sparse hits resolve through exactly the same store as dense ones.
+
+def write_collection(store, rows, out_path, concat):
+    """Writes a pyserini JsonCollection file for the given store rows."""
+    tmp_path = f"{out_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for row in rows:
+            doc = store.get(int(row))
+            if doc is None:
+                continue
+            f.write(json.dumps({
+                "id": str(int(row)),
+                "contents": concat(doc["title"], doc["content"])
+            }, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, out_path)
+
+
+def build_lucene_index(collection_dir, index_dir, threads=4):
+    """(Re)builds the Lucene index for a JsonCollection directory and swaps it into place."""
+    tmp_dir = f"{index_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    subprocess.run([
+        sys.executable, "-m", "pyserini.index.lucene",
+        "--collection", "JsonCollection",
+        "--input", collection_dir,
+        "--index", tmp_dir,
+        "--generator", "DefaultLuceneDocumentGenerator",
+        "--threads", str(threads)
+    ], check=True)
+    old_dir = f"{index_dir}.old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(index_dir):
+        os.replace(index_dir, old_dir)
+    os.replace(tmp_dir, index_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+class BM25Searcher:
+    """Lazily opened LuceneSearcher returning (rows, bm25 scores)."""
+
+    def __init__(self, index_dir, k1=0.9, b=0.4):
+        self.index_dir = index_dir
+        self.k1 = k1
+        self.b = b
+        self._searcher = None
+
+    @staticmethod
+    def exists(index_dir):
+        return os.path.isdir(index_dir)
+
+    def _open(self):
+        if self._searcher is None:
+            # Imported lazily: pyserini starts a JVM
+            from pyserini.search.lucene import LuceneSearcher
+            self._searcher = LuceneSearcher(self.index_dir)
+            self._searcher.set_bm25(self.k1, self.b)
+        return self._searcher
+
+    def search(self, query, k):
+        hits = self._open().search(query, k)
+        return [int(h.docid) for h in hits], [float(h.score) for h in hits]
+
+    def close(self):
+        if self._searcher is not None:
+            self._searcher.close()
+            self._searcher = None
+
+
+def rrf_fuse(ranked_lists, k=None, rrf_k=60):
+    """Reciprocal rank fusion of several ranked row lists. Returns [(row, rrf_score), ...]."""
+    fused = {}
+    for rows in ranked_lists:
+        for rank, row in enumerate(rows, 1):
+            fused[row] = fused.get(row, 0.0) + 1.0 / (rrf_k + rank)
+    ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)
+    return ranked[:k] if k else ranked
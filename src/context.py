@@ -0,0 +1,135 @@
+import re
+import tiktoken
+from .rerank import rank_score
+
+WORD_RE = re.compile(r"\w+|[^\w\s]")
+
+
+# -----------------------------
+# Token counting
+# -----------------------------
+class TokenCounter:
+    """tiktoken counts; if the encoding can't be loaded (it is downloaded on first use),
+    falls back to counting words and punctuation, which is close for English label text."""
+
+    def __init__(self, encoding="cl100k_base"):
+        self.encoding = encoding
+        self._enc = None
+        self._loaded = False
+
+    @property
+    def enc(self):
+        # Loaded on first use: the first load may download the BPE file
+        if not self._loaded:
+            try:
+                self._enc = tiktoken.get_encoding(self.encoding)
+            except Exception as e:
+                print(f"⚠️ tiktoken encoding {self.encoding!r} unavailable ({type(e).__name__}); "
+                      "approximating token counts")
+            self._loaded = True
+        return self._enc
+
+    def count(self, text):
+        if self.enc is not None:
+            return len(self.enc.encode(text, disallowed_special=()))
+        return len(WORD_RE.findall(text))
+
+    def truncate(self, text, n_tokens):
+        if n_tokens <= 0:
+            return ""
+        if self.enc is not None:
+            return self.enc.decode(self.enc.encode(text, disallowed_special=())[:n_tokens])
+        matches = list(WORD_RE.finditer(text))
+        if len(matches) <= n_tokens:
+            return text
+        return text[:matches[n_tokens - 1].end()]
+
+
+def format_source(doc):
+    return f"SOURCE [{doc['title']}]: {doc['content']}"
+
+
+def shingles(text, n=5):
+    words = re.findall(r"[a-z0-9]+", text.lower())
+    if len(words) < n:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + n]) for i in range(len(words) - n + 1)}
+
+
+# -----------------------------
+# Context packing
+# -----------------------------
+class ContextPacker:
+    """Builds the prompt context from retrieved chunks under a token budget.
+
+    1. Chunks whose word 5-grams are mostly (>= dup_threshold) covered by a better
+       scoring chunk are dropped: overlapping splitter windows and the identical
+       label text many manufacturers share.
+    2. The best chunk of every distinct title is placed first, so each drug in a DDI
+       question keeps its label, then the rest by score.
+    3. Chunks are added until the budget is spent; the one that crosses it is cut to
+       fit if at least min_tokens remain.
+    Scores are the cross-encoder's for reranked chunks, else the cosine. The kept chunks
+    are returned in score order together with a report of every decision.
+    """
+
+    def __init__(self, budget=3000, encoding="cl100k_base", dup_threshold=0.8, min_tokens=48):
+        self.budget = budget
+        self.dup_threshold = dup_threshold
+        self.min_tokens = min_tokens
+        self.counter = TokenCounter(encoding)
+
+    def dedup(self, docs):
+        kept, dropped, seen = [], [], set()
+        for d in docs:
+            sh = shingles(d["content"])
+            if sh and len(sh & seen) >= self.dup_threshold * len(sh):
+                dropped.append(d)
+                continue
+            seen |= sh
+            kept.append(d)
+        return kept, dropped
+
+    def pack(self, docs):
+        docs = sorted(docs, key=rank_score, reverse=True)
+        unique, duplicates = self.dedup(docs)
+
+        titles = set()
+        first, rest = [], []
+        for d in unique:
+            (rest if d["title"] in titles else first).append(d)
+            titles.add(d["title"])
+
+        packed, over_budget, truncated = [], [], []
+        used = 0
+        for d in first + rest:
+            # +1 for the newline joining sources
+            cost = self.counter.count(format_source(d)) + 1
+            if used + cost <= self.budget:
+                packed.append(d)
+                used += cost
+                continue
+            room = self.budget - used - self.counter.count(format_source(dict(d, content=""))) - 1
+            if room >= self.min_tokens:
+                cut = dict(d, content=self.counter.truncate(d["content"], room))
+                # Re-tokenizing a cut string can merge differently at the boundary
+                while room > 0 and used + self.counter.count(format_source(cut)) + 1 > self.budget:
+                    room -= 1
+                    cut["content"] = self.counter.truncate(d["content"], room)
+                packed.append(cut)
+                truncated.append(d)
+                used += self.counter.count(format_source(cut)) + 1
+            else:
+                over_budget.append(d)
+
+        packed.sort(key=rank_score, reverse=True)
+        report = {
+            "budget": self.budget,
+            "tokens": used,
+            "retrieved": len(docs),
+            "kept": [d.get("id") for d in packed],
+            "duplicates": [d.get("id") for d in duplicates],
+            "over_budget": [d.get("id") for d in over_budget],
+            "truncated": [d.get("id") for d in truncated],
+        }
+        return packed, report
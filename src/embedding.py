@@ -0,0 +1,296 @@
+import os
+import json
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+
+
+# -----------------------------
+# Custom SentenceTransformer (CLS pooling)
+# -----------------------------
+_customize_class = None
+
+
+def _sentence_transformer_class():
+    # sentence-transformers pulls in torch (seconds of import time), so the class is
+    # only defined the first time a torch-backed model is actually needed
+    global _customize_class
+    if _customize_class is None:
+        from sentence_transformers import SentenceTransformer
+        from sentence_transformers.models import Transformer, Pooling
+
+        class CustomizeSentenceTransformer(SentenceTransformer):
+            def _load_auto_model(self, model_name_or_path, *args, **kwargs):
+                transformer_model = Transformer(model_name_or_path)
+                pooling_model = Pooling(
+                    transformer_model.get_word_embedding_dimension(),
+                    pooling_mode_cls_token=True
+                )
+                return [transformer_model, pooling_model]
+
+        _customize_class = CustomizeSentenceTransformer
+    return _customize_class
+
+
+def __getattr__(name):
+    if name == "CustomizeSentenceTransformer":
+        return _sentence_transformer_class()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def load_reference(model_name=MODEL_NAME):
+    model = _sentence_transformer_class()(model_name, device="cpu")
+    model.eval()
+    return model
+
+
+# -----------------------------
+# int8 dynamic-quantized torch
+# -----------------------------
+def load_quantized_torch(model_name=MODEL_NAME):
+    """Reference model with every nn.Linear swapped for an int8 dynamic-quantized one."""
+    import torch
+    model = load_reference(model_name)
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+# -----------------------------
+# ONNX Runtime
+# -----------------------------
+def export_onnx(model_name=MODEL_NAME, out_dir="./models/onnx", quantize=False):
+    """Exports the transformer of the CLS-pooled model to ONNX (once) and returns the model path.
+
+    Tokenizer files and the reference max_seq_length are saved alongside, so serving
+    only needs onnxruntime + the tokenizer. quantize=True adds an int8 weight-quantized copy.
+    """
+    out_dir = os.path.join(out_dir, model_name.replace("/", "__"))
+    fp32_path = os.path.join(out_dir, "model.onnx")
+    int8_path = os.path.join(out_dir, "model.int8.onnx")
+
+    if not os.path.exists(fp32_path):
+        import torch
+        os.makedirs(out_dir, exist_ok=True)
+        reference = load_reference(model_name)
+        transformer = reference[0]
+        hf_model = transformer.auto_model
+        tokenizer = transformer.tokenizer
+        tokenizer.save_pretrained(out_dir)
+        with open(os.path.join(out_dir, "pooling.json"), "w", encoding="utf-8") as f:
+            json.dump({"max_seq_length": transformer.max_seq_length, "pooling": "cls"}, f)
+
+        sample = tokenizer(["export sample"], return_tensors="pt")
+        names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in sample]
+        dynamic = {n: {0: "batch", 1: "seq"} for n in names}
+        dynamic["last_hidden_state"] = {0: "batch", 1: "seq"}
+        tmp_path = fp32_path + ".tmp"
+        with torch.no_grad():
+            torch.onnx.export(
+                hf_model, tuple(sample[n] for n in names), tmp_path,
+                input_names=names, output_names=["last_hidden_state"],
+                dynamic_axes=dynamic, opset_version=17
+            )
+        os.replace(tmp_path, fp32_path)
+
+    if quantize and not os.path.exists(int8_path):
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        tmp_path = int8_path + ".tmp"
+        quantize_dynamic(fp32_path, tmp_path, weight_type=QuantType.QInt8)
+        os.replace(tmp_path, int8_path)
+
+    return int8_path if quantize else fp32_path
+
+
+class OnnxEmbedder:
+    """Same CLS-pooled embeddings as CustomizeSentenceTransformer, run with ONNX Runtime.
+
+    Only the `encode` surface the Retriever uses is implemented. Inputs are sorted by
+    length before batching so each batch pads to a similar length.
+    """
+
+    def __init__(self, model_name=MODEL_NAME, model_dir="./models/onnx", quantize=False, threads=None):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        path = export_onnx(model_name, model_dir, quantize=quantize)
+        base = os.path.dirname(path)
+        self.tokenizer = AutoTokenizer.from_pretrained(base)
+        with open(os.path.join(base, "pooling.json"), "r", encoding="utf-8") as f:
+            self.max_seq_length = json.load(f)["max_seq_length"]
+
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            opts.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, opts, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def eval(self):
+        return self
+
+    def get_sentence_embedding_dimension(self):
+        return self.session.get_outputs()[0].shape[-1]
+
+    def encode(self, sentences, batch_size=32, show_progress_bar=False, convert_to_numpy=True, **kwargs):
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        order = np.argsort([-len(s) for s in sentences], kind="stable")
+        out = [None] * len(sentences)
+        starts = range(0, len(sentences), batch_size)
+        if show_progress_bar:
+            import tqdm
+            starts = tqdm.tqdm(starts, desc="Batches")
+        for start in starts:
+            idx = order[start:start + batch_size]
+            feats = self.tokenizer(
+                [sentences[i] for i in idx], padding=True, truncation=True,
+                max_length=self.max_seq_length, return_tensors="np"
+            )
+            inputs = {n: feats[n].astype(np.int64) for n in self.input_names}
+            hidden = self.session.run(None, inputs)[0]
+            for i, emb in zip(idx, hidden[:, 0]):
+                out[i] = emb
+        embeddings = np.stack(out).astype(np.float32) if out else np.zeros((0, 0), dtype=np.float32)
+        return embeddings[0] if single else embeddings
+
+
+# -----------------------------
+# Backend selection
+# -----------------------------
+def make_embedder(backend="torch", model_name=MODEL_NAME, model_dir="./models/onnx", threads=None):
+    """Returns an object with SentenceTransformer's `encode` for the given backend."""
+    if backend == "torch":
+        return load_reference(model_name)
+    if backend == "torch-int8":
+        return load_quantized_torch(model_name)
+    if backend in ("onnx", "onnx-int8"):
+        return OnnxEmbedder(model_name, model_dir, quantize=backend == "onnx-int8", threads=threads)
+    raise ValueError(f"Unknown embedding backend {backend!r}, expected one of {EMBEDDING_BACKENDS}")
+
+
+def compare_embeddings(reference, candidate, texts, batch_size=64):
+    """Equivalence of two backends on the same texts.
+
+    Returns the max absolute difference and the min/mean cosine between
+    corresponding embeddings, plus wall-clock encode time of each side.
+    """
+    t0 = time.perf_counter()
+    a = np.asarray(reference.encode(texts, batch_size=batch_size, convert_to_numpy=True), dtype=np.float32)
+    t1 = time.perf_counter()
+    b = np.asarray(candidate.encode(texts, batch_size=batch_size, convert_to_numpy=True), dtype=np.float32)
+    t2 = time.perf_counter()
+    cos = np.sum(a * b, axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+    return {
+        "max_abs_diff": float(np.max(np.abs(a - b))),
+        "min_cosine": float(cos.min()),
+        "mean_cosine": float(cos.mean()),
+        "reference_s": t1 - t0,
+        "candidate_s": t2 - t1,
+    }
+
+
+# -----------------------------
+# Checkpointed corpus encoding
+# -----------------------------
+def set_threads(threads):
+    """Caps torch's intra-op threads (ONNX sessions take `threads` directly)."""
+    if threads:
+        try:
+            import torch
+            torch.set_num_threads(threads)
+        except ImportError:
+            pass
+
+
+def _count_rows(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return sum(1 for line in f if line.strip())
+
+
+def encode_file(model, chunk_path, out_path, text_fn, batch_size=64):
+    """Encodes one chunk JSONL into an .npy checkpoint, batch by batch.
+
+    Embeddings are written straight into a memory-mapped array, so only one batch
+    is held in memory. The file appears at out_path only once it is complete.
+    Returns the number of rows.
+    """
+    n_rows = _count_rows(chunk_path)
+    tmp_path = out_path + ".tmp"
+    out = None
+    row = 0
+
+    def flush(batch):
+        nonlocal out, row
+        emb = np.asarray(model.encode(
+            batch,
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        ), dtype=np.float32)
+        if out is None:
+            out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(n_rows, emb.shape[1]))
+        out[row:row + len(emb)] = emb
+        row += len(emb)
+
+    batch = []
+    with open(chunk_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            t = json.loads(line)
+            batch.append(text_fn(t["title"], t["content"]))
+            if len(batch) == batch_size:
+                flush(batch)
+                batch = []
+    if batch:
+        flush(batch)
+
+    if out is None:
+        np.save(tmp_path, np.zeros((0, 0), dtype=np.float32))
+        os.replace(tmp_path + ".npy", out_path)
+    else:
+        out.flush()
+        del out
+        os.replace(tmp_path, out_path)
+    return row
+
+
+_worker_model = None
+
+
+def _init_worker(backend, model_name, model_dir, threads):
+    global _worker_model
+    set_threads(threads)
+    _worker_model = make_embedder(backend, model_name, model_dir, threads=threads)
+
+
+def _encode_job(job):
+    chunk_path, out_path, text_fn, batch_size = job
+    return encode_file(_worker_model, chunk_path, out_path, text_fn, batch_size)
+
+
+def encode_files(jobs, text_fn, model=None, backend="torch", model_name=MODEL_NAME, model_dir="./models/onnx",
+                 workers=1, threads=None, batch_size=64):
+    """Encodes (chunk_path, out_path) jobs to .npy checkpoints, yielding (chunk_path, rows) in job order.
+
+    workers > 1 shards files across processes, each with its own model and `threads`
+    intra-op threads; otherwise `model` encodes in this process.
+    """
+    args = [(chunk_path, out_path, text_fn, batch_size) for chunk_path, out_path in jobs]
+    if workers <= 1 or len(args) <= 1:
+        set_threads(threads)
+        model = model or make_embedder(backend, model_name, model_dir, threads=threads)
+        for job in args:
+            yield job[0], encode_file(model, *job)
+        return
+
+    # spawn: forking a process that already ran torch can deadlock its thread pools
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker,
+                             initargs=(backend, model_name, model_dir, threads)) as pool:
+        for job, rows in zip(args, pool.map(_encode_job, args)):
+            yield job[0], rows
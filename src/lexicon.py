@@ -0,0 +1,161 @@
+import os
+import json
+import pickle
+import re
+from collections import deque
+import numpy as np
+
+
+def normalize_name(name):
+    """Lowercase a drug name and collapse punctuation/whitespace to single spaces."""
+    return " ".join(re.findall(r"[a-z0-9]+", name.lower()))
+
+
+# Brand names that are plain English ("Cold", "Pain Relief", "Sleep Aid") would otherwise
+# match ordinary questions and drag them into drug-filtered retrieval. A name made up
+# only of these words (or numbers) never enters the matcher.
+COMMON_WORDS = frozenset("""
+    a an and the of for to in on with by or at from as is it no not plus
+    day daytime night nighttime time am pm hour hours daily
+    extra maximum max regular original advanced complete ultra fast rapid quick
+    strength formula care health relief relieve remedy aid support defense
+    pain ache aches headache fever cold colds flu cough sinus allergy allergies
+    sleep nausea heartburn acid gas itch rash sore throat chest nose nasal
+    eye eyes ear ears skin lip lips hand hands foot feet mouth teeth
+    children child kids adult adults infant junior baby women men
+    soft gel gels liquid tablet tablets capsule capsules chewable spray cream
+    drops lotion ointment
+""".split())
+
+
+def is_common_name(name, stopwords=COMMON_WORDS):
+    """True if a normalized name is made up only of common words and numbers."""
+    return all(w in stopwords or w.isdigit() for w in name.split(" "))
+
+
+# -----------------------------
+# Aho-Corasick drug-name matcher
+# -----------------------------
+class DrugMatcher:
+    """Finds every lexicon drug name in a text in one linear pass.
+
+    Aho-Corasick over word tokens rather than characters: names only ever match whole
+    words, and the automaton has one node per name token instead of per character.
+    Overlapping hits resolve to the leftmost-longest name ("potassium phosphate" beats
+    "potassium"). Names that are only common words (see COMMON_WORDS) are left out.
+    """
+
+    def __init__(self, names, min_length=3, stopwords=COMMON_WORDS):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [()]
+        for name in sorted({normalize_name(n) for n in names}):
+            if len(name) >= min_length and not is_common_name(name, stopwords):
+                self._insert(name)
+        self._build_links()
+
+    def _insert(self, name):
+        node = 0
+        words = name.split(" ")
+        for word in words:
+            nxt = self.goto[node].get(word)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][word] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append(())
+            node = nxt
+        self.out[node] = ((name, len(words)),)
+
+    def _build_links(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for word, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and word not in self.goto[f]:
+                    f = self.fail[f]
+                link = self.goto[f].get(word, 0)
+                self.fail[nxt] = link if link != nxt else 0
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def __len__(self):
+        return sum(1 for o in self.out if o)
+
+    def find(self, text):
+        """Returns the drug names mentioned in text, in order of appearance."""
+        hits = []
+        node = 0
+        for i, word in enumerate(normalize_name(text).split(" ")):
+            while node and word not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(word, 0)
+            for name, n_words in self.out[node]:
+                hits.append((i - n_words + 1, i + 1, name))
+
+        hits.sort(key=lambda h: (h[0], h[0] - h[1]))
+        found = []
+        last_end = -1
+        for start, end, name in hits:
+            if start >= last_end:
+                found.append(name)
+                last_end = end
+        return list(dict.fromkeys(found))
+
+    def save(self, path):
+        with open(f"{path}.tmp", "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f"{path}.tmp", path)
+
+    @staticmethod
+    def load(path):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+
+# -----------------------------
+# Drug -> FAISS rows postings
+# -----------------------------
+# Layout, for a path prefix P:
+#   P.keys.json    sorted normalized drug names
+#   P.indptr.npy   int64 (len(keys) + 1,) offsets into P.rows.npy
+#   P.rows.npy     int64 FAISS row ids, grouped by key
+
+class Postings:
+    def __init__(self, prefix):
+        self.prefix = prefix
+        with open(f"{prefix}.keys.json", "r", encoding="utf-8") as f:
+            self.keys = json.load(f)
+        self.key_pos = {k: i for i, k in enumerate(self.keys)}
+        self.indptr = np.load(f"{prefix}.indptr.npy", mmap_mode="r")
+        self.row_ids = np.load(f"{prefix}.rows.npy", mmap_mode="r")
+
+    @staticmethod
+    def exists(prefix):
+        return all(os.path.exists(f"{prefix}{ext}") for ext in (".keys.json", ".indptr.npy", ".rows.npy"))
+
+    def rows(self, key):
+        i = self.key_pos.get(key)
+        if i is None:
+            return np.empty(0, dtype=np.int64)
+        return np.asarray(self.row_ids[self.indptr[i]:self.indptr[i + 1]])
+
+    def to_dict(self):
+        return {k: self.rows(k).tolist() for k in self.keys}
+
+    @staticmethod
+    def write(prefix, postings):
+        """Writes {key: [rows]} atomically."""
+        keys = sorted(k for k, rows in postings.items() if rows)
+        lengths = np.array([len(postings[k]) for k in keys], dtype=np.int64)
+        indptr = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        rows = np.fromiter((r for k in keys for r in sorted(postings[k])), dtype=np.int64, count=int(indptr[-1]))
+        with open(f"{prefix}.keys.json.tmp", "w", encoding="utf-8") as f:
+            json.dump(keys, f)
+        np.save(f"{prefix}.indptr.tmp.npy", indptr)
+        np.save(f"{prefix}.rows.tmp.npy", rows)
+        os.replace(f"{prefix}.keys.json.tmp", f"{prefix}.keys.json")
+        os.replace(f"{prefix}.indptr.tmp.npy", f"{prefix}.indptr.npy")
+        os.replace(f"{prefix}.rows.tmp.npy", f"{prefix}.rows.npy")
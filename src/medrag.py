@@ -1,59 +1,288 @@
 import os
 import re
-import tiktoken
+import asyncio
+import logging
+import threading
 from .utils import Retriever
+from .cache import SQLiteCache, normalize_query
+from .answercache import SemanticAnswerCache
+from .terms import key_terms
+from .lexicon import normalize_name
+from .context import ContextPacker, format_source
+from .rerank import rank_score
+from .stubllm import StubLLM
+from .trace import span, count, request
 from .template import (
     simple_medrag_system,
     simple_medrag_prompt,
     ddi_medrag_prompt
 )
 
+logger = logging.getLogger(__name__)
+
+# Words that, next to drug names, let a query skip LLM concept extraction
+MEDICAL_TERMS = {
+    "adverse", "effects", "effect", "side", "reactions", "reaction", "dosage", "dosing",
+    "interaction", "interactions", "warnings", "warning", "contraindications", "contraindication",
+    "indications", "indication", "overdose", "toxicity", "pregnancy", "lactation", "pediatric",
+    "geriatric", "renal", "hepatic", "impairment", "precautions", "risks", "risk", "safety",
+    "administration", "pharmacokinetics", "mechanism", "action", "boxed", "allergy", "allergic"
+}
+QUERY_GLUE = {"and", "for", "of", "on", "in", "any", "about", "between", "taking", "take", "its", "their"}
+
+LOW_EVIDENCE_NOTE = "Note: The following information is based on general medical knowledge as it is not fully detailed in the provided corpus."
+SEVERITY_TAG = "SEVERITY_SCORE:"
+# Every tag is cut out of the answer together with the whitespace before it
+SEVERITY_RE = re.compile(r"\s*SEVERITY_SCORE:\s*(\d+)")
+# Label sections (OpenFDA fields) searched for interaction questions about indexed drugs
+DDI_SECTIONS = ("drug_interactions",)
+# Interaction intent, matched as whole words: "adverse reactions", "metformin vs placebo" or the
+# "vs" in "CVS" are not interaction questions
+DDI_INTENT = re.compile(
+    r"\b(interact|interacts|interacting|interaction|interactions|combine|combines|combined|combining"
+    r"|combination|combinations|react|reacts|reacted|co-administered|coadministered|concurrent|concurrently)\b"
+)
+
+class AnswerStream:
+    """Applies MedRAG's answer post-processing to a stream of text deltas.
+
+    - Leading whitespace is dropped and the LOW-evidence note is prepended unless the
+      model already started with "Note:" (decided as soon as 5 characters have arrived).
+    - The SEVERITY_SCORE tag is held back and parsed into `severity_score` instead of
+      being shown; text that might be the start of the tag (or whitespace before it) is
+      buffered until it can't be. Every tag is stripped, as in `_extract_severity`.
+    - Runs of 3+ newlines are collapsed to 2, as in `medrag_answer`.
+    """
+
+    def __init__(self, note=None, header=""):
+        self.note = note
+        self.header = header
+        self.severity_score = None
+        self._started = False
+        self._pending = ""
+        self._tail = None   # text from the whitespace before the first severity tag onwards
+        self._newlines = 0
+        self._body = False  # whether any answer text has been emitted
+
+    def start(self):
+        return self.emit(self.header)
+
+    def feed(self, delta):
+        if self._tail is not None:
+            self._tail += delta
+            return
+        self._pending += delta
+        if not self._started:
+            self._pending = self._pending.lstrip()
+            if len(self._pending) < len("Note:"):
+                return
+            yield from self._open()
+
+        tag_at = self._pending.find(SEVERITY_TAG)
+        if tag_at >= 0:
+            cut = self._space_before(tag_at)
+            self._tail = self._pending[cut:]
+            out, self._pending = self._pending[:cut], ""
+            yield from self._emit_body(out)
+            return
+
+        # Keep back a suffix that could still grow into the tag, and the whitespace before it
+        keep = 0
+        for n in range(min(len(SEVERITY_TAG) - 1, len(self._pending)), 0, -1):
+            if SEVERITY_TAG.startswith(self._pending[-n:]):
+                keep = n
+                break
+        cut = self._space_before(len(self._pending) - keep)
+        out, self._pending = self._pending[:cut], self._pending[cut:]
+        yield from self._emit_body(out)
+
+    def finish(self):
+        if not self._started:
+            yield from self._open()
+        rest = self._pending + (self._tail or "")
+        self._pending, self._tail = "", None
+        match = SEVERITY_RE.search(rest)
+        if match:
+            self.severity_score = int(match.group(1))
+            rest = SEVERITY_RE.sub("", rest)
+        yield from self._emit_body(rest.rstrip() if self._body else rest.strip())
+
+    def _space_before(self, i):
+        """Start of the whitespace run that ends at self._pending[i]."""
+        while i > 0 and self._pending[i - 1].isspace():
+            i -= 1
+        return i
+
+    def _emit_body(self, text):
+        self._body = self._body or bool(text)
+        yield from self.emit(text)
+
+    def _open(self):
+        self._started = True
+        if self.note and not self._pending.startswith("Note:"):
+            yield from self.emit(f"{self.note}\n\n")
+
+    def emit(self, text):
+        """Yields text with newline runs collapsed across delta boundaries."""
+        out = []
+        for ch in text:
+            if ch == "\n":
+                self._newlines += 1
+                if self._newlines > 2:
+                    continue
+            else:
+                self._newlines = 0
+            out.append(ch)
+        if out:
+            yield "".join(out)
+
+
 class MedRAG:
-    def __init__(self, llm_name="gemini-2.5-flash", rag=True, corpus_name="openfda", db_dir="./corpus"):
+    def __init__(self, llm_name="gemini-2.5-flash", rag=True, corpus_name="openfda", db_dir="./corpus",
+                 concept_cache_size=10000, retrieval_mode="dense", embedding_backend="torch",
+                 context_budget=3000, lazy=False, build_index=True, answer_cache_size=1024,
+                 answer_cache_threshold=0.92, answer_cache_ttl=24 * 3600, rerank=False,
+                 index_watch_interval=None, ddi_sections=DDI_SECTIONS):
+        """lazy=True defers the embedding model, the FAISS index and the Gemini client to first
+        use (see `warmup`); build_index=False refuses to build a missing index in this process.
+        answer_cache_size=0 turns off the semantic answer cache; rerank=True adds the
+        cross-encoder second stage to retrieval. index_watch_interval (s) polls for newly
+        published index snapshots and hot-swaps them in. ddi_sections are the label sections
+        an interaction question about indexed drugs is answered from (None: all sections)."""
         self.llm_name = llm_name
         self.rag = rag
+        self.ddi_sections = tuple(ddi_sections) if ddi_sections else None
         self.retrieval_system = None
         if rag:
             chunk_dir = os.path.join(db_dir, corpus_name, "chunk")
             if os.path.exists(chunk_dir):
-                self.retrieval_system = Retriever(chunk_dir=chunk_dir)
+                self.retrieval_system = Retriever(chunk_dir=chunk_dir, retrieval_mode=retrieval_mode,
+                                                  embedding_backend=embedding_backend,
+                                                  lazy=lazy, allow_build=build_index, rerank=rerank,
+                                                  watch_interval=index_watch_interval)
+
+        # Concept extraction is a full LLM round trip, so its results persist across restarts
+        self.concept_cache = None
+        if concept_cache_size:
+            cache_dir = os.path.join(db_dir, corpus_name, "cache")
+            os.makedirs(cache_dir, exist_ok=True)
+            self.concept_cache = SQLiteCache(os.path.join(cache_dir, "concepts.sqlite"), concept_cache_size)
+
+        # Answers to paraphrased questions grounded on the same chunks skip the LLM
+        self.answer_cache = None
+        if answer_cache_size and self.retrieval_system is not None:
+            self.answer_cache = SemanticAnswerCache(answer_cache_size, answer_cache_threshold, answer_cache_ttl)
+
+        # Prompt context is deduplicated and packed to this many tokens; None sends every chunk
+        self.context_packer = ContextPacker(context_budget) if context_budget else None
 
         self.templates = {
             "system": simple_medrag_system,
             "prompt": simple_medrag_prompt
         }
 
-        self.model = None
-        try:
-            import google.generativeai as genai
-            api_key = os.environ.get("GOOGLE_API_KEY")
-            if not api_key: raise RuntimeError("GOOGLE_API_KEY not set")
-            genai.configure(api_key=api_key)
-            self.model = genai.GenerativeModel(self.llm_name)
-        except Exception as e:
-            print("❌ Gemini init failed:", e)
+        self._model = None
+        self._llm_ready = False
+        self._llm_lock = threading.Lock()
+        if not lazy:
+            self._init_llm()
+
+    @property
+    def model(self):
+        if not self._llm_ready:
+            self._init_llm()
+        return self._model
+
+    @model.setter
+    def model(self, value):
+        self._model = value
+        self._llm_ready = True
+
+    def _init_llm(self):
+        with self._llm_lock:
+            if self._llm_ready:
+                return
+            self._llm_ready = True
+            if self.llm_name == "stub":
+                # Deterministic offline stand-in (evaluation, load tests)
+                self._model = StubLLM()
+                return
+            try:
+                import google.generativeai as genai
+                api_key = os.environ.get("GOOGLE_API_KEY")
+                if not api_key: raise RuntimeError("GOOGLE_API_KEY not set")
+                genai.configure(api_key=api_key)
+                self._model = genai.GenerativeModel(self.llm_name)
+            except Exception as e:
+                print("❌ Gemini init failed:", e)
+
+    def warmup(self, background=True):
+        """Loads the LLM client, the token encoding, the embedding model and the index ahead of
+        the first question. With background=True this runs on a daemon thread, which is returned."""
+        def run():
+            self._init_llm()
+            if self.context_packer is not None:
+                self.context_packer.counter.count("warmup")
+            if self.retrieval_system is not None:
+                self.retrieval_system.warmup(background=False)
+        if not background:
+            run()
+            return None
+        thread = threading.Thread(target=run, name="medrag-warmup", daemon=True)
+        thread.start()
+        return thread
 
     def generate(self, messages):
         if not self.model: raise RuntimeError("Gemini model not initialized")
         # Combine system and user prompt for Gemini
         combined_prompt = f"SYSTEM: {messages[0]['content']}\n\nUSER: {messages[1]['content']}"
+        count("llm_calls")
         response = self.model.generate_content(combined_prompt)
         return response.text if response.candidates else "No response generated."
 
+    def generate_stream(self, messages):
+        """Yields the answer text as Gemini streams it."""
+        if not self.model: raise RuntimeError("Gemini model not initialized")
+        combined_prompt = f"SYSTEM: {messages[0]['content']}\n\nUSER: {messages[1]['content']}"
+        count("llm_calls")
+        for chunk in self.model.generate_content(combined_prompt, stream=True):
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks without candidates (e.g. safety-blocked) carry no text
+                continue
+            if text:
+                yield text
+
+    async def agenerate(self, messages):
+        """Non-blocking `generate` using Gemini's async client."""
+        if not self.model: raise RuntimeError("Gemini model not initialized")
+        combined_prompt = f"SYSTEM: {messages[0]['content']}\n\nUSER: {messages[1]['content']}"
+        count("llm_calls")
+        response = await self.model.generate_content_async(combined_prompt)
+        return response.text if response.candidates else "No response generated."
+
     def _key_terms(self, text):
-        fillers = {
-        "understand", "know", "mean", "think", "explain", "tell", 
-        "describe", "give", "information", "detail", "details"
-        }
-        stopwords = {"what", "is", "are", "does", "do", "you", "by","can", "the", "a", "an", "with", "if", "when", "how", "happens", "interacts", "patient", "patients", "treatment", "use", "used", "indicated", "mg", "dose", "clinical"}
-        all_stops = fillers | stopwords
-        return {
-                w.lower() for w in re.findall(r"[a-zA-Z]+", text)
-                if w.lower() not in all_stops and len(w) > 2
-        }
+        return key_terms(text)
     
-    def _extract_medical_concepts(self, question):
-         prompt = f"""
+    def _fast_concepts(self, question):
+        """Returns the query's terms if it is made only of known drug/medical words, else None."""
+        if not self.retrieval_system:
+            return None
+        drug_terms = self.retrieval_system.drug_terms()
+        key_terms = self._key_terms(question)
+        terms = [
+            w.lower() for w in re.findall(r"[a-zA-Z]+", question)
+            if w.lower() in key_terms and w.lower() not in QUERY_GLUE
+        ]
+        if not terms or not any(w in drug_terms for w in terms):
+            return None
+        if all(w in drug_terms or w in MEDICAL_TERMS for w in terms):
+            return " ".join(dict.fromkeys(terms))
+        return None
+
+    def _concept_prompt(self, question):
+        return f"""
                    Extract only medical concepts from the query.
                    Remove intent, tone, and explanation-related words.
                    Return a comma-separated list. No explanation.
@@ -61,14 +290,52 @@ class MedRAG:
                    Query:
                    {question}
                 """
+
+    def _known_concepts(self, question):
+        """Concepts available without an LLM call (fast path or cache), else None."""
+        fast = self._fast_concepts(question)
+        if fast:
+            count("concept_fast_path")
+            return fast
+        if self.concept_cache is not None:
+            cached = self.concept_cache.get(normalize_query(question))
+            count("concept_cache_hits" if cached is not None else "concept_cache_misses")
+            return cached
+        return None
+
+    def _store_concepts(self, question, text):
+        # safety: fallback to original question if extraction fails
+        if not text:
+            return question
+        if self.concept_cache is not None:
+            self.concept_cache.put(normalize_query(question), text)
+        return text
+
+    def _extract_medical_concepts(self, question):
+         known = self._known_concepts(question)
+         if known is not None:
+           return known
          try:
-           response = self.model.generate_content(prompt)
+           count("llm_calls")
+           response = self.model.generate_content(self._concept_prompt(question))
            text = response.text.strip()
-        # safety: fallback to original question if extraction fails
-           return text if text else question
          except Exception:
            return question
+         return self._store_concepts(question, text)
 
+    async def _aextract_medical_concepts(self, question):
+         known = self._known_concepts(question)
+         if known is not None:
+           return known
+         try:
+           count("llm_calls")
+           response = await self.model.generate_content_async(self._concept_prompt(question))
+           text = response.text.strip()
+         except asyncio.CancelledError:
+           raise
+         except Exception:
+           return question
+         return self._store_concepts(question, text)
 
     def _evidence_strength(self, docs, question):
         if not docs: return "LOW"
@@ -84,60 +351,129 @@ class MedRAG:
            
         scores = [d.get("score", 0.0) for d in docs]
         avg_top_score = sum(scores[:3]) / min(len(scores), 3)
-        q_terms = self._key_terms(question)
         if not q_terms: return "LOW"
 
-        supporting_docs = 0
-        for d in docs:
-            overlap = q_terms & self._key_terms(d["content"])
-            if len(overlap) / len(q_terms) >= 0.4:
-                supporting_docs += 1
+        overlaps = self._term_overlaps(docs, q_terms)
+        supporting_docs = sum(1 for n in overlaps if n / len(q_terms) >= 0.4)
 
         if avg_top_score >= 0.70 and supporting_docs >= 3: return "HIGH"
         if avg_top_score >= 0.55 and supporting_docs >= 1: return "MEDIUM"
         return "LOW"
 
+    def _term_overlaps(self, docs, q_terms):
+        """Number of question key terms found in each doc.
+
+        Uses the key terms precomputed at index time when every doc carries its FAISS row;
+        otherwise tokenizes the doc contents.
+        """
+        if self.retrieval_system is not None and all("row" in d for d in docs):
+            counts = self.retrieval_system.term_overlaps([d["row"] for d in docs], q_terms)
+            if counts is not None:
+                return counts.tolist()
+        return [len(q_terms & self._key_terms(d["content"])) for d in docs]
+
+    def _detect_drugs(self, question, concept_query=None):
+        """Drug names mentioned in the question (and concept query), via the lexicon matcher."""
+        if not self.retrieval_system:
+            return []
+        matcher = self.retrieval_system.drug_matcher()
+        found = matcher.find(question)
+        if concept_query:
+            found += matcher.find(concept_query)
+        return list(dict.fromkeys(found))
+
     def _is_ddi_query(self, question, docs, concept_query=None):
-        intent_words = {"interact", "interaction", "interacts", "combined", "combine", "combines", "react", "reaction", "reacts", "reacted", "combination", "together", "co-administered", "concurrent", "versus", "vs"}
-        has_intent = any(w in question.lower() for w in intent_words)
+        has_intent = DDI_INTENT.search(question.lower()) is not None
         
-        # Count unique drugs mentioned in the question that appear in our retrieved titles
-        detected_drugs = set()
+        # Drugs named in the question, whether or not their labels were retrieved
+        detected_drugs = set(self._detect_drugs(question, concept_query))
         q_lower = f"{question} {concept_query}".lower() if concept_query else question.lower()
         for d in docs:
             title = d["title"].lower()
             # If the drug title (e.g. "Potassium Phosphate") is in the question
             if title in q_lower:
-                detected_drugs.add(title)
+                detected_drugs.add(normalize_name(title))
         
         return has_intent or len(detected_drugs) >= 2
     
     def _extract_severity(self, text):
         """Extracts the numeric score from the LLM response."""
-        match = re.search(r"SEVERITY_SCORE:\s*(\d+)", text)
+        match = SEVERITY_RE.search(text)
         if match:
             score = int(match.group(1))
             # Clean the tag out of the final text so the user doesn't see raw code
-            clean_text = re.sub(r"SEVERITY_SCORE:\s*\d+", "", text).strip()
+            clean_text = SEVERITY_RE.sub("", text).strip()
             return clean_text, score
         return text, None
 
-    def medrag_answer(self, question, k=5):
-        context_text = ""
-        evidence = "LOW"
-        docs = []
+    def _retrieve(self, question, k, concept_query):
+        """Dense retrieval for the concept query. When two or more indexed drugs are named,
+        the search is restricted to those drugs' chunks so every label lands in the prompt.
+        An interaction question only searches those drugs' interaction sections."""
+        filters = self._drug_filters(question, concept_query)
+        if filters:
+            return self.retrieval_system.get_relevant_documents(
+                concept_query, max(k, len(filters["drugs"])), **filters)
+        return self.retrieval_system.get_relevant_documents(concept_query, self._search_k(question, k))
 
-        concept_query = question
-        if self.retrieval_system and k > 0:
-            # Increase K slightly for DDI to get both drug labels
-            ddi_keywords = ["interact", "combine", "interacts", "combines", "combined","reacts", "react"]
-            search_k = k + 3 if any(kw in question.lower() for kw in ddi_keywords) else k
-            concept_query = self._extract_medical_concepts(question)
-            docs = self.retrieval_system.get_relevant_documents(concept_query, search_k)
-            context_text = "\n".join(f"SOURCE [{d['title']}]: {d['content']}" for d in docs)
-            evidence = self._evidence_strength(docs, concept_query)
+    def _drug_filters(self, question, concept_query):
+        """Search filters (drugs, sections) for a question naming indexed drugs, or None."""
+        drugs = self._indexed_drugs(question, concept_query)
+        if not drugs:
+            return None
+        # Same test as the answer's DDI mode, minus the retrieved titles
+        ddi = self._is_ddi_query(question, [], concept_query)
+        if len(drugs) < 2 and not (ddi and self.ddi_sections):
+            return None
+        return {"drugs": drugs, "sections": self.ddi_sections if ddi else None}
 
-        ddi_mode = self._is_ddi_query(question, docs, concept_query)
+    def _indexed_drugs(self, question, concept_query=None):
+        return [d for d in self._detect_drugs(question, concept_query)
+                if len(self.retrieval_system.drug_rows(d))]
+
+    def _cached_answer(self, question, k, retrieve=None):
+        """(answer, key): the cached answer of a similar question that retrieves the same chunks
+        (or None), and the key to store this question's answer under (None if uncacheable).
+        retrieve(question, k, concept_query) must be the retrieval the pipeline itself runs."""
+        if self.answer_cache is None or k <= 0:
+            return None, None
+        retrieve = retrieve or self._retrieve
+        # The version must be the one of the index this answer will be grounded on
+        self.retrieval_system._ready()
+        q_emb = self.retrieval_system.encode_query(question)
+        key = (q_emb, self.retrieval_system.index_version)
+        answer, _, _ = self.answer_cache.get(*key, lambda cq: retrieve(question, k, cq))
+        count("answer_cache_hits" if answer is not None else "answer_cache_misses")
+        return answer, key
+
+    def _cache_answer(self, key, concept_query, docs, answer):
+        if key is not None and docs:
+            q_emb, version = key
+            self.answer_cache.put(q_emb, concept_query, docs, answer, version)
+
+    def _search_k(self, question, k):
+        # Increase K slightly for DDI to get both drug labels
+        ddi_keywords = ["interact", "combine", "interacts", "combines", "combined","reacts", "react"]
+        return k + 3 if any(kw in question.lower() for kw in ddi_keywords) else k
+
+    def _pack_context(self, docs):
+        """Drops near-duplicate chunks and fits the rest to the token budget, logging what was cut."""
+        if self.context_packer is None or not docs:
+            return docs
+        with span("context"):
+            packed, report = self.context_packer.pack(docs)
+        count("context_tokens", report["tokens"])
+        count("context_chunks_dropped", len(report["duplicates"]) + len(report["over_budget"]))
+        if report["duplicates"] or report["over_budget"] or report["truncated"]:
+            logger.info(
+                "context: %d/%d chunks, %d/%d tokens; duplicates=%s over_budget=%s truncated=%s",
+                len(packed), report["retrieved"], report["tokens"], report["budget"],
+                report["duplicates"], report["over_budget"], report["truncated"]
+            )
+        return packed
+
+    def _build_messages(self, question, docs, evidence, ddi_mode):
+        context_text = "\n".join(format_source(d) for d in self._pack_context(docs))
 
         if ddi_mode:
             # Override system prompt for DDI to ensure structure
@@ -155,23 +491,15 @@ class MedRAG:
                 evidence_level=evidence # Pass evidence level to template
             )
 
-        messages = [{"role": "system", "content": sys_msg}, {"role": "user", "content": prompt}]
-        ans = self.generate(messages).strip()
+        return [{"role": "system", "content": sys_msg}, {"role": "user", "content": prompt}]
 
-        ans, severity_score = self._extract_severity(ans)
+    def _format_answer(self, ans, evidence, ddi_mode):
+        ans, severity_score = self._extract_severity(ans.strip())
 
         if evidence == "LOW" and not ans.startswith("Note:"):
-           ans = f"Note: The following information is based on general medical knowledge as it is not fully detailed in the provided corpus.\n\n{ans}"
+           ans = f"{LOW_EVIDENCE_NOTE}\n\n{ans}"
         
-        severity_display = ""
-        if severity_score is not None:
-            # Assign a visual label based on the score
-            if severity_score >= 8:
-                severity_display = f"🚨 **Severity Score: {severity_score}/10 (High Risk)**"
-            elif severity_score >= 4:
-                severity_display = f"⚠️ **Severity Score: {severity_score}/10 (Moderate Risk)**"
-            else:
-                severity_display = f"✅ **Severity Score: {severity_score}/10 (Low Risk)**"
+        severity_display = self._severity_display(severity_score)
 
         # Final Formatting for Clinical Look
         if ddi_mode:
@@ -180,5 +508,181 @@ class MedRAG:
                 header += f"{severity_display}\n\n"
             ans = f"{header}{ans}"
         
-        ans += f"\n\n---\n**Evidence Strength:** {evidence} | **Analysis Mode:** {'Drug-Drug Interaction' if ddi_mode else 'General Clinical'}"
+        ans += self._footer(evidence, ddi_mode)
         return re.sub(r"\n{3,}", "\n\n", ans).strip()
+
+    def _severity_display(self, severity_score):
+        if severity_score is None:
+            return ""
+        # Assign a visual label based on the score
+        if severity_score >= 8:
+            return f"🚨 **Severity Score: {severity_score}/10 (High Risk)**"
+        elif severity_score >= 4:
+            return f"⚠️ **Severity Score: {severity_score}/10 (Moderate Risk)**"
+        else:
+            return f"✅ **Severity Score: {severity_score}/10 (Low Risk)**"
+
+    def _footer(self, evidence, ddi_mode):
+        return f"\n\n---\n**Evidence Strength:** {evidence} | **Analysis Mode:** {'Drug-Drug Interaction' if ddi_mode else 'General Clinical'}"
+
+    def medrag_answer(self, question, k=5):
+        with request("medrag_answer"):
+            return self._medrag_answer(question, k)
+
+    def _medrag_answer(self, question, k):
+        cached, key = self._cached_answer(question, k)
+        if cached is not None:
+            return cached
+
+        evidence = "LOW"
+        docs = []
+
+        concept_query = question
+        if self.retrieval_system and k > 0:
+            with span("concepts"):
+                concept_query = self._extract_medical_concepts(question)
+            docs = self._retrieve(question, k, concept_query)
+            with span("evidence"):
+                evidence = self._evidence_strength(docs, concept_query)
+
+        ddi_mode = self._is_ddi_query(question, docs, concept_query)
+
+        messages = self._build_messages(question, docs, evidence, ddi_mode)
+        with span("generate"):
+            ans = self.generate(messages)
+        answer = self._format_answer(ans, evidence, ddi_mode)
+        self._cache_answer(key, concept_query, docs, answer)
+        return answer
+
+    # -----------------------------
+    # Streaming pipeline
+    # -----------------------------
+    def medrag_stream(self, question, k=5):
+        """Generator of text deltas for the same answer `medrag_answer` builds.
+
+        Retrieval runs before the first yield. The DDI header and, for LOW evidence, the
+        "Note:" disclaimer are sent up front; the severity score only exists once the model
+        has finished, so in streaming mode it is shown after the report instead of in the header.
+        """
+        with request("medrag_stream"):
+            yield from self._medrag_stream(question, k)
+
+    def _medrag_stream(self, question, k):
+        cached, _ = self._cached_answer(question, k)
+        if cached is not None:
+            yield cached
+            return
+
+        evidence = "LOW"
+        docs = []
+
+        concept_query = question
+        if self.retrieval_system and k > 0:
+            with span("concepts"):
+                concept_query = self._extract_medical_concepts(question)
+            docs = self._retrieve(question, k, concept_query)
+            with span("evidence"):
+                evidence = self._evidence_strength(docs, concept_query)
+
+        ddi_mode = self._is_ddi_query(question, docs, concept_query)
+
+        messages = self._build_messages(question, docs, evidence, ddi_mode)
+        stream = AnswerStream(
+            note=LOW_EVIDENCE_NOTE if evidence == "LOW" else None,
+            header="## CLINICAL INTERACTION REPORT\n\n" if ddi_mode else ""
+        )
+        # Not cached: the streamed layout (severity after the report) differs from
+        # medrag_answer's, and both pipelines read the same answer cache
+        yield from self._stream_answer(stream, messages, evidence, ddi_mode)
+
+    def _stream_answer(self, stream, messages, evidence, ddi_mode):
+        yield from stream.start()
+        deltas = self.generate_stream(messages)
+        while True:
+            # Only time spent waiting on the model, not on the consumer of this generator
+            with span("generate"):
+                delta = next(deltas, None)
+            if delta is None:
+                break
+            yield from stream.feed(delta)
+        yield from stream.finish()
+
+        tail = ""
+        severity_display = self._severity_display(stream.severity_score)
+        if ddi_mode and severity_display:
+            tail += f"\n\n{severity_display}"
+        tail += self._footer(evidence, ddi_mode)
+        yield from stream.emit(tail)
+
+    # -----------------------------
+    # Async pipeline
+    # -----------------------------
+    async def _aretrieve(self, question, k):
+        """Retrieves for the raw question while concept extraction is in flight, then merges
+        in the concept-query hits. Both legs share the Retriever's result cache."""
+        search_k = self._search_k(question, k)
+        retrieve = self.retrieval_system.get_relevant_documents
+        raw_task = asyncio.create_task(asyncio.to_thread(retrieve, question, search_k))
+        try:
+            with span("concepts"):
+                concept_query = await self._aextract_medical_concepts(question)
+            raw_docs = None if self._drug_filters(question, concept_query) else await raw_task
+        finally:
+            raw_task.cancel()
+        docs = await asyncio.to_thread(self._retrieve_merged, question, k, concept_query, raw_docs)
+        return docs, concept_query
+
+    def _merge_docs(self, concept_docs, raw_docs, search_k):
+        merged = {}
+        for d in concept_docs + raw_docs:
+            key = (d["title"], d["content"])
+            if key not in merged or rank_score(d) > rank_score(merged[key]):
+                merged[key] = d
+        return sorted(merged.values(), key=rank_score, reverse=True)[:search_k]
+
+    def _retrieve_merged(self, question, k, concept_query, raw_docs=None):
+        """What `_aretrieve` returns once the concept query is known (also answer cache lookups).
+        raw_docs are the raw question's results if already fetched."""
+        # Drug-filtered results already cover every named drug; don't let raw hits displace them
+        if self._drug_filters(question, concept_query):
+            return self._retrieve(question, k, concept_query)
+        search_k = self._search_k(question, k)
+        if raw_docs is None:
+            raw_docs = self.retrieval_system.get_relevant_documents(question, search_k)
+        if normalize_query(concept_query) == normalize_query(question):
+            return raw_docs
+        concept_docs = self._retrieve(question, k, concept_query)
+        return self._merge_docs(concept_docs, raw_docs, search_k)
+
+    async def _amedrag_answer(self, question, k):
+        cached, key = None, None
+        if self.answer_cache is not None:
+            cached, key = await asyncio.to_thread(self._cached_answer, question, k, self._retrieve_merged)
+        if cached is not None:
+            return cached
+
+        evidence = "LOW"
+        docs = []
+
+        concept_query = question
+        if self.retrieval_system and k > 0:
+            docs, concept_query = await self._aretrieve(question, k)
+            with span("evidence"):
+                evidence = self._evidence_strength(docs, concept_query)
+
+        ddi_mode = self._is_ddi_query(question, docs, concept_query)
+
+        messages = self._build_messages(question, docs, evidence, ddi_mode)
+        with span("generate"):
+            ans = await self.agenerate(messages)
+        answer = self._format_answer(ans, evidence, ddi_mode)
+        self._cache_answer(key, concept_query, docs, answer)
+        return answer
+
+    async def amedrag_answer(self, question, k=5, timeout=None):
+        """Async `medrag_answer`. Cancelling the awaiting task cancels the in-flight LLM calls;
+        `timeout` (seconds) raises asyncio.TimeoutError if the whole pipeline runs over."""
+        with request("amedrag_answer"):
+            if timeout is None:
+                return await self._amedrag_answer(question, k)
+            return await asyncio.wait_for(self._amedrag_answer(question, k), timeout)
@@ -1,7 +1,11 @@
 import os
 import json
+import time
+import hashlib
+import argparse
 import regex as re
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
 # -----------------------------
@@ -19,43 +23,407 @@ def concat(title: str, content: str) -> str:
     else:
         return f"{title}. {content}"
 
+# -----------------------------
+# Streaming JSON reader
+# -----------------------------
+_WS = re.compile(r"\s*")
+
+class _JsonStream:
+    """Decodes JSON values one at a time from a file using a small rolling buffer."""
+
+    def __init__(self, f, read_size=1 << 20):
+        self.f = f
+        self.read_size = read_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        if self.eof:
+            return False
+        data = self.f.read(self.read_size)
+        if not data:
+            self.eof = True
+            return False
+        # Drop everything already consumed so the buffer never grows past one record
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Returns the next non-whitespace character without consuming it."""
+        while True:
+            self.pos = _WS.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON input")
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at offset {self.pos}, got {self.buf[self.pos]!r}")
+        self.pos += 1
+
+    def value(self):
+        """Decodes the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)
+                # A number at the buffer edge may still be incomplete
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            if not self._fill():
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)
+                self.pos = end
+                return obj
+
+
+def iter_drug_records(file_path):
+    """Yields each entry of the top-level `results` array without loading the whole file."""
+    with open(file_path, "r", encoding="utf-8") as f:
+        stream = _JsonStream(f)
+        stream.expect("{")
+        if stream.peek() == "}":
+            return
+        while True:
+            key = stream.value()
+            stream.expect(":")
+            if key == "results" and stream.peek() == "[":
+                stream.expect("[")
+                if stream.peek() != "]":
+                    while True:
+                        yield stream.value()
+                        if stream.peek() == "]":
+                            break
+                        stream.expect(",")
+                stream.expect("]")
+            else:
+                # "meta" and any other small top-level fields are skipped
+                stream.value()
+            if stream.peek() == "}":
+                return
+            stream.expect(",")
+
+# -----------------------------
+# Record processing
+# -----------------------------
+# Label fields that make up the corpus: OpenFDA field name -> marker shown in the chunk text.
+# The field name is also each chunk's "section", which searches can filter on.
+SECTIONS = {
+    "indications_and_usage": "Indications",
+    "dosage_and_administration": "Dosage",
+    "warnings": "Warnings",
+    "adverse_reactions": "Adverse Reactions",
+    "drug_interactions": "Drug Interactions"
+}
+
+def process_record(rec, doc_id):
+    """Extracts title and section text from one OpenFDA label. Returns None if empty."""
+    openfda = rec.get("openfda", {})
+    generic = openfda.get("generic_name", [None])[0]
+    brand = openfda.get("brand_name", [None])[0]
+    title = generic if generic else (brand if brand else "Unknown Medication")
+    # Every name the label can be referred to by, for the drug lexicon
+    drugs = sorted({
+        name.strip()
+        for field in ("generic_name", "brand_name", "substance_name")
+        for name in openfda.get(field, [])
+        if name and name.strip()
+    })
+    brands = sorted({name.strip() for name in openfda.get("brand_name", []) if name and name.strip()})
+
+    # (section key, "[Marker]: text") in label order; each section is chunked on its own
+    sections = []
+    for key, section_name in SECTIONS.items():
+        clean_section = re.sub(r"\s+", " ", " ".join(rec.get(key, []))).strip()
+        if clean_section:
+            sections.append((key, f"[{section_name}]: {clean_section}"))
+
+    if not sections:
+        return None
+    return {
+        "id": str(doc_id),
+        "title": title,
+        "drugs": drugs,
+        "brands": brands,
+        "set_id": rec.get("set_id") or rec.get("id") or str(doc_id),
+        "sections": sections,
+        "text": " ".join(text for _, text in sections)
+    }
+
+def iter_drug_data(file_path, id_prefix=""):
+    """Streaming version of `load_drug_data`: yields processed docs one at a time."""
+    for i, rec in enumerate(iter_drug_records(file_path)):
+        doc = process_record(rec, f"{id_prefix}{i}")
+        if doc:
+            yield doc
+
 def load_drug_data(file_path):
     """Loads OpenFDA JSON and extracts relevant medical fields."""
-    with open(file_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    
-    processed_docs = []
-    for i, rec in enumerate(data.get("results", [])):
-        openfda = rec.get("openfda", {})
-        generic = openfda.get("generic_name", [None])[0]
-        brand = openfda.get("brand_name", [None])[0]
-        title = generic if generic else (brand if brand else "Unknown Medication")
-
-        sections = {
-            "Indications": rec.get("indications_and_usage", []),
-            "Dosage": rec.get("dosage_and_administration", []),
-            "Warnings": rec.get("warnings", []),
-            "Adverse Reactions": rec.get("adverse_reactions", []),
-            "Drug Interactions": rec.get("drug_interactions", [])
+    return list(iter_drug_data(file_path))
+
+def chunk_doc(doc, text_splitter):
+    """Splits one processed doc into corpus chunk records, one section at a time, so no
+    chunk spans two sections. Continuation chunks repeat the section marker."""
+    j = 0
+    for section, text in doc['sections']:
+        marker = text[:text.index("]: ") + 3]
+        for chunk in text_splitter.split_text(text):
+            clean_chunk = re.sub(r"\s+", " ", chunk)
+            if not clean_chunk.startswith(marker):
+                clean_chunk = marker + clean_chunk
+            yield {
+                "id": f"{doc['id']}_{j}",
+                "title": doc['title'],
+                "content": clean_chunk,
+                "contents": concat(doc['title'], clean_chunk),
+                "section": section,
+                "set_id": doc.get('set_id'),
+                "drugs": doc.get('drugs', []),
+                "set_ids": [doc['set_id']] if doc.get('set_id') else [],
+                "brands": doc.get('brands', [])
+            }
+            j += 1
+
+def write_chunks(docs, output_file, text_splitter, lexicon=None, fingerprints=None):
+    """Chunks docs as they arrive and appends each chunk to a JSONL file.
+
+    Returns (records, chunks) written. Only one record is held in memory at a time.
+    If `lexicon` is a set, every drug name seen is added to it.
+    If `fingerprints` is a list, a (doc id, label key, chunk count) tuple is appended per record.
+    """
+    n_docs = n_chunks = 0
+    tmp_file = f"{output_file}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        for doc in docs:
+            n_docs += 1
+            if lexicon is not None:
+                lexicon.update(doc.get('drugs', []))
+            n_doc_chunks = 0
+            for chunk in chunk_doc(doc, text_splitter):
+                # ensure_ascii=False handles special medical symbols better
+                f.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+                n_doc_chunks += 1
+            n_chunks += n_doc_chunks
+            if fingerprints is not None:
+                fingerprints.append((doc['id'], label_key(doc), n_doc_chunks))
+    os.replace(tmp_file, output_file)
+    return n_docs, n_chunks
+
+# -----------------------------
+# Near-duplicate labels
+# -----------------------------
+def label_key(doc):
+    """Duplicate key of a label: its title plus the section text with the label's own
+    drug names masked, lowercased, and reduced to words. Repackager copies of the same
+    label differ only in brand name, punctuation and whitespace, so they share a key."""
+    text = doc['text'].lower()
+    for name in sorted(doc.get('drugs', []), key=len, reverse=True):
+        text = text.replace(name.lower(), " ")
+    text = " ".join(re.findall(r"\w+", text))
+    key = f"{doc['title'].lower()}\x00{text}".encode("utf-8")
+    return hashlib.blake2b(key, digest_size=16).hexdigest()
+
+def plan_dedup(stats):
+    """Groups records by label key across all shards, in shard order.
+
+    The first record of each group is canonical. Returns (drop, canonical) where drop is the
+    set of duplicate doc ids and canonical maps each canonical doc id to its duplicates.
+    """
+    groups = {}
+    for s in stats:
+        for doc_id, key, _ in s["fingerprints"]:
+            groups.setdefault(key, []).append(doc_id)
+    drop, canonical = set(), {}
+    for ids in groups.values():
+        if len(ids) > 1:
+            canonical[ids[0]] = ids[1:]
+            drop.update(ids[1:])
+    return drop, canonical
+
+def dedup_shard(chunk_file, drop, merged):
+    """Rewrites one chunk file without the chunks of duplicate labels.
+
+    `merged` maps a canonical doc id to {"set_ids", "brands", "drugs"} of its whole group,
+    which replace the fields on that doc's chunks. Returns (chunks before, chunks after).
+    """
+    n_in = n_out = 0
+    tmp_file = f"{chunk_file}.tmp"
+    with open(chunk_file, 'r', encoding='utf-8') as src, open(tmp_file, 'w', encoding='utf-8') as dst:
+        for line in src:
+            if not line.strip():
+                continue
+            n_in += 1
+            chunk = json.loads(line)
+            doc_id = chunk["id"].rsplit("_", 1)[0]
+            if doc_id in drop:
+                continue
+            if doc_id in merged:
+                chunk.update(merged[doc_id])
+            dst.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+            n_out += 1
+    os.replace(tmp_file, chunk_file)
+    return n_in, n_out
+
+def collect_group_fields(chunk_file, doc_ids):
+    """set_ids / brands / drugs of the given docs, read from the first chunk of each."""
+    fields = {}
+    with open(chunk_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            chunk = json.loads(line)
+            doc_id = chunk["id"].rsplit("_", 1)[0]
+            if doc_id in doc_ids and doc_id not in fields:
+                fields[doc_id] = {k: chunk.get(k, []) for k in ("set_ids", "brands", "drugs")}
+    return fields
+
+# -----------------------------
+# Multi-shard corpus build
+# -----------------------------
+SHARD_PATTERN = "drug-label-*-of-*.json"
+
+def find_shards(data_dir):
+    """Returns every OpenFDA drug-label shard under data_dir, in shard order."""
+    return sorted(Path(data_dir).glob(SHARD_PATTERN))
+
+def shard_tag(file_path):
+    """`drug-label-0001-of-0013.json` -> `0001`. Used to keep chunk IDs unique across shards."""
+    match = re.match(r"drug-label-(\d+)-of-\d+", Path(file_path).name)
+    return match.group(1) if match else Path(file_path).stem
+
+def build_shard(input_file, chunk_dir, chunk_size=500, chunk_overlap=50):
+    """Streams one shard into `<chunk_dir>/<shard name>.jsonl`. Runs inside a worker process."""
+    input_file = Path(input_file)
+    output_file = Path(chunk_dir) / f"{input_file.stem}.jsonl"
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+    start = time.perf_counter()
+    docs = iter_drug_data(input_file, id_prefix=f"{shard_tag(input_file)}-")
+    lexicon = set()
+    fingerprints = []
+    n_docs, n_chunks = write_chunks(docs, output_file, text_splitter, lexicon, fingerprints)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "shard": input_file.name,
+        "output": str(output_file),
+        "records": n_docs,
+        "chunks": n_chunks,
+        "seconds": elapsed,
+        "records_per_s": n_docs / elapsed if elapsed > 0 else 0.0,
+        "drugs": sorted(lexicon),
+        "fingerprints": fingerprints
+    }
+
+def build_corpus(data_dir, chunk_dir, workers=None, chunk_size=500, chunk_overlap=50, dedup=True):
+    """Chunks every shard in data_dir across a process pool. Returns per-shard stats.
+
+    With dedup, repackager copies of a label are collapsed into one canonical label
+    afterwards (see `dedup_corpus`).
+    """
+    shards = find_shards(data_dir)
+    if not shards:
+        raise FileNotFoundError(f"No {SHARD_PATTERN} files found in {data_dir}")
+    Path(chunk_dir).mkdir(parents=True, exist_ok=True)
+
+    workers = min(workers or os.cpu_count() or 1, len(shards))
+    stats = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(build_shard, shard, chunk_dir, chunk_size, chunk_overlap)
+            for shard in shards
+        ]
+        for future in as_completed(futures):
+            s = future.result()
+            print(f"  {s['shard']}: {s['records']} records, {s['chunks']} chunks "
+                  f"in {s['seconds']:.1f}s ({s['records_per_s']:.1f} records/s)")
+            stats.append(s)
+        stats.sort(key=lambda s: s["shard"])
+        write_lexicon(Path(chunk_dir).parent / "lexicon.json", (name for s in stats for name in s.pop("drugs")))
+        if dedup:
+            dedup_corpus(stats, pool)
+    write_chunking(Path(chunk_dir).parent / "chunking.json", chunk_size, chunk_overlap, dedup)
+    for s in stats:
+        s.pop("fingerprints")
+    return stats
+
+def dedup_corpus(stats, pool):
+    """Drops the chunks of duplicate labels from every shard's chunk file and gives each
+    canonical label's chunks the set_ids, brand names and drug names of its whole group.
+    Updates the per-shard stats in place and prints how much the corpus shrank."""
+    drop, canonical = plan_dedup(stats)
+    n_records = sum(s["records"] for s in stats)
+    n_chunks = sum(s["chunks"] for s in stats)
+    if not drop:
+        print(f"  Dedup: no duplicate labels among {n_records} records")
+        return
+
+    # Shard tags prefix the doc ids, so each worker only sees its own shard's ids
+    shard_of = {s["shard"]: shard_tag(s["shard"]) + "-" for s in stats}
+    def ids_for(s, ids):
+        return {i for i in ids if i.startswith(shard_of[s["shard"]])}
+
+    group_ids = set(canonical) | drop
+    fields = {}
+    for part in pool.map(collect_group_fields,
+                         [s["output"] for s in stats], [ids_for(s, group_ids) for s in stats]):
+        fields.update(part)
+
+    merged = {}
+    for doc_id, dups in canonical.items():
+        group = [fields[i] for i in [doc_id] + dups if i in fields]
+        merged[doc_id] = {
+            k: sorted({v for f in group for v in f[k]}) if k != "set_ids"
+            else list(dict.fromkeys(v for f in group for v in f[k]))
+            for k in ("set_ids", "brands", "drugs")
         }
 
-        full_text_list = []
-        for section_name, content in sections.items():
-            if content:
-                clean_section = " ".join(content)
-                full_text_list.append(f"[{section_name}]: {clean_section}")
+    results = pool.map(
+        dedup_shard,
+        [s["output"] for s in stats],
+        [ids_for(s, drop) for s in stats],
+        [{i: m for i, m in merged.items() if i.startswith(shard_of[s["shard"]])} for s in stats],
+    )
+    for s, (_, n_out) in zip(stats, results):
+        s["duplicates"] = len(ids_for(s, drop))
+        s["records"] -= s["duplicates"]
+        s["chunks"] = n_out
+
+    kept_chunks = sum(s["chunks"] for s in stats)
+    largest = max(len(d) + 1 for d in canonical.values())
+    print(f"  Dedup: {n_records} -> {n_records - len(drop)} records "
+          f"({len(drop) / n_records:.1%} fewer), {n_chunks} -> {kept_chunks} chunks "
+          f"({(n_chunks - kept_chunks) / max(n_chunks, 1):.1%} fewer); "
+          f"{len(canonical)} duplicate groups, largest {largest} labels")
 
-        combined_text = " ".join(full_text_list)
-        combined_text = re.sub(r"\s+", " ", combined_text).strip()
+def write_lexicon(path, names):
+    """Writes the sorted set of drug names (generic, brand and substance) seen during ingestion."""
+    names = sorted(set(names))
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(names, f, ensure_ascii=False, indent=0)
+    os.replace(f"{path}.tmp", path)
+    print(f"  Drug lexicon: {len(names)} names -> {path}")
 
-        if combined_text:
-            processed_docs.append({
-                "id": str(i),
-                "title": title,
-                "text": combined_text
-            })
-    
-    return processed_docs
+def write_chunking(path, chunk_size, chunk_overlap, dedup):
+    """Records how the chunks were made; index snapshots copy it into their manifest."""
+    params = {
+        "splitter": "RecursiveCharacterTextSplitter",
+        "per_section": True,
+        "sections": list(SECTIONS),
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "dedup": dedup
+    }
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(params, f, indent=2)
+    os.replace(f"{path}.tmp", path)
 
 # -----------------------------
 # Main Execution
@@ -64,38 +432,28 @@ if __name__ == "__main__":
     # --- PATH SETUP ---
     SCRIPT_DIR = Path(__file__).resolve().parent
     PROJECT_ROOT = SCRIPT_DIR.parent 
-    
-    INPUT_FILE = PROJECT_ROOT / "data" / "drug-label-0001-of-0013.json"
-    chunk_dir = PROJECT_ROOT / "corpus" / "openfda" / "chunk"
-    
-    if not INPUT_FILE.exists():
-        print(f"❌ Could not find data file at: {INPUT_FILE}")
-        exit(1)
-
-    print(f"📂 Loading data from: {INPUT_FILE.name}...")
-    mini_corpus = load_drug_data(INPUT_FILE)
 
-    # FIXED: Using the variable you already defined
-    chunk_dir.mkdir(parents=True, exist_ok=True)
+    parser = argparse.ArgumentParser(description="Build the chunked OpenFDA corpus from all label shards.")
+    parser.add_argument("--data-dir", default=PROJECT_ROOT / "data", type=Path)
+    parser.add_argument("--chunk-dir", default=PROJECT_ROOT / "corpus" / "openfda" / "chunk", type=Path)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per CPU)")
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--chunk-overlap", type=int, default=50)
+    parser.add_argument("--no-dedup", action="store_true", help="Keep repackager copies of identical labels")
+    args = parser.parse_args()
 
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-    saved_text = []
-
-    print(f"✂️  Chunking {len(mini_corpus)} drug records...")
-
-    for doc in mini_corpus:
-        chunks = text_splitter.split_text(doc['text'])
-        for j, chunk in enumerate(chunks):
-            clean_chunk = re.sub(r"\s+", " ", chunk)
-            saved_text.append(json.dumps({
-                "id": f"{doc['id']}_{j}",
-                "title": doc['title'],
-                "content": clean_chunk,
-                "contents": concat(doc['title'], clean_chunk)
-            }, ensure_ascii=False)) # ensure_ascii=False handles special medical symbols better
+    shards = find_shards(args.data_dir)
+    if not shards:
+        print(f"❌ Could not find any {SHARD_PATTERN} files in: {args.data_dir}")
+        exit(1)
 
-    output_file = chunk_dir / "clean_openfda.jsonl"
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(saved_text))
+    print(f"📂 Building corpus from {len(shards)} shard(s) in: {args.data_dir}...")
+    start = time.perf_counter()
+    stats = build_corpus(args.data_dir, args.chunk_dir, args.workers, args.chunk_size, args.chunk_overlap,
+                         dedup=not args.no_dedup)
+    elapsed = time.perf_counter() - start
 
-    print(f"✅ Curated drug corpus generated: {output_file}")
+    total_docs = sum(s["records"] for s in stats)
+    total_chunks = sum(s["chunks"] for s in stats)
+    print(f"✅ Curated drug corpus generated in {args.chunk_dir}: {total_docs} records, "
+          f"{total_chunks} chunks in {elapsed:.1f}s ({total_docs / max(elapsed, 1e-9):.1f} records/s)")
@@ -0,0 +1,100 @@
+import threading
+import numpy as np
+from .cache import LRUCache, normalize_query
+from .trace import span, count
+
+RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L6-v2"
+
+
+def rank_score(doc):
+    """Ordering score of a retrieved doc: the cross-encoder score when it was reranked,
+    else the dense cosine. "score" itself always stays the cosine (evidence thresholds)."""
+    return doc.get("rerank_score", doc.get("score", 0.0))
+
+
+def adaptive_cut(scores, max_k, min_k=1, threshold=None, gap=None):
+    """How many of the descending `scores` to keep: at most max_k, at least min_k, stopping
+    at the first score below `threshold` or the first drop larger than `gap`."""
+    n = min(max_k, len(scores))
+    for i in range(min(min_k, n), n):
+        if threshold is not None and scores[i] < threshold:
+            return i
+        if gap is not None and scores[i - 1] - scores[i] > gap:
+            return i
+    return n
+
+
+# -----------------------------
+# Cross-encoder reranker
+# -----------------------------
+class CrossEncoderReranker:
+    """Second retrieval stage: scores (question, chunk) pairs with a small cross-encoder on CPU.
+
+    Scores are sigmoid relevance probabilities in [0, 1]. All uncached pairs of a query are
+    scored in one batched predict; scores are cached per (normalized question, chunk id),
+    so a repeated question costs no inference.
+    """
+
+    def __init__(self, model_name=RERANK_MODEL, batch_size=32, max_length=256, threads=None,
+                 cache_size=16384):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.threads = threads
+        self.cache = LRUCache(cache_size)
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        # torch + the cross-encoder are only loaded on the first rerank (or warmup)
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    import torch
+                    from sentence_transformers import CrossEncoder
+                    if self.threads:
+                        torch.set_num_threads(self.threads)
+                    self._model = CrossEncoder(self.model_name, max_length=self.max_length, device="cpu",
+                                               activation_fn=torch.nn.Sigmoid())
+        return self._model
+
+    def warmup(self):
+        self.score("warmup", [{"id": None, "title": "warmup", "content": "warmup"}])
+        self.cache.clear()
+
+    def score(self, question, docs):
+        """Relevance score per doc, in order."""
+        q = normalize_query(question)
+        scores = [self.cache.get((q, d["id"])) for d in docs]
+        missing = [i for i, s in enumerate(scores) if s is None]
+        count("rerank_cache_hits", len(docs) - len(missing))
+        if missing:
+            pairs = [(question, f"{docs[i]['title']}. {docs[i]['content']}") for i in missing]
+            with span("rerank"):
+                predicted = self.model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False,
+                                               convert_to_numpy=True)
+            count("rerank_pairs", len(missing))
+            for i, s in zip(missing, np.asarray(predicted, dtype=np.float32).reshape(-1)):
+                scores[i] = float(s)
+                self.cache.put((q, docs[i]["id"]), float(s))
+        return scores
+
+    def rerank(self, question, docs, k, min_k=1, threshold=None, gap=None, keep=()):
+        """`docs` ordered by cross-encoder score (as "rerank_score") and cut adaptively.
+        Docs whose ids are in `keep` survive the cut (e.g. one chunk per requested drug)."""
+        if not docs:
+            return []
+        scores = self.score(question, docs)
+        ranked = sorted((dict(d, rerank_score=s) for d, s in zip(docs, scores)),
+                        key=lambda d: d["rerank_score"], reverse=True)
+        n = adaptive_cut([d["rerank_score"] for d in ranked], k, min_k, threshold, gap)
+        kept = ranked[:n] + [d for d in ranked[n:] if d["id"] in keep]
+        count("rerank_cut", len(docs) - len(kept))
+        return kept
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        return self.cache.stats()
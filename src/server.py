@@ -0,0 +1,289 @@
+import json
+import time
+import asyncio
+from .trace import request, add_exporter, remove_exporter, PrometheusExporter
+
+# Largest k a client may ask for; FAISS allocates k results per query up front
+MAX_K = 100
+
+
+# -----------------------------
+# Bounded worker pools
+# -----------------------------
+class Overloaded(Exception):
+    """The pool's queue is full; the request is shed with a 429."""
+
+
+class DeadlineExceeded(Exception):
+    """The request ran out of time, either queued or while running."""
+
+
+class WorkerPool:
+    """`workers` tasks serving a queue of at most `max_queue` waiting jobs.
+
+    submit() never blocks on a full queue: it raises Overloaded so the caller can shed
+    load. Jobs whose deadline passed while queued are dropped without running, and a
+    running job is cancelled when its deadline passes.
+    """
+
+    def __init__(self, name, workers=4, max_queue=64):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self.queue = None
+        self.tasks = []
+        self.busy = 0
+        self.stats = {"completed": 0, "failed": 0, "shed": 0, "expired": 0}
+
+    def start(self):
+        self.queue = asyncio.Queue(self.max_queue)
+        self.tasks = [asyncio.create_task(self._work(), name=f"{self.name}-{i}") for i in range(self.workers)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def submit(self, fn, deadline):
+        """Runs `await fn()` on a worker before `deadline` (loop time). Returns its result."""
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((fn, deadline, future))
+        except asyncio.QueueFull:
+            self.stats["shed"] += 1
+            raise Overloaded(self.name)
+        remaining = deadline - asyncio.get_running_loop().time()
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), max(remaining, 0))
+        except asyncio.TimeoutError:
+            future.cancel()
+            raise DeadlineExceeded(self.name)
+        except asyncio.CancelledError:
+            # Client went away: drop the job (or stop the work) rather than finish it
+            future.cancel()
+            raise
+
+    async def _work(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            fn, deadline, future = await self.queue.get()
+            try:
+                remaining = deadline - loop.time()
+                if future.done() or remaining <= 0:
+                    # The caller already gave up; don't spend a worker on it
+                    self.stats["expired"] += 1
+                    if not future.done():
+                        future.set_exception(DeadlineExceeded(self.name))
+                    continue
+                await self._run(fn, remaining, future)
+            finally:
+                self.queue.task_done()
+
+    async def _run(self, fn, remaining, future):
+        self.busy += 1
+        task = asyncio.ensure_future(fn())
+        # Stop the work itself as soon as the caller stops waiting
+        future.add_done_callback(lambda f: task.cancel() if f.cancelled() else None)
+        try:
+            done, _ = await asyncio.wait({task}, timeout=remaining)
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        finally:
+            self.busy -= 1
+        if not done:
+            task.cancel()
+            self.stats["expired"] += 1
+            if not future.done():
+                future.set_exception(DeadlineExceeded(self.name))
+        elif task.cancelled():
+            self.stats["expired"] += 1
+        elif task.exception() is not None:
+            self.stats["failed"] += 1
+            if not future.done():
+                future.set_exception(task.exception())
+        else:
+            self.stats["completed"] += 1
+            if not future.done():
+                future.set_result(task.result())
+
+    def snapshot(self):
+        return dict(self.stats, workers=self.workers, busy=self.busy,
+                    queued=self.queue.qsize() if self.queue else 0, max_queue=self.max_queue)
+
+
+# -----------------------------
+# MedRAG service
+# -----------------------------
+class MedRAGService:
+    """One MedRAG (and so one Retriever + index) shared by two bounded pools: answers are
+    LLM-bound and get many workers, retrieval is CPU-bound and gets a few (concurrent
+    retrievals still share encodes through the Retriever's micro-batcher)."""
+
+    def __init__(self, model, answer_workers=16, answer_queue=64, retrieve_workers=4, retrieve_queue=256,
+                 default_timeout=30.0, max_timeout=120.0):
+        self.model = model
+        self.answers = WorkerPool("answer", answer_workers, answer_queue)
+        self.retrievals = WorkerPool("retrieve", retrieve_workers, retrieve_queue)
+        self.default_timeout = default_timeout
+        self.max_timeout = max_timeout
+        # Registered for the service's lifetime only: exporters are process-global
+        self.metrics = PrometheusExporter()
+
+    async def start(self):
+        add_exporter(self.metrics)
+        self.answers.start()
+        self.retrievals.start()
+        if hasattr(self.model, "warmup"):
+            self.model.warmup(background=True)
+
+    async def stop(self):
+        await self.answers.stop()
+        await self.retrievals.stop()
+        remove_exporter(self.metrics)
+
+    def deadline(self, timeout):
+        timeout = self.default_timeout if timeout is None else min(float(timeout), self.max_timeout)
+        return asyncio.get_running_loop().time() + timeout
+
+    async def answer(self, question, k=5, timeout=None):
+        deadline = self.deadline(timeout)
+
+        async def run():
+            remaining = deadline - asyncio.get_running_loop().time()
+            return await self.model.amedrag_answer(question, k=k, timeout=remaining)
+        return await self.answers.submit(run, deadline)
+
+    async def retrieve(self, question, k=5, mode=None, timeout=None):
+        deadline = self.deadline(timeout)
+        retriever = self.model.retrieval_system
+        if retriever is None:
+            raise LookupError("No corpus/index loaded")
+
+        def search():
+            with request("retrieve"):
+                return retriever.get_relevant_documents(question, k, mode)
+
+        async def run():
+            return await asyncio.to_thread(search)
+        return await self.retrievals.submit(run, deadline)
+
+    def health(self):
+        retriever = self.model.retrieval_system
+        return {
+            "status": "ok",
+            "rag": retriever is not None,
+            "index_loaded": bool(retriever is not None and retriever._loaded),
+            "index_snapshot": retriever.snapshot if retriever is not None else None,
+            "answer_cache": self.model.answer_cache.stats() if self.model.answer_cache is not None else None,
+            "answer_pool": self.answers.snapshot(),
+            "retrieve_pool": self.retrievals.snapshot(),
+        }
+
+    def render_metrics(self):
+        lines = [self.metrics.render().rstrip("\n")]
+        for pool in (self.answers, self.retrievals):
+            snap = pool.snapshot()
+            for key in ("busy", "queued", "workers"):
+                lines.append(f'medrag_pool_{key}{{pool="{pool.name}"}} {snap[key]}')
+            for key in ("completed", "failed", "shed", "expired"):
+                lines.append(f'medrag_pool_{key}_total{{pool="{pool.name}"}} {snap[key]}')
+        return "\n".join(lines) + "\n"
+
+
+# -----------------------------
+# ASGI app
+# -----------------------------
+async def _read_json(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    return json.loads(body or b"{}")
+
+
+async def _send(send, status, payload, content_type="application/json", headers=()):
+    body = payload if isinstance(payload, bytes) else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode()),
+                    *headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def create_app(service):
+    """Plain ASGI app (run with any ASGI server, e.g. uvicorn):
+
+    POST /v1/answer    {"question", "k"?, "timeout"?}  -> {"answer", "elapsed_ms"}
+    POST /v1/retrieve  {"question", "k"?, "mode"?, "timeout"?} -> {"docs", "elapsed_ms"}
+    GET  /healthz      pool and index status
+    GET  /metrics      Prometheus text format
+
+    k must be in 1..MAX_K and timeout a positive number of seconds, else 400.
+    A full queue answers 429 with Retry-After; a missed deadline answers 504.
+    """
+
+    async def app(scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await service.start()
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await service.stop()
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+
+        if scope["type"] != "http":
+            return
+
+        method, path = scope["method"], scope["path"]
+        if method == "GET" and path == "/healthz":
+            return await _send(send, 200, service.health())
+        if method == "GET" and path == "/metrics":
+            return await _send(send, 200, service.render_metrics().encode(), "text/plain; version=0.0.4")
+        if method != "POST" or path not in ("/v1/answer", "/v1/retrieve"):
+            return await _send(send, 404, {"error": "not found"})
+
+        try:
+            req = await _read_json(receive)
+            question = req["question"].strip()
+            if not question:
+                raise ValueError("empty question")
+            k = int(req.get("k", 5))
+            if not 1 <= k <= MAX_K:
+                raise ValueError(f"k must be between 1 and {MAX_K}")
+            timeout = req.get("timeout")
+            if timeout is not None:
+                timeout = float(timeout)
+                if not timeout > 0:
+                    raise ValueError("timeout must be a positive number of seconds")
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            return await _send(send, 400, {"error": f"bad request: {e}"})
+
+        start = time.perf_counter()
+        try:
+            if path == "/v1/answer":
+                answer = await service.answer(question, k, timeout)
+                payload = {"answer": answer}
+            else:
+                docs = await service.retrieve(question, k, req.get("mode"), timeout)
+                payload = {"docs": [{key: d[key] for key in ("id", "title", "content", "score")} for d in docs]}
+        except Overloaded:
+            return await _send(send, 429, {"error": "overloaded, retry later"}, headers=[(b"retry-after", b"1")])
+        except (DeadlineExceeded, asyncio.TimeoutError):
+            return await _send(send, 504, {"error": "deadline exceeded"})
+        except LookupError as e:
+            return await _send(send, 503, {"error": str(e)})
+        except Exception as e:
+            return await _send(send, 500, {"error": f"{type(e).__name__}: {e}"})
+        payload["elapsed_ms"] = (time.perf_counter() - start) * 1000
+        return await _send(send, 200, payload)
+
+    return app
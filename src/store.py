@@ -0,0 +1,125 @@
+import os
+import json
+import mmap
+import shutil
+import numpy as np
+
+
+# -----------------------------
+# Memory-mapped metadata store
+# -----------------------------
+# Layout, for a path prefix P:
+#   P.bin      concatenated UTF-8 JSON records
+#   P.idx.npy  int64 array of shape (n_rows, 2) holding (offset, length) per FAISS row id.
+#              length == 0 means the row was removed (or never existed).
+# Both files are opened read-only with mmap, so a process only keeps the pages it
+# touches resident and every worker shares them through the OS page cache.
+
+class MetadataStore:
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.bin_path = f"{prefix}.bin"
+        self.idx_path = f"{prefix}.idx.npy"
+        self.offsets = np.load(self.idx_path, mmap_mode="r")
+        self._file = open(self.bin_path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._blob = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    @staticmethod
+    def exists(prefix):
+        return os.path.exists(f"{prefix}.bin") and os.path.exists(f"{prefix}.idx.npy")
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def get(self, row, default=None):
+        """Returns the metadata dict for a FAISS row id, reading it lazily from the blob."""
+        if row < 0 or row >= len(self.offsets):
+            return default
+        offset, length = self.offsets[row]
+        if length == 0:
+            return default
+        return json.loads(self._blob[offset:offset + length])
+
+    def __contains__(self, row):
+        return 0 <= row < len(self.offsets) and self.offsets[row][1] > 0
+
+    def rows(self):
+        """Row ids that currently hold a record."""
+        return np.flatnonzero(self.offsets[:, 1] > 0)
+
+    def close(self):
+        if isinstance(self._blob, mmap.mmap):
+            self._blob.close()
+        self._file.close()
+
+
+class MetadataStoreWriter:
+    """Builds a new store, optionally starting from a copy of an existing one.
+
+    Nothing is visible to readers until `commit()` atomically replaces the files.
+    Removed rows leave their bytes behind in the copied blob; once they make up more than
+    `compact_ratio` of it, commit() rewrites the blob with only the live records.
+    """
+
+    def __init__(self, prefix, base=None, compact_ratio=0.25):
+        self.prefix = prefix
+        self.compact_ratio = compact_ratio
+        self.tmp_bin = f"{prefix}.bin.tmp"
+        if base is not None:
+            shutil.copyfile(base.bin_path, self.tmp_bin)
+            self.offsets = np.array(base.offsets, dtype=np.int64)
+        else:
+            self.offsets = np.zeros((0, 2), dtype=np.int64)
+        self._out = open(self.tmp_bin, "ab")
+        self._pos = self._out.tell()
+
+    def add(self, row, record):
+        data = json.dumps(record, ensure_ascii=False).encode("utf-8")
+        if row >= len(self.offsets):
+            grow = max(row + 1, 2 * len(self.offsets)) - len(self.offsets)
+            self.offsets = np.vstack([self.offsets, np.zeros((grow, 2), dtype=np.int64)])
+        self._out.write(data)
+        self.offsets[row] = (self._pos, len(data))
+        self._pos += len(data)
+
+    def remove(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        rows = rows[rows < len(self.offsets)]
+        self.offsets[rows] = 0
+
+    def commit(self, n_rows=None):
+        """Writes the offset table and swaps both files into place."""
+        self._out.close()
+        # Trim the growth slack back to the real number of rows
+        if n_rows is not None:
+            if n_rows > len(self.offsets):
+                pad = np.zeros((n_rows - len(self.offsets), 2), dtype=np.int64)
+                self.offsets = np.vstack([self.offsets, pad])
+            self.offsets = self.offsets[:n_rows]
+        live = int(self.offsets[:, 1].sum())
+        if self._pos and self._pos - live > self.compact_ratio * self._pos:
+            self._compact()
+        tmp_idx = f"{self.prefix}.idx.tmp.npy"
+        np.save(tmp_idx, self.offsets)
+        os.replace(self.tmp_bin, f"{self.prefix}.bin")
+        os.replace(tmp_idx, f"{self.prefix}.idx.npy")
+
+    def _compact(self):
+        """Rewrites the temp blob with only the live records, in row order."""
+        compact_bin = f"{self.prefix}.bin.compact.tmp"
+        pos = 0
+        with open(self.tmp_bin, "rb") as src, open(compact_bin, "wb") as dst:
+            with mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as blob:
+                for row in np.flatnonzero(self.offsets[:, 1] > 0):
+                    offset, length = self.offsets[row]
+                    dst.write(blob[offset:offset + length])
+                    self.offsets[row, 0] = pos
+                    pos += length
+        os.replace(compact_bin, self.tmp_bin)
+        self._pos = pos
+
+    def abort(self):
+        self._out.close()
+        if os.path.exists(self.tmp_bin):
+            os.remove(self.tmp_bin)
@@ -0,0 +1,72 @@
+import re
+import time
+import asyncio
+import hashlib
+
+# Prompt markers that tell the stub which pipeline call it is answering
+CONCEPT_MARKER = "Extract only medical concepts"
+DDI_MARKER = "SEVERITY_SCORE"
+
+
+# -----------------------------
+# Deterministic offline LLM
+# -----------------------------
+class StubResponse:
+    def __init__(self, text):
+        self.text = text
+        self.candidates = [text]
+
+
+class StubLLM:
+    """Drop-in for `genai.GenerativeModel` that answers without a network.
+
+    Responses are a pure function of the prompt, so runs are repeatable: concept
+    prompts get the query's words back, DDI prompts get the report sections plus a
+    SEVERITY_SCORE, anything else gets a short bullet summary of the context.
+    `latency` (seconds per call) and `token_latency` (seconds per streamed word)
+    simulate a remote model for load tests.
+    """
+
+    def __init__(self, latency=0.0, token_latency=0.0):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.calls = 0
+
+    def _answer(self, prompt):
+        self.calls += 1
+        digest = int(hashlib.sha1(prompt.encode("utf-8")).hexdigest(), 16)
+        if CONCEPT_MARKER in prompt:
+            query = prompt.split("Query:", 1)[-1]
+            words = re.findall(r"[A-Za-z][A-Za-z0-9-]+", query)
+            return ", ".join(dict.fromkeys(w.lower() for w in words))
+
+        sources = re.findall(r"SOURCE \[([^\]]+)\]", prompt)
+        titles = ", ".join(dict.fromkeys(sources)) or "no corpus sources"
+        if DDI_MARKER in prompt:
+            return (
+                f"**Interaction Summary**\n• Stub report based on {titles}.\n\n"
+                f"**Mechanism**\n• Not evaluated (offline stub).\n\n"
+                f"**Clinical Risk**\n• Not evaluated (offline stub).\n\n"
+                f"**Monitoring Recommendation**\n• Not evaluated (offline stub).\n\n"
+                f"**Overall Assessment**\n• Offline stub answer.\n\n"
+                f"SEVERITY_SCORE: {digest % 10 + 1}"
+            )
+        return f"**Summary**\n• Stub answer based on {titles}.\n• {len(sources)} source chunk(s) in context."
+
+    def generate_content(self, prompt, stream=False):
+        text = self._answer(prompt)
+        if not stream:
+            time.sleep(self.latency)
+            return StubResponse(text)
+        return self._stream(text)
+
+    def _stream(self, text):
+        time.sleep(self.latency)
+        for word in re.findall(r"\S+\s*", text):
+            time.sleep(self.token_latency)
+            yield StubResponse(word)
+
+    async def generate_content_async(self, prompt):
+        text = self._answer(prompt)
+        await asyncio.sleep(self.latency)
+        return StubResponse(text)
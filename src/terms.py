@@ -0,0 +1,146 @@
+import os
+import re
+import hashlib
+import numpy as np
+
+
+# -----------------------------
+# Key terms
+# -----------------------------
+FILLER_WORDS = frozenset({
+    "understand", "know", "mean", "think", "explain", "tell",
+    "describe", "give", "information", "detail", "details"
+})
+STOPWORDS = frozenset({
+    "what", "is", "are", "does", "do", "you", "by", "can", "the", "a", "an", "with", "if", "when", "how",
+    "happens", "interacts", "patient", "patients", "treatment", "use", "used", "indicated", "mg", "dose", "clinical"
+})
+ALL_STOPS = FILLER_WORDS | STOPWORDS
+_WORD = re.compile(r"[a-zA-Z]+")
+
+
+def key_terms(text):
+    """Lowercased content words of a text (len > 2, stopwords removed)."""
+    return {
+        w for w in (m.lower() for m in _WORD.findall(text))
+        if w not in ALL_STOPS and len(w) > 2
+    }
+
+
+def term_id(term):
+    """Stable 64-bit id of a term, so no vocabulary has to be kept in memory."""
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+
+
+def term_ids(terms):
+    return np.unique(np.fromiter((term_id(t) for t in terms), dtype=np.int64, count=len(terms)))
+
+
+# -----------------------------
+# Precomputed per-chunk term index
+# -----------------------------
+# Layout, for a path prefix P (same row ids as the FAISS index / metadata store):
+#   P.ids.npy  int64 term ids of all rows, concatenated, sorted within each row
+#   P.idx.npy  int64 (n_rows, 2) array of (offset, length) into P.ids.npy
+
+class TermIndex:
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.ids = np.load(f"{prefix}.ids.npy", mmap_mode="r")
+        self.offsets = np.load(f"{prefix}.idx.npy", mmap_mode="r")
+
+    @staticmethod
+    def exists(prefix):
+        return os.path.exists(f"{prefix}.ids.npy") and os.path.exists(f"{prefix}.idx.npy")
+
+    def row_terms(self, row):
+        """Sorted term ids of one row."""
+        if row < 0 or row >= len(self.offsets):
+            return np.empty(0, dtype=np.int64)
+        offset, length = self.offsets[row]
+        return np.asarray(self.ids[offset:offset + length])
+
+    def overlap_counts(self, rows, query_ids):
+        """Number of query term ids present in each row, computed in one vectorized pass."""
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0 or len(query_ids) == 0:
+            return np.zeros(len(rows), dtype=np.int64)
+        valid = (rows >= 0) & (rows < len(self.offsets))
+        spans = np.zeros((len(rows), 2), dtype=np.int64)
+        spans[valid] = self.offsets[rows[valid]]
+        lengths = spans[:, 1]
+        if lengths.sum() == 0:
+            return np.zeros(len(rows), dtype=np.int64)
+        gathered = np.concatenate([self.ids[o:o + n] for o, n in spans])
+        segment = np.repeat(np.arange(len(rows)), lengths)
+        # Not assume_unique: `gathered` repeats ids across rows, which breaks the sort-based path
+        hits = np.isin(gathered, np.unique(query_ids))
+        return np.bincount(segment[hits], minlength=len(rows))
+
+
+class TermIndexWriter:
+    """Builds a new term index, optionally starting from an existing one (see MetadataStoreWriter).
+
+    Term ids are appended to a raw temp file as rows arrive, so memory stays flat.
+    """
+
+    block_size = 1 << 20
+
+    def __init__(self, prefix, base=None):
+        self.prefix = prefix
+        self.tmp_raw = f"{prefix}.ids.raw.tmp"
+        self._raw = open(self.tmp_raw, "wb")
+        self._pos = 0
+        if base is not None:
+            for start in range(0, len(base.ids), self.block_size):
+                self._raw.write(np.asarray(base.ids[start:start + self.block_size]).tobytes())
+            self._pos = len(base.ids)
+            self.offsets = np.array(base.offsets, dtype=np.int64)
+        else:
+            self.offsets = np.zeros((0, 2), dtype=np.int64)
+
+    def add(self, row, text):
+        ids = term_ids(key_terms(text))
+        if row >= len(self.offsets):
+            grow = max(row + 1, 2 * len(self.offsets)) - len(self.offsets)
+            self.offsets = np.vstack([self.offsets, np.zeros((grow, 2), dtype=np.int64)])
+        self._raw.write(ids.tobytes())
+        self.offsets[row] = (self._pos, len(ids))
+        self._pos += len(ids)
+
+    def remove(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        rows = rows[rows < len(self.offsets)]
+        self.offsets[rows] = 0
+
+    def commit(self, n_rows):
+        self._raw.close()
+        if n_rows > len(self.offsets):
+            pad = np.zeros((n_rows - len(self.offsets), 2), dtype=np.int64)
+            self.offsets = np.vstack([self.offsets, pad])
+        self.offsets = self.offsets[:n_rows]
+
+        # Copy the raw ids into a proper .npy block by block
+        tmp_ids = f"{self.prefix}.ids.tmp.npy"
+        if self._pos == 0:
+            np.save(tmp_ids, np.zeros(0, dtype=np.int64))
+        else:
+            self._copy_raw(tmp_ids)
+        np.save(f"{self.prefix}.idx.tmp.npy", self.offsets)
+        os.replace(tmp_ids, f"{self.prefix}.ids.npy")
+        os.replace(f"{self.prefix}.idx.tmp.npy", f"{self.prefix}.idx.npy")
+        os.remove(self.tmp_raw)
+
+    def _copy_raw(self, tmp_ids):
+        out = np.lib.format.open_memmap(tmp_ids, mode="w+", dtype=np.int64, shape=(self._pos,))
+        with open(self.tmp_raw, "rb") as f:
+            for start in range(0, self._pos, self.block_size):
+                block = np.fromfile(f, dtype=np.int64, count=self.block_size)
+                out[start:start + len(block)] = block
+        out.flush()
+        del out
+
+    def abort(self):
+        self._raw.close()
+        if os.path.exists(self.tmp_raw):
+            os.remove(self.tmp_raw)
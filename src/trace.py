@@ -0,0 +1,219 @@
+import time
+import logging
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+# The trace of the request running in this context; None means timing is off
+_current = contextvars.ContextVar("medrag_trace", default=None)
+
+# Exporters receive every finished request trace; with none registered and no
+# explicit trace() open, spans and counters cost one ContextVar lookup
+_exporters = []
+
+
+# -----------------------------
+# Per-request stage timings
+# -----------------------------
+class Trace:
+    """Seconds spent per pipeline stage, plus event counters, for one request.
+    A stage entered several times (e.g. two encodes) accumulates."""
+
+    def __init__(self, name="request"):
+        self.name = name
+        self.stages = {}
+        self.counters = {}
+        self.start = time.perf_counter()
+        self.timestamp = time.time()
+        self.total = None
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        # Async pipelines time stages from worker threads too
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def finish(self):
+        self.total = time.perf_counter() - self.start
+        return self
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "timestamp": self.timestamp,
+            "total_s": self.total,
+            "stages_s": dict(self.stages),
+            "counters": dict(self.counters),
+        }
+
+
+@contextmanager
+def trace(name="request"):
+    """Collects the stage timings and counters of everything run inside the block,
+    including work handed to asyncio.to_thread (which copies the context). Nested
+    blocks join the outer trace. On exit the trace is passed to every exporter."""
+    outer = _current.get()
+    if outer is not None:
+        yield outer
+        return
+    t = Trace(name)
+    token = _current.set(t)
+    try:
+        yield t
+    finally:
+        try:
+            _current.reset(token)
+        except ValueError:
+            # A generator finished from another context (e.g. closed by the GC)
+            _current.set(None)
+        t.finish()
+        for exporter in list(_exporters):
+            try:
+                exporter.export(t)
+            except Exception as e:
+                logging.getLogger(__name__).warning("trace exporter %r failed: %s", exporter, e)
+
+
+@contextmanager
+def request(name):
+    """`trace(name)` when instrumentation is on (an exporter is registered or a trace is
+    already open), otherwise a no-op. Wraps each public MedRAG pipeline call."""
+    if not _exporters and _current.get() is None:
+        yield None
+        return
+    with trace(name) as t:
+        yield t
+
+
+@contextmanager
+def span(name):
+    t = _current.get()
+    if t is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        t.add(name, time.perf_counter() - start)
+
+
+def record(name, seconds):
+    """Adds a duration measured elsewhere (e.g. on the query batcher's thread)."""
+    t = _current.get()
+    if t is not None:
+        t.add(name, seconds)
+
+
+def count(name, n=1):
+    """Bumps a counter (cache hits, docs retrieved, ...) on the current trace."""
+    t = _current.get()
+    if t is not None:
+        t.count(name, n)
+
+
+def add_exporter(exporter):
+    _exporters.append(exporter)
+    return exporter
+
+
+def remove_exporter(exporter):
+    if exporter in _exporters:
+        _exporters.remove(exporter)
+
+
+# -----------------------------
+# Exporters
+# -----------------------------
+class LogExporter:
+    """One log line per request: total, then each stage in ms, then counters."""
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger("medrag.trace")
+        self.level = level
+
+    def export(self, t):
+        stages = " ".join(f"{k}={v * 1000:.1f}ms" for k, v in t.stages.items())
+        counters = " ".join(f"{k}={v}" for k, v in t.counters.items())
+        self.logger.log(self.level, "%s total=%.1fms %s %s", t.name, t.total * 1000, stages, counters)
+
+
+class RingBufferExporter:
+    """Keeps the last `size` traces in memory (e.g. for a debug panel)."""
+
+    def __init__(self, size=100):
+        self.buffer = deque(maxlen=size)
+
+    def export(self, t):
+        self.buffer.append(t.to_dict())
+
+    def last(self):
+        return self.buffer[-1] if self.buffer else None
+
+    def traces(self):
+        return list(self.buffer)
+
+
+class PrometheusExporter:
+    """Aggregates traces into Prometheus metrics; `render()` returns the text exposition format.
+
+    medrag_requests_total{name}, medrag_request_seconds (histogram),
+    medrag_stage_seconds (histogram per stage) and medrag_<counter>_total per counter.
+    """
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, prefix="medrag"):
+        self.prefix = prefix
+        self.requests = {}
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def _observe(self, metric, labels, seconds):
+        h = self.histograms.setdefault((metric, labels), [[0] * len(self.BUCKETS), 0.0, 0])
+        for i, bound in enumerate(self.BUCKETS):
+            if seconds <= bound:
+                h[0][i] += 1
+        h[1] += seconds
+        h[2] += 1
+
+    def export(self, t):
+        with self._lock:
+            self.requests[t.name] = self.requests.get(t.name, 0) + 1
+            self._observe("request_seconds", (("name", t.name),), t.total)
+            for stage, seconds in t.stages.items():
+                self._observe("stage_seconds", (("stage", stage),), seconds)
+            for name, n in t.counters.items():
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}" if pairs else ""
+
+    def render(self):
+        p = self.prefix
+        with self._lock:
+            lines = [f"# TYPE {p}_requests_total counter"]
+            for name, n in sorted(self.requests.items()):
+                lines.append(f'{p}_requests_total{{name="{name}"}} {n}')
+            for metric in ("request_seconds", "stage_seconds"):
+                lines.append(f"# TYPE {p}_{metric} histogram")
+                for (m, labels), (buckets, total, n) in sorted(self.histograms.items()):
+                    if m != metric:
+                        continue
+                    for bound, c in zip(self.BUCKETS, buckets):
+                        lines.append(f"{p}_{metric}_bucket{self._labels(labels, [('le', bound)])} {c}")
+                    lines.append(f"{p}_{metric}_bucket{self._labels(labels, [('le', '+Inf')])} {n}")
+                    lines.append(f"{p}_{metric}_sum{self._labels(labels)} {total}")
+                    lines.append(f"{p}_{metric}_count{self._labels(labels)} {n}")
+            for name, n in sorted(self.counters.items()):
+                lines.append(f"# TYPE {p}_{name}_total counter")
+                lines.append(f"{p}_{name}_total {n}")
+        return "\n".join(lines) + "\n"
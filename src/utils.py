@@ -1,10 +1,26 @@
 import os
+import re
 import json
+import time
+import random
+import copy
+import shutil
+import hashlib
+import threading
+from contextlib import contextmanager
 import numpy as np
 import faiss
 import tqdm
-from sentence_transformers import SentenceTransformer
-from sentence_transformers.models import Transformer, Pooling
+from .store import MetadataStore, MetadataStoreWriter
+from .cache import LRUCache, normalize_query
+from .terms import TermIndex, TermIndexWriter, term_ids
+from .lexicon import DrugMatcher, Postings, normalize_name
+from .batcher import MicroBatcher
+from .rerank import CrossEncoderReranker, RERANK_MODEL
+from . import embedding
+from .embedding import MODEL_NAME, make_embedder, encode_files
+from .trace import span, record, count
+from .bm25 import BM25Searcher, write_collection, build_lucene_index, rrf_fuse
 
 
 # -----------------------------
@@ -22,136 +38,1295 @@ def concat(title: str, content: str) -> str:
     return f"{title} {content}"
 
 
+def __getattr__(name):
+    # Still importable from here; resolved lazily so importing utils doesn't load torch
+    if name == "CustomizeSentenceTransformer":
+        return embedding.CustomizeSentenceTransformer
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 # -----------------------------
-# Custom SentenceTransformer (CLS pooling)
+# Chunk file fingerprints
 # -----------------------------
-class CustomizeSentenceTransformer(SentenceTransformer):
-    def _load_auto_model(self, model_name_or_path, *args, **kwargs):
-        transformer_model = Transformer(model_name_or_path)
-        pooling_model = Pooling(
-            transformer_model.get_word_embedding_dimension(),
-            pooling_mode_cls_token=True
-        )
-        return [transformer_model, pooling_model]
+def file_sha1(path, block_size=1 << 20):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+# -----------------------------
+# Versioned index snapshots
+# -----------------------------
+# index/
+#   CURRENT             name of the published snapshot, swapped in with os.replace
+#   snapshots/v000007/  faiss.index, manifest.json, metadata.*, key_terms.*, drugs.*, sections.*, bm25/...
+#   embeddings/         per-file embedding checkpoints, shared by every snapshot
+# A build writes a new snapshot directory and only then swaps CURRENT, so a reader never
+# sees a half-written index. Indexes built before snapshots existed live directly in index/.
+SNAPSHOT_SHARED = {"snapshots", "embeddings", "CURRENT", "CURRENT.tmp"}
+SNAPSHOT_RE = re.compile(r"^v(\d+)$")
+
+
+def snapshot_paths(snapshot_dir):
+    return {
+        "index_path": os.path.join(snapshot_dir, "faiss.index"),
+        "meta_prefix": os.path.join(snapshot_dir, "metadata"),
+        "manifest_path": os.path.join(snapshot_dir, "manifest.json"),
+        "terms_path": os.path.join(snapshot_dir, "drug_terms.json"),
+        "term_prefix": os.path.join(snapshot_dir, "key_terms"),
+        "drug_prefix": os.path.join(snapshot_dir, "drugs"),
+        "section_prefix": os.path.join(snapshot_dir, "sections"),
+        "matcher_path": os.path.join(snapshot_dir, "drugs.matcher.pkl"),
+        "bm25_collection_dir": os.path.join(snapshot_dir, "bm25_collection"),
+        "bm25_dir": os.path.join(snapshot_dir, "bm25"),
+    }
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def link_snapshot(src_dir, dst_dir):
+    """Hard-links every snapshot file of src_dir into dst_dir. Builders only ever replace
+    files (write to .tmp, then os.replace), so the source snapshot is never modified."""
+    for name in os.listdir(src_dir):
+        if name in SNAPSHOT_SHARED or ".tmp" in name or name.endswith(".old"):
+            continue
+        src, dst = os.path.join(src_dir, name), os.path.join(dst_dir, name)
+        if os.path.isdir(src):
+            shutil.copytree(src, dst, copy_function=_link_or_copy)
+        else:
+            _link_or_copy(src, dst)
+
+
+class ReadWriteLock:
+    """Any number of readers (queries) or one writer (an index swap). A waiting writer
+    holds back new readers, so a swap waits only for the queries already in flight."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writing or self._waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._waiting += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+
+# -----------------------------
+# FAISS index factory
+# -----------------------------
+INDEX_TYPES = ("flat", "hnsw", "ivf", "ivfpq", "opq")
+
+
+def index_factory_string(index_type, n_train=None, nlist=1024, pq_m=48, hnsw_m=32):
+    """Maps an index type to a faiss.index_factory spec.
+
+    IVF lists are capped so every centroid sees at least ~39 training points.
+    """
+    if n_train:
+        nlist = max(1, min(nlist, n_train // 39))
+    specs = {
+        # Flat and HNSW cannot store their own IDs, so they go behind an IDMap2
+        "flat": "IDMap2,Flat",
+        "hnsw": f"IDMap2,HNSW{hnsw_m},Flat",
+        "ivf": f"IVF{nlist},Flat",
+        "ivfpq": f"IVF{nlist},PQ{pq_m}",
+        "opq": f"OPQ{pq_m},IVF{nlist},PQ{pq_m}",
+    }
+    if index_type not in specs:
+        raise ValueError(f"Unknown index type {index_type!r}, expected one of {INDEX_TYPES}")
+    return specs[index_type]
+
+
+def needs_training(index_type):
+    return index_type in ("ivf", "ivfpq", "opq")
+
+
+def make_index(dim, index_type="flat", train_vectors=None, **params):
+    """Builds an inner-product FAISS index, training it on `train_vectors` if required."""
+    n_train = len(train_vectors) if train_vectors is not None else None
+    spec = index_factory_string(index_type, n_train=n_train, **params)
+    index = faiss.index_factory(dim, spec, faiss.METRIC_INNER_PRODUCT)
+    if not index.is_trained:
+        if train_vectors is None:
+            raise ValueError(f"Index type {index_type!r} needs training vectors")
+        index.train(train_vectors)
+    return index
+
+
+def set_search_params(index, nprobe=None, efSearch=None):
+    """Applies query-time knobs; ignores the ones that don't apply to this index type."""
+    ps = faiss.ParameterSpace()
+    for name, value in (("nprobe", nprobe), ("efSearch", efSearch)):
+        if value is None:
+            continue
+        try:
+            ps.set_index_parameter(index, name, value)
+        except RuntimeError:
+            pass  # e.g. efSearch on an IVF index
+
+
+def enable_reconstruct(index):
+    """IVF indexes need a direct map to reconstruct vectors by ID (used to score sparse-only hits)."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and ivf.direct_map.type == faiss.DirectMap.NoMap:
+        ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+
+
+def index_nbytes(index):
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def recall_report(xb, xq, k=10, configs=(("hnsw", {}), ("ivf", {}), ("ivfpq", {}), ("opq", {})), sweeps=None, train_size=50000, **params):
+    """Measures recall@k and per-query latency of candidate indexes against exact search.
+
+    xb: (n, d) normalized corpus vectors. xq: (q, d) normalized query vectors.
+    configs: [(index_type, extra make_index params), ...]
+    sweeps: {"nprobe": [...], "efSearch": [...]} query-time values to try.
+    Returns one row per (index, setting).
+    """
+    sweeps = sweeps or {"nprobe": [1, 4, 16, 64], "efSearch": [16, 32, 64, 128]}
+    dim = xb.shape[1]
+    ids = np.arange(len(xb), dtype=np.int64)
+
+    exact = faiss.IndexFlatIP(dim)
+    exact.add(xb)
+    t0 = time.perf_counter()
+    _, gt = exact.search(xq, k)
+    exact_ms = (time.perf_counter() - t0) * 1000 / len(xq)
+
+    rows = [{
+        "index": "flat (exact)", "setting": "-", "recall": 1.0,
+        "ms_per_query": exact_ms, "bytes_per_vector": index_nbytes(exact) / len(xb)
+    }]
+    rng = np.random.default_rng(0)
+
+    for index_type, extra in configs:
+        cfg = dict(params, **extra)
+        train = None
+        if needs_training(index_type):
+            sample = rng.choice(len(xb), size=min(train_size, len(xb)), replace=False)
+            train = xb[np.sort(sample)]
+        index = make_index(dim, index_type, train, **cfg)
+        index.add_with_ids(xb, ids)
+        size = index_nbytes(index) / len(xb)
+
+        if index_type == "hnsw":
+            settings = [("efSearch", v) for v in sweeps.get("efSearch", [])]
+        elif needs_training(index_type):
+            settings = [("nprobe", v) for v in sweeps.get("nprobe", [])]
+        else:
+            settings = []
+
+        for knob, value in settings or [(None, None)]:
+            if knob:
+                set_search_params(index, **{knob: value})
+            t0 = time.perf_counter()
+            _, found = index.search(xq, k)
+            ms = (time.perf_counter() - t0) * 1000 / len(xq)
+            hits = sum(len(set(a.tolist()) & set(b.tolist())) for a, b in zip(found, gt))
+            rows.append({
+                "index": index_factory_string(index_type, n_train=len(train) if train is not None else None, **cfg),
+                "setting": f"{knob}={value}" if knob else "-",
+                "recall": hits / (k * len(xq)),
+                "ms_per_query": ms,
+                "bytes_per_vector": size
+            })
+    return rows
 
 
 # -----------------------------
 # Retriever
 # -----------------------------
 class Retriever:
-    def __init__(self, chunk_dir="./corpus/openfda/chunk", HNSW=False):
+    # Rows added to the FAISS index per call while streaming checkpoints
+    ADD_BATCH = 4096
+
+    def __init__(self, chunk_dir="./corpus/openfda/chunk", HNSW=False, index_type=None,
+                 nlist=1024, pq_m=48, train_size=50000, nprobe=16, efSearch=64,
+                 cache_size=1024, cache_ttl=None, sparse=False, retrieval_mode="dense", rrf_k=60,
+                 exact_filter_limit=4096, batch_window=0.005, max_batch=32,
+                 embedding_backend="torch", encode_workers=1, encode_threads=None, encode_batch_size=64,
+                 keep_embeddings=False, lazy=False, allow_build=True, rerank=False, rerank_model=RERANK_MODEL,
+                 rerank_candidates=30, rerank_threshold=0.05, rerank_gap=None, rerank_min_k=1,
+                 watch_interval=None, keep_snapshots=3):
         self.chunk_dir = os.path.normpath(chunk_dir)
         self.index_dir = os.path.join(os.path.dirname(self.chunk_dir), "index")
         os.makedirs(self.index_dir, exist_ok=True)
+        # index_type=None keeps whatever type the index on disk was built with
+        self.index_type = index_type or ("hnsw" if HNSW else None)
+        self.index_params = {"nlist": nlist, "pq_m": pq_m}
+        self.train_size = train_size
+        self.search_params = {"nprobe": nprobe, "efSearch": efSearch}
 
-        # Embedding model
-        self.model = CustomizeSentenceTransformer(
-            "sentence-transformers/all-MiniLM-L6-v2",
-            device="cpu"
-        )
-        self.model.eval()
+        # Query embeddings only depend on the model; results also depend on the index
+        self.embedding_cache = LRUCache(cache_size, cache_ttl)
+        self.result_cache = LRUCache(cache_size, cache_ttl)
+        self.index_version = 0
 
-        self.index_path = os.path.join(self.index_dir, "faiss.index")
-        self.meta_path = os.path.join(self.index_dir, "metadatas.jsonl")
+        # Sparse BM25 leg (pyserini); sparse=True builds it alongside the dense index
+        self.sparse = sparse
+        self.retrieval_mode = retrieval_mode
+        self.rrf_k = rrf_k
+        # Filtered searches over at most this many rows are scored exactly
+        self.exact_filter_limit = exact_filter_limit
+        # Concurrent query encodes/searches are coalesced into one batch; batch_window=None disables
+        self._batcher = None
+        self.set_batching(batch_window, max_batch)
 
-        if os.path.exists(self.index_path) and os.path.exists(self.meta_path):
-            self._load_index()
-        else:
-            self._build_index(HNSW)
+        # Optional second stage: over-fetch rerank_candidates, rerank with a cross-encoder and keep
+        # the chunks down to the first score below rerank_threshold or drop above rerank_gap (k at most)
+        self.reranker = CrossEncoderReranker(rerank_model, cache_size=cache_size * 16) if rerank else None
+        self.rerank_candidates = rerank_candidates
+        self.rerank_threshold = rerank_threshold
+        self.rerank_gap = rerank_gap
+        self.rerank_min_k = rerank_min_k
+
+        # Embedding model: "torch" (reference), "torch-int8", "onnx" or "onnx-int8"
+        self.embedding_backend = embedding_backend
+        self._model = None
+        # Index builds: encode processes, intra-op threads per process, rows per encode batch.
+        # Per-file embeddings are checkpointed under index/embeddings/ so a crashed build resumes;
+        # keep_embeddings leaves them there after a successful build (e.g. to switch index types).
+        self.encode_workers = encode_workers
+        self.encode_threads = encode_threads
+        self.encode_batch_size = encode_batch_size
+        self.keep_embeddings = keep_embeddings
+
+        # Every index file lives in a versioned snapshot (see snapshot_paths); builds publish a
+        # new one, and with watch_interval (seconds) running Retrievers pick it up on their own
+        self.snapshots_dir = os.path.join(self.index_dir, "snapshots")
+        self.current_path = os.path.join(self.index_dir, "CURRENT")
+        self.keep_snapshots = keep_snapshots
+        self.snapshot = self._read_current()
+        self._staging = None
+        self._swap_lock = ReadWriteLock()
+        self._use_dir(self._snapshot_dir(self.snapshot))
+        self.embed_dir = os.path.join(self.index_dir, "embeddings")
+        self.lexicon_path = os.path.join(os.path.dirname(self.chunk_dir), "lexicon.json")
+        self.chunking_path = os.path.join(os.path.dirname(self.chunk_dir), "chunking.json")
+        self.term_index = None
+        self.drug_postings = None
+        self.section_postings = None
+        # Section filter -> cached FAISS ID selector, per loaded snapshot
+        self._section_selectors = {}
+        self._drug_matcher = None
+        self.bm25 = BM25Searcher(self.bm25_dir) if BM25Searcher.exists(self.bm25_dir) else None
+        self.metadatas = None
+        self.index = None
+        self._drug_terms = None
+
+        # lazy=True defers the model and the index to first use (or `warmup`);
+        # allow_build=False makes a missing index an error instead of a full build
+        self.allow_build = allow_build
+        self._loaded = False
+        self._load_lock = threading.RLock()
+        # Separate from _load_lock: a query holding the swap read lock may load the model while a
+        # reload holds _load_lock and waits for that query to finish
+        self._model_lock = threading.Lock()
+        if not lazy:
+            self._model = make_embedder(self.embedding_backend, MODEL_NAME)
+            self._ready()
+        self._stop_watch = threading.Event()
+        if watch_interval:
+            threading.Thread(target=self._watch, args=(watch_interval,), name="index-watch", daemon=True).start()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = make_embedder(self.embedding_backend, MODEL_NAME)
+        return self._model
+
+    def _index_exists(self):
+        paths = snapshot_paths(self._snapshot_dir(self._read_current()))
+        return (os.path.exists(paths["index_path"]) and os.path.exists(paths["manifest_path"])
+                and MetadataStore.exists(paths["meta_prefix"]))
+
+    def _ready(self):
+        """Loads the index on first use; builds it only if this process may build."""
+        if self._loaded:
+            return
+        with self._load_lock:
+            if self._loaded:
+                return
+            if self._index_exists():
+                self._load_index()
+            elif self.allow_build:
+                self._build_index()
+            else:
+                raise FileNotFoundError(
+                    f"No FAISS index in {self.index_dir}; build it with `python buildindex.py` "
+                    "(index builds are disabled in this process)"
+                )
+
+    def warmup(self, background=True):
+        """Loads the model and index and runs one query so the first real request is fast.
+        With background=True this happens on a daemon thread, which is returned."""
+        def run():
+            self._ready()
+            self._encode_queries(["warmup"])
+            if self.reranker is not None:
+                self.reranker.warmup()
+        if not background:
+            run()
+            return None
+        thread = threading.Thread(target=run, name="retriever-warmup", daemon=True)
+        thread.start()
+        return thread
 
     # -----------------------------
-    # Load existing index
+    # Snapshots: load, swap, publish
     # -----------------------------
+    def _read_current(self):
+        try:
+            with open(self.current_path, "r", encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _snapshot_dir(self, name):
+        # No published snapshot yet: an index built before snapshots existed, in index/ itself
+        return os.path.join(self.snapshots_dir, name) if name else self.index_dir
+
+    def _use_dir(self, snapshot_dir):
+        self.snapshot_dir = snapshot_dir
+        for attr, path in snapshot_paths(snapshot_dir).items():
+            setattr(self, attr, path)
+
     def _load_index(self):
-        self.index = faiss.read_index(self.index_path)
-        with open(self.meta_path, "r", encoding="utf-8") as f:
-            self.metadatas = [json.loads(line) for line in f]
+        name = self._read_current()
+        snapshot_dir = self._snapshot_dir(name)
+        self._swap(name, snapshot_dir, self._load_snapshot(snapshot_dir))
+
+    def _load_snapshot(self, snapshot_dir):
+        """Opens every part of a snapshot without touching the one being served."""
+        paths = snapshot_paths(snapshot_dir)
+        index = faiss.read_index(paths["index_path"])
+        with open(paths["manifest_path"], "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        set_search_params(index, **self.search_params)
+        enable_reconstruct(index)
+        return dict(self._open_snapshot_files(paths), index=index, manifest=manifest)
+
+    def _open_snapshot_files(self, paths):
+        """The parts of a snapshot that are served straight from its files."""
+        return {
+            # Chunk metadata stays on disk; rows are read lazily by FAISS id
+            "metadatas": MetadataStore(paths["meta_prefix"]),
+            # Precomputed key terms per row; indexes built before it existed fall back to tokenizing
+            "term_index": TermIndex(paths["term_prefix"]) if TermIndex.exists(paths["term_prefix"]) else None,
+            "drug_postings": Postings(paths["drug_prefix"]) if Postings.exists(paths["drug_prefix"]) else None,
+            "section_postings": (Postings(paths["section_prefix"]) if Postings.exists(paths["section_prefix"])
+                                 else None),
+            "bm25": BM25Searcher(paths["bm25_dir"]) if BM25Searcher.exists(paths["bm25_dir"]) else None,
+        }
+
+    def _swap(self, name, snapshot_dir, state):
+        """Makes a loaded snapshot the one queries use. Waits for in-flight queries, holds new
+        ones back only for the assignments, then closes what the old snapshot had open."""
+        old_metadatas, old_bm25 = self.metadatas, self.bm25
+        with self._swap_lock.write():
+            self._use_dir(snapshot_dir)
+            self.snapshot = name
+            self.index = state["index"]
+            self.manifest = state["manifest"]
+            self.metadatas = state["metadatas"]
+            self.term_index = state["term_index"]
+            self.drug_postings = state["drug_postings"]
+            self.section_postings = state["section_postings"]
+            self._section_selectors = {}
+            self.bm25 = state["bm25"]
+            self._drug_matcher = state.get("drug_matcher")
+            self._drug_terms = state.get("drug_terms")
+            if self.index_type is None:
+                self.index_type = self.manifest.get("index_type", "flat")
+                self.index_params.update(self.manifest.get("index_params", {}))
+            self._loaded = True
+            self._invalidate_results()
+        if old_metadatas is not None and old_metadatas is not self.metadatas:
+            old_metadatas.close()
+        if old_bm25 is not None and old_bm25 is not self.bm25:
+            old_bm25.close()
+
+    def reload_if_changed(self):
+        """Loads a newly published snapshot next to the one being served and swaps it in.
+        Returns True if it did. Called every watch_interval seconds when watching."""
+        name = self._read_current()
+        if not self._loaded or self._staging is not None or name is None or name == self.snapshot:
+            return False
+        with self._load_lock:
+            if self._staging is not None or name == self.snapshot:
+                return False
+            snapshot_dir = self._snapshot_dir(name)
+            self._swap(name, snapshot_dir, self._load_snapshot(snapshot_dir))
+        print(f"🔄 Reloaded index snapshot {name}")
+        return True
+
+    def _watch(self, interval):
+        while not self._stop_watch.wait(interval):
+            try:
+                self.reload_if_changed()
+            except Exception as e:
+                # e.g. a snapshot pruned before this process got to it; the next poll retries
+                print(f"⚠️ Index reload failed: {e}")
+
+    def stop_watching(self):
+        self._stop_watch.set()
+
+    def _stage(self):
+        """Starts a new snapshot directory as hard links of the loaded one; the build then
+        replaces whatever it changes. Returns (name, directory)."""
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+        numbers = [int(m.group(1)) for m in map(SNAPSHOT_RE.match, os.listdir(self.snapshots_dir)) if m]
+        name = f"v{max(numbers, default=0) + 1:06d}"
+        staging_dir = os.path.join(self.snapshots_dir, name)
+        os.makedirs(staging_dir)
+        if self._loaded:
+            link_snapshot(self.snapshot_dir, staging_dir)
+        self._staging = (name, staging_dir)
+        return self._staging
+
+    def _discard_stage(self):
+        _, staging_dir = self._staging
+        self._staging = None
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def _publish(self, name):
+        """Points CURRENT at the staged snapshot (an atomic rename)."""
+        with open(self.current_path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(name)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.current_path + ".tmp", self.current_path)
+
+    def _prune_snapshots(self, current):
+        """Keeps the current snapshot and the keep_snapshots - 1 before it (processes that have
+        not reloaded yet may still open files in them); drops the rest and abandoned builds."""
+        cur = int(SNAPSHOT_RE.match(current).group(1))
+        numbers = sorted(int(m.group(1)) for m in map(SNAPSHOT_RE.match, os.listdir(self.snapshots_dir)) if m)
+        older = [n for n in numbers if n < cur]
+        keep = set(older[len(older) - max(self.keep_snapshots - 1, 0):]) | {cur}
+        for n in numbers:
+            if n not in keep:
+                shutil.rmtree(os.path.join(self.snapshots_dir, f"v{n:06d}"), ignore_errors=True)
+
+    def _chunking_params(self):
+        if os.path.exists(self.chunking_path):
+            with open(self.chunking_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        return None
 
     # -----------------------------
     # Build FAISS index (one-time)
     # -----------------------------
-    def _build_index(self, HNSW=False):
-        fnames = sorted(f for f in os.listdir(self.chunk_dir) if f.endswith(".jsonl"))
-        embeddings_list = []
-        self.metadatas = []
-
-        for fname in tqdm.tqdm(fnames, desc="Building embeddings"):
-            path = os.path.join(self.chunk_dir, fname)
-            with open(path, "r", encoding="utf-8") as f:
-                lines = f.read().strip().split("\n")
-
-            texts = [json.loads(line) for line in lines]
-            inputs = [concat(t["title"], t["content"]) for t in texts]
-
-            print(f"Encoding {len(inputs)} chunks from {fname}")
-
-            batch_size = 64
-            all_embeds = []
-
-            for i in range(0, len(inputs), batch_size):
-                batch = inputs[i:i + batch_size]
-                emb = self.model.encode(
-                    batch,
-                    convert_to_numpy=True,
-                    show_progress_bar=False
-                )
-                all_embeds.append(emb)
+    def _build_index(self):
+        self.index_type = self.index_type or "flat"
+        self.update_index(rebuild=True)
+
+    def _empty_manifest(self):
+        return {"index_type": self.index_type, "index_params": self._build_params(),
+                "embedding_model": MODEL_NAME, "embedding_backend": self.embedding_backend,
+                "next_id": 0, "files": {}}
+
+    def _build_params(self):
+        # Only trained index types depend on nlist/pq_m
+        return self.index_params if needs_training(self.index_type) else {}
+
+    def set_search_params(self, nprobe=None, efSearch=None):
+        """Tunes recall vs. latency at query time (IVF: nprobe, HNSW: efSearch)."""
+        if nprobe is not None:
+            self.search_params["nprobe"] = nprobe
+        if efSearch is not None:
+            self.search_params["efSearch"] = efSearch
+        if self.index is not None:
+            set_search_params(self.index, nprobe, efSearch)
+        self._invalidate_results()
+
+    def _invalidate_results(self):
+        self.index_version += 1
+        self.result_cache.clear()
+        if self.reranker is not None:
+            self.reranker.clear()
+
+    def set_batching(self, batch_window=0.005, max_batch=32):
+        """Collect concurrent queries for up to batch_window seconds and serve them with one
+        encode + one index.search. batch_window=None encodes every query on the caller's thread."""
+        old = self._batcher
+        self._batcher = (MicroBatcher(self._search_batch, batch_window, max_batch, name="query-batcher")
+                         if batch_window is not None else None)
+        if old is not None:
+            old.close()
+
+    def cache_stats(self):
+        """Hit/miss counters of the query caches, for monitoring."""
+        return {
+            "snapshot": self.snapshot,
+            "index_version": self.index_version,
+            "embedding": self.embedding_cache.stats(),
+            "result": self.result_cache.stats(),
+            "rerank": self.reranker.stats() if self.reranker is not None else None,
+            "batching": self._batcher.stats() if self._batcher else None
+        }
+
+    def _checkpoint_path(self, fname, sha1):
+        return os.path.join(self.embed_dir, f"{fname}.{self.embedding_backend}.{sha1[:16]}.npy")
+
+    def _encode_checkpoints(self, files, current):
+        """Makes sure every file has an embeddings checkpoint; files encoded by an earlier,
+        interrupted build are not encoded again. Returns {fname: checkpoint path}."""
+        os.makedirs(self.embed_dir, exist_ok=True)
+        paths = {f: self._checkpoint_path(f, current[f]["sha1"]) for f in files}
+        # Partial outputs of an interrupted encode
+        for name in os.listdir(self.embed_dir):
+            if name.endswith(".tmp") or name.endswith(".tmp.npy"):
+                os.remove(os.path.join(self.embed_dir, name))
 
-            embeddings = np.vstack(all_embeds)
-            embeddings_list.append(embeddings)
+        todo = [f for f in files if not os.path.exists(paths[f])]
+        if len(todo) < len(files):
+            print(f"Resuming: {len(files) - len(todo)} file(s) already encoded")
+        jobs = [(os.path.join(self.chunk_dir, f), paths[f]) for f in todo]
+        # Worker processes load their own model; only an in-process encode needs this one
+        in_process = self.encode_workers <= 1 or len(jobs) == 1
+        encoded = encode_files(
+            jobs, concat, model=self.model if jobs and in_process else self._model,
+            backend=self.embedding_backend,
+            workers=self.encode_workers, threads=self.encode_threads, batch_size=self.encode_batch_size
+        )
+        for _ in tqdm.tqdm(encoded, total=len(jobs), desc="Building embeddings"):
+            pass
+        return paths
+
+    def _prune_checkpoints(self, manifest):
+        """Drops checkpoints that no longer match a file in the manifest (or all of them)."""
+        if not os.path.isdir(self.embed_dir):
+            return
+        keep = set()
+        if self.keep_embeddings:
+            keep = {os.path.basename(self._checkpoint_path(f, e["sha1"])) for f, e in manifest["files"].items()}
+        for name in os.listdir(self.embed_dir):
+            if name not in keep:
+                os.remove(os.path.join(self.embed_dir, name))
 
-            self.metadatas.extend([
-                {
-                    "id": t["id"],
-                    "source": fname,
-                    "title": t["title"],
-                    "content": t["content"]
+    def _scan_chunk_dir(self, manifest):
+        """Returns {fname: fingerprint} for every chunk file, hashing only files whose mtime/size moved."""
+        known = manifest["files"]
+        current = {}
+        for fname in sorted(f for f in os.listdir(self.chunk_dir) if f.endswith(".jsonl")):
+            st = os.stat(os.path.join(self.chunk_dir, fname))
+            old = known.get(fname)
+            if old and old["mtime"] == st.st_mtime and old["size"] == st.st_size:
+                current[fname] = {"sha1": old["sha1"], "mtime": st.st_mtime, "size": st.st_size}
+            else:
+                current[fname] = {
+                    "sha1": file_sha1(os.path.join(self.chunk_dir, fname)),
+                    "mtime": st.st_mtime,
+                    "size": st.st_size
                 }
-                for t in texts
-            ])
+        return current
 
-        # Stack + normalize
-        all_embeddings = np.vstack(embeddings_list).astype(np.float32)
-        faiss.normalize_L2(all_embeddings)
+    def update_index(self, rebuild=False):
+        """Embeds only chunk files that are new or changed since the last build.
 
-        dim = all_embeddings.shape[1]
+        Rows belonging to changed or deleted files are removed from the index by ID.
+        Returns {"added": [...], "removed": [...]} file names.
 
-        # FAISS index
-        if HNSW:
-            self.index = faiss.IndexHNSWFlat(dim, 32)
+        The build works on a copy of the served index and manifest and writes a new snapshot;
+        queries keep using the old one until it is published, and a failed build changes nothing.
+        """
+        if not self._loaded and self._index_exists():
+            self._ready()
+        # index_type=None keeps the loaded index's type; a first build defaults to flat
+        self.index_type = self.index_type or "flat"
+        manifest = getattr(self, "manifest", None)
+        if (rebuild or manifest is None
+                or manifest.get("index_type") != self.index_type
+                or manifest.get("index_params", {}) != self._build_params()):
+            index, manifest, base = None, self._empty_manifest(), None
         else:
-            self.index = faiss.IndexFlatIP(dim)
+            index, manifest, base = self.index, copy.deepcopy(manifest), self.metadatas
+
+        current = self._scan_chunk_dir(manifest)
+        known = manifest["files"]
+        stale = [f for f in known if f not in current or known[f]["sha1"] != current[f]["sha1"]]
+        fresh = [f for f in current if f not in known or f in stale]
+
+        # HNSW graphs cannot delete vectors, so any removal means starting over
+        if stale and self.index_type == "hnsw" and index is not None:
+            print("HNSW index does not support removals; rebuilding from scratch")
+            return self.update_index(rebuild=True)
+
+        if (not stale and not fresh and base is not None
+                and self.term_index is not None and self.drug_postings is not None
+                and self.section_postings is not None):
+            if self.sparse and self._bm25_stale(manifest):
+                self._build_snapshot(self._bm25_snapshot, manifest)
+            return {"added": [], "removed": []}
+
+        if index is not None:
+            index = faiss.clone_index(index)
+            set_search_params(index, **self.search_params)
+            enable_reconstruct(index)
+        self._build_snapshot(self._write_snapshot, index, manifest, base, current, stale, fresh)
+        return {"added": fresh, "removed": stale}
+
+    def _build_snapshot(self, fn, *args):
+        """Runs fn(paths of a new staged snapshot, *args) -> state of the built snapshot.
+        Only once it succeeded is the snapshot published and swapped in."""
+        name, staging_dir = self._stage()
+        try:
+            state = fn(snapshot_paths(staging_dir), *args)
+        except BaseException:
+            self._discard_stage()
+            raise
+        self._publish(name)
+        self._swap(name, staging_dir, state)
+        self._staging = None
+        self._prune_snapshots(name)
+        print(f"Published index snapshot {name}")
+
+    def _write_snapshot(self, paths, index, manifest, base, current, stale, fresh):
+        known = manifest["files"]
+        writer = MetadataStoreWriter(paths["meta_prefix"], base=base)
+        term_writer = TermIndexWriter(paths["term_prefix"], base=self.term_index if base is not None else None)
+        if base is not None and self.term_index is None:
+            # Backfill key terms for rows embedded before the term index existed
+            for row in base.rows():
+                doc = base.get(int(row))
+                term_writer.add(int(row), doc["content"])
+
+        # drug name -> rows and label section -> rows; small enough to edit in memory at build time
+        drug_postings, section_postings = {}, {}
+        if base is not None:
+            if self.drug_postings is not None:
+                drug_postings = self.drug_postings.to_dict()
+            if self.section_postings is not None:
+                section_postings = self.section_postings.to_dict()
+            if self.drug_postings is None or self.section_postings is None:
+                for row in base.rows():
+                    doc = base.get(int(row))
+                    if self.drug_postings is None:
+                        self._add_drug_rows(drug_postings, int(row), doc)
+                    if self.section_postings is None and doc.get("section"):
+                        section_postings.setdefault(doc["section"], []).append(int(row))
+
+        for fname in stale:
+            entry = known.pop(fname)
+            ids = np.arange(entry["start"], entry["start"] + entry["count"], dtype=np.int64)
+            if index is not None and len(ids):
+                index.remove_ids(ids)
+            writer.remove(ids)
+            term_writer.remove(ids)
+            lo, hi = entry["start"], entry["start"] + entry["count"]
+            for postings in (drug_postings, section_postings):
+                for name, rows in postings.items():
+                    postings[name] = [r for r in rows if not lo <= r < hi]
+
+        checkpoints = self._encode_checkpoints(fresh, current)
+
+        # Trained index types buffer vectors until there is enough data to train on
+        pending = []
+        n_pending = 0
+        drug_terms = set() if base is None else set(self.drug_terms())
+
+        for fname in tqdm.tqdm(fresh, desc="Adding to index"):
+            start = manifest["next_id"]
+            # Checkpoints are read through a memory map, one add batch at a time
+            embeddings = np.load(checkpoints[fname], mmap_mode="r")
+            for lo in range(0, len(embeddings), self.ADD_BATCH):
+                batch = np.array(embeddings[lo:lo + self.ADD_BATCH], dtype=np.float32)
+                faiss.normalize_L2(batch)
+                ids = np.arange(start + lo, start + lo + len(batch), dtype=np.int64)
+                if index is None:
+                    pending.append((batch, ids))
+                    n_pending += len(ids)
+                    if not needs_training(self.index_type) or n_pending >= self.train_size:
+                        index = self._create_index(pending)
+                        pending = []
+                else:
+                    index.add_with_ids(batch, ids)
+            n_rows = len(embeddings)
+            del embeddings
+
+            row = start
+            with open(os.path.join(self.chunk_dir, fname), "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    t = json.loads(line)
+                    record = {
+                        "id": t["id"],
+                        "source": fname,
+                        "title": t["title"],
+                        "content": t["content"]
+                    }
+                    # Structured label fields of section-aware chunks (see openfda.chunk_doc)
+                    for field in ("section", "set_id"):
+                        if t.get(field):
+                            record[field] = t[field]
+                    writer.add(row, record)
+                    term_writer.add(row, t["content"])
+                    self._add_drug_rows(drug_postings, row, t)
+                    if t.get("section"):
+                        section_postings.setdefault(t["section"], []).append(row)
+                    drug_terms.update(re.findall(r"[a-z0-9]+", t["title"].lower()))
+                    row += 1
+            if row - start != n_rows:
+                raise RuntimeError(f"{fname} changed while indexing ({n_rows} embeddings, {row - start} chunks)")
+            known[fname] = dict(current[fname], start=start, count=n_rows)
+            manifest["next_id"] = start + n_rows
+
+        if pending:
+            index = self._create_index(pending)
+
+        state = self._save_index(paths, index, manifest, writer, term_writer, drug_terms, drug_postings,
+                                 section_postings)
+        if self.sparse:
+            state["bm25"] = self._sync_bm25(paths, manifest, state["metadatas"]) or state["bm25"]
+        self._prune_checkpoints(manifest)
+        return state
+
+    @staticmethod
+    def _add_drug_rows(drug_postings, row, chunk):
+        names = set(chunk.get("drugs", []))
+        if chunk["title"] != "Unknown Medication":
+            names.add(chunk["title"])
+        for name in {normalize_name(n) for n in names}:
+            if name:
+                drug_postings.setdefault(name, []).append(row)
+
+    def _bm25_stale(self, manifest):
+        done = manifest.get("bm25", {})
+        known = manifest["files"]
+        return (set(done) != set(known) or any(known[f]["sha1"] != done[f] for f in done)
+                or not BM25Searcher.exists(self.bm25_dir))
+
+    def _bm25_snapshot(self, paths, manifest):
+        """A snapshot that only catches the BM25 index up; the FAISS index and drug matcher are
+        the served ones. Its files are reopened from the new snapshot's links: the served
+        snapshot's directory goes away once it is pruned."""
+        state = dict(self._open_snapshot_files(paths), index=self.index, manifest=manifest,
+                     drug_matcher=self._drug_matcher, drug_terms=self._drug_terms)
+        try:
+            state["bm25"] = self._sync_bm25(paths, manifest, state["metadatas"]) or state["bm25"]
+        except BaseException:
+            state["metadatas"].close()
+            raise
+        return state
+
+    def _sync_bm25(self, paths, manifest, metadatas):
+        """Brings a snapshot's BM25 collection/index in line with its dense index, one file at a
+        time. Returns a searcher for the rebuilt index, or None if nothing changed."""
+        collection_dir, bm25_dir = paths["bm25_collection_dir"], paths["bm25_dir"]
+        os.makedirs(collection_dir, exist_ok=True)
+        done = manifest.setdefault("bm25", {})
+        known = manifest["files"]
+        changed = False
+
+        for fname in list(done):
+            if fname not in known or known[fname]["sha1"] != done[fname]:
+                path = os.path.join(collection_dir, fname)
+                if os.path.exists(path):
+                    os.remove(path)
+                del done[fname]
+                changed = True
+
+        for fname in os.listdir(collection_dir):
+            if fname not in done:
+                os.remove(os.path.join(collection_dir, fname))
+
+        for fname, entry in known.items():
+            if fname in done:
+                continue
+            rows = range(entry["start"], entry["start"] + entry["count"])
+            write_collection(metadatas, rows, os.path.join(collection_dir, fname), concat)
+            done[fname] = entry["sha1"]
+            changed = True
+
+        if not changed and BM25Searcher.exists(bm25_dir):
+            return None
+        print("Building BM25 index")
+        build_lucene_index(collection_dir, bm25_dir)
+        with open(paths["manifest_path"] + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(paths["manifest_path"] + ".tmp", paths["manifest_path"])
+        return BM25Searcher(bm25_dir)
+
+    def _create_index(self, pending):
+        """Creates (and trains, for IVF/PQ types) the index from the first encoded batches."""
+        dim = pending[0][0].shape[1]
+        train = None
+        if needs_training(self.index_type):
+            all_vectors = np.vstack([e for e, _ in pending])
+            rng = np.random.default_rng(0)
+            sample = rng.choice(len(all_vectors), size=min(self.train_size, len(all_vectors)), replace=False)
+            train = all_vectors[np.sort(sample)]
+            print(f"Training {self.index_type} index on {len(train)} vectors")
+        index = make_index(dim, self.index_type, train, **self.index_params)
+        set_search_params(index, **self.search_params)
+        enable_reconstruct(index)
+        for embeddings, ids in pending:
+            index.add_with_ids(embeddings, ids)
+        return index
+
+    def sample_embeddings(self, n, seed=0):
+        """Encodes a random sample of n chunks, e.g. for `recall_report`. Returns (vectors, records)."""
+        # Reservoir sampling keeps only n records in memory
+        rng = random.Random(seed)
+        texts = []
+        seen = 0
+        for fname in sorted(f for f in os.listdir(self.chunk_dir) if f.endswith(".jsonl")):
+            with open(os.path.join(self.chunk_dir, fname), "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    seen += 1
+                    if len(texts) < n:
+                        texts.append(line)
+                    else:
+                        j = rng.randrange(seen)
+                        if j < n:
+                            texts[j] = line
+        texts = [json.loads(line) for line in texts]
+        vectors = self.model.encode(
+            [concat(t["title"], t["content"]) for t in texts],
+            batch_size=64,
+            convert_to_numpy=True,
+            show_progress_bar=True
+        ).astype(np.float32)
+        faiss.normalize_L2(vectors)
+        return vectors, texts
+
+    def drug_terms(self):
+        """Lowercased words of every indexed drug title, e.g. for recognizing drug-only queries."""
+        if self._drug_terms is None:
+            if os.path.exists(self.terms_path):
+                with open(self.terms_path, "r", encoding="utf-8") as f:
+                    self._drug_terms = frozenset(json.load(f))
+            else:
+                self._drug_terms = frozenset()
+        return self._drug_terms
+
+    def drug_matcher(self):
+        """Aho-Corasick matcher over every indexed drug name plus the ingestion lexicon."""
+        if self._drug_matcher is None and not os.path.exists(self.matcher_path):
+            self._ready()
+        if self._drug_matcher is None:
+            if os.path.exists(self.matcher_path):
+                self._drug_matcher = DrugMatcher.load(self.matcher_path)
+            else:
+                self._drug_matcher = DrugMatcher(self.drug_postings.keys if self.drug_postings else [])
+        return self._drug_matcher
 
-        self.index.add(all_embeddings)
+    def _build_drug_matcher(self, drug_postings):
+        names = set(drug_postings)
+        if os.path.exists(self.lexicon_path):
+            with open(self.lexicon_path, "r", encoding="utf-8") as f:
+                names.update(json.load(f))
+        return DrugMatcher(names)
 
-        # Save
-        faiss.write_index(self.index, self.index_path)
-        with open(self.meta_path, "w", encoding="utf-8") as f:
-            for m in self.metadatas:
-                f.write(json.dumps(m) + "\n")
+    def _save_index(self, paths, index, manifest, writer, term_writer, drug_terms, drug_postings,
+                    section_postings):
+        """Writes the built index and its side files into the staged snapshot; returns its state."""
+        if index is None:
+            writer.abort()
+            term_writer.abort()
+            raise RuntimeError(f"No chunks found to index in {self.chunk_dir}")
+        name, _ = self._staging
+        manifest.update(snapshot=name, created=time.strftime("%Y-%m-%dT%H:%M:%S"),
+                        chunking=self._chunking_params())
+        # Temp files first, even inside the unpublished snapshot: its hard links are shared
+        faiss.write_index(index, paths["index_path"] + ".tmp")
+        with open(paths["manifest_path"] + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        with open(paths["terms_path"] + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(sorted(drug_terms), f)
+        matcher = self._build_drug_matcher(drug_postings)
+        matcher.save(paths["matcher_path"])
+        Postings.write(paths["drug_prefix"], drug_postings)
+        Postings.write(paths["section_prefix"], section_postings)
+        writer.commit(n_rows=manifest["next_id"])
+        term_writer.commit(n_rows=manifest["next_id"])
+        os.replace(paths["index_path"] + ".tmp", paths["index_path"])
+        os.replace(paths["manifest_path"] + ".tmp", paths["manifest_path"])
+        os.replace(paths["terms_path"] + ".tmp", paths["terms_path"])
+        return {
+            "index": index,
+            "manifest": manifest,
+            "metadatas": MetadataStore(paths["meta_prefix"]),
+            "term_index": TermIndex(paths["term_prefix"]),
+            "drug_postings": Postings(paths["drug_prefix"]),
+            "section_postings": Postings(paths["section_prefix"]),
+            "bm25": BM25Searcher(paths["bm25_dir"]) if BM25Searcher.exists(paths["bm25_dir"]) else None,
+            "drug_matcher": matcher,
+            "drug_terms": frozenset(drug_terms),
+        }
 
     # -----------------------------
     # Retrieval
     # -----------------------------
-    def get_relevant_documents(self, question, k=5):
+    def encode_query(self, question):
+        """Returns the normalized (1, dim) query embedding, memoized on the normalized text."""
+        text = normalize_query(question)
+        q_emb = self.embedding_cache.get(text)
+        count("embedding_cache_hits" if q_emb is not None else "embedding_cache_misses")
+        if q_emb is None:
+            if self._batcher is not None:
+                q_emb, _ = self._batched((text, 0))
+            else:
+                with span("encode"):
+                    q_emb = self._encode_queries([text])
+                self.embedding_cache.put(text, q_emb)
+        return q_emb
+
+    def _batched(self, item):
+        """Runs one (text, k) item through the batcher; its batch's encode/search times
+        go to the caller's trace, the rest of the wait is recorded as "batch_wait"."""
+        start = time.perf_counter()
+        emb, hit, timings = self._batcher(item)
+        for name, seconds in timings.items():
+            record(name, seconds)
+        record("batch_wait", time.perf_counter() - start - sum(timings.values()))
+        return emb, hit
+
+    def _encode_queries(self, texts):
         q_emb = self.model.encode(
-        [question],
+        texts,
         convert_to_numpy=True
         ).astype(np.float32)
-
         faiss.normalize_L2(q_emb)
+        return q_emb
+
+    def _search_batch(self, items):
+        """Batched encode + search for (text, k) items; k=0 only encodes.
+
+        Runs on the batcher thread: one model.encode for every uncached text and one
+        index.search at the largest k, sliced per caller.
+        """
+        embs = {}
+        for text, _ in items:
+            if text not in embs:
+                embs[text] = self.embedding_cache.get(text)
+        timings = {}
+        missing = [text for text, emb in embs.items() if emb is None]
+        if missing:
+            start = time.perf_counter()
+            for text, emb in zip(missing, self._encode_queries(missing)):
+                embs[text] = emb[None, :]
+                self.embedding_cache.put(text, embs[text])
+            timings["encode"] = time.perf_counter() - start
+
+        k_max = max(k for _, k in items)
+        if k_max:
+            start = time.perf_counter()
+            searched = [i for i, (_, k) in enumerate(items) if k]
+            xq = np.vstack([embs[items[i][0]] for i in searched])
+            scores, idxs = self.index.search(xq, k_max)
+            hits = dict(zip(searched, zip(idxs, scores)))
+            timings["search"] = time.perf_counter() - start
+
+        results = []
+        for i, (text, k) in enumerate(items):
+            hit = None
+            if k:
+                row_idxs, row_scores = hits[i]
+                row_idxs, row_scores = row_idxs[:k], row_scores[:k]
+                keep = row_idxs >= 0
+                hit = (row_idxs[keep].copy(), row_scores[keep].copy())
+            results.append((embs[text], hit, timings))
+        return results
+
+    def _dense_search(self, question, k):
+        text = normalize_query(question)
+        key = ("dense", text, k)
+        hit = self.result_cache.get(key)
+        count("result_cache_hits" if hit is not None else "result_cache_misses")
+        if hit is None:
+            version = self.index_version
+            if self._batcher is not None:
+                _, hit = self._batched((text, k))
+            else:
+                q_emb = self.encode_query(question)
+                with span("search"):
+                    scores, idxs = self.index.search(q_emb, k)
+                keep = idxs[0] >= 0
+                hit = (idxs[0][keep].copy(), scores[0][keep].copy())
+            # Skip caching a result computed against an index that was swapped meanwhile
+            if version == self.index_version:
+                self.result_cache.put(key, hit)
+        return hit
+
+    def _sparse_search(self, question, k):
+        if self.bm25 is None:
+            raise RuntimeError("No BM25 index; build with Retriever(sparse=True).update_index()")
+        key = ("sparse", normalize_query(question), k)
+        hit = self.result_cache.get(key)
+        count("result_cache_hits" if hit is not None else "result_cache_misses")
+        if hit is None:
+            version = self.index_version
+            with span("sparse_search"):
+                rows, scores = self.bm25.search(question, k)
+            hit = (np.array(rows, dtype=np.int64), np.array(scores, dtype=np.float32))
+            if version == self.index_version:
+                self.result_cache.put(key, hit)
+        return hit
+
+    def _cosine_scores(self, question, rows):
+        """Dense similarity for rows found only by BM25, so evidence scoring stays on one scale."""
+        q_emb = self.encode_query(question)[0]
+        scores = []
+        for row in rows:
+            try:
+                scores.append(float(self.index.reconstruct(int(row)) @ q_emb))
+            except RuntimeError:
+                scores.append(0.0)
+        return scores
+
+    def _search_parameters(self, sel):
+        if needs_training(self.index_type):
+            return faiss.SearchParametersIVF(sel=sel, nprobe=self.search_params["nprobe"])
+        if self.index_type == "hnsw":
+            return faiss.SearchParametersHNSW(sel=sel, efSearch=self.search_params["efSearch"])
+        return faiss.SearchParameters(sel=sel)
+
+    def _filtered_search(self, question, k, rows, sel=None):
+        """Dense top-k restricted to the given FAISS rows (sel: a prebuilt selector for them)."""
+        q_emb = self.encode_query(question)
+        rows = np.asarray(rows, dtype=np.int64)
+        with span("search"):
+            # Small subsets: exact scores from the stored vectors (IVF/HNSW selectors can miss them)
+            if len(rows) <= self.exact_filter_limit:
+                try:
+                    scores = self.index.reconstruct_batch(rows) @ q_emb[0]
+                    top = np.argsort(-scores)[:k]
+                    return rows[top], scores[top]
+                except RuntimeError:
+                    pass
+            sel = sel or faiss.IDSelectorBatch(rows)
+            scores, idxs = self.index.search(q_emb, k, params=self._search_parameters(sel))
+        keep = idxs[0] >= 0
+        return idxs[0][keep].copy(), scores[0][keep].copy()
+
+    def _drug_search(self, question, k, drugs, sections=None):
+        """Top chunks for each drug's labels, interleaved by rank so every drug is represented.
+        With sections, each drug's chunks are narrowed to those sections, unless its labels
+        have none of them (then all its chunks are searched)."""
+        per_drug = []
+        for name in dict.fromkeys(normalize_name(d) for d in drugs):
+            key = ("drug", normalize_query(question), k, name, sections)
+            hit = self.result_cache.get(key)
+            if hit is None:
+                rows = self.drug_postings.rows(name) if self.drug_postings else []
+                if sections and len(rows):
+                    in_sections = rows[self._in_sections(rows, sections)]
+                    rows = in_sections if len(in_sections) else rows
+                hit = self._filtered_search(question, k, rows) if len(rows) else None
+                self.result_cache.put(key, hit)
+            if hit is not None:
+                per_drug.append(hit)
+        if not per_drug:
+            return None
+
+        picked = {}
+        for rank in range(k):
+            for idxs, scores in per_drug:
+                if rank < len(idxs) and len(picked) < max(k, len(per_drug)):
+                    picked.setdefault(int(idxs[rank]), float(scores[rank]))
+        ranked = sorted(picked.items(), key=lambda item: item[1], reverse=True)
+        return [row for row, _ in ranked], [score for _, score in ranked]
+
+    def _in_sections(self, rows, sections):
+        """Mask of the (few) rows that belong to any of the sections. Section postings are
+        sorted, so this is a binary search per row rather than a pass over a whole section."""
+        mask = np.zeros(len(rows), dtype=bool)
+        if self.section_postings is None:
+            return mask
+        for section in sections:
+            posting = self.section_postings.rows(section)
+            if len(posting):
+                pos = np.minimum(np.searchsorted(posting, rows), len(posting) - 1)
+                mask |= posting[pos] == rows
+        return mask
+
+    def _section_search(self, question, k, sections):
+        """Dense top-k over the chunks of the given label sections only. The ID selector for a
+        section filter is built once per snapshot; FAISS skips every other vector."""
+        key = ("section", normalize_query(question), k, sections)
+        hit = self.result_cache.get(key)
+        if hit is None:
+            rows = self.section_rows(sections)
+            if not len(rows):
+                return None
+            sel = None
+            if len(rows) > self.exact_filter_limit:
+                sel = self._section_selectors.get(sections)
+                if sel is None:
+                    sel = self._section_selectors.setdefault(sections, faiss.IDSelectorBatch(rows))
+            hit = self._filtered_search(question, k, rows, sel)
+            self.result_cache.put(key, hit)
+        return hit
+
+    def section_rows(self, sections):
+        """FAISS rows of every chunk from any of these label sections, e.g. ("drug_interactions",)."""
+        self._ready()
+        if self.section_postings is None:
+            return np.empty(0, dtype=np.int64)
+        rows = [self.section_postings.rows(s) for s in sections]
+        return np.unique(np.concatenate(rows)) if rows else np.empty(0, dtype=np.int64)
+
+    def term_overlaps(self, rows, terms):
+        """Number of the key terms found in each FAISS row's chunk, from the term index built
+        with the snapshot (None if it has none). Read under the swap lock, so a reload
+        cannot mix two snapshots' terms."""
+        self._ready()
+        with self._swap_lock.read():
+            if self.term_index is None:
+                return None
+            return self.term_index.overlap_counts(rows, term_ids(terms))
+
+    def drug_rows(self, name):
+        """FAISS rows of every chunk labelled with this drug name."""
+        self._ready()
+        return self.drug_postings.rows(normalize_name(name)) if self.drug_postings else np.empty(0, dtype=np.int64)
+
+    def get_relevant_documents(self, question, k=5, mode=None, dense_k=None, sparse_k=None, drugs=None,
+                               sections=None, rerank=None):
+        """Top-k chunks for a question.
+
+        mode: "dense" (FAISS), "sparse" (BM25) or "hybrid" (both legs fused with RRF).
+        dense_k / sparse_k: candidates per hybrid leg (default k); 0 skips that leg.
+        drugs: restrict the dense search to these drugs' chunks, with every drug that has
+        indexed chunks guaranteed a place in the results.
+        sections: restrict the dense search to chunks of these label sections (OpenFDA field
+        names, e.g. "drug_interactions"); with drugs, per drug where its labels have them.
+        rerank: two-stage retrieval (default: on if the Retriever has a reranker). The first
+        stage fetches rerank_candidates chunks, the cross-encoder reorders them and k becomes
+        an upper bound: the list is cut at the rerank threshold or score gap.
+        "score" is always the dense cosine similarity; hybrid results also carry "rrf_score"
+        and reranked results "rerank_score" (and come in that order).
+        """
+        self._ready()
+        sections = tuple(sections) if sections else None
+        # A snapshot swap waits for the queries in flight; none sees half of each index
+        with self._swap_lock.read():
+            return self._search_documents(question, k, mode, dense_k, sparse_k, drugs, sections, rerank)
+
+    def _search_documents(self, question, k, mode, dense_k, sparse_k, drugs, sections, rerank):
+        if rerank is None:
+            rerank = self.reranker is not None
+        if not rerank or k <= 0:
+            return self._first_stage(question, k, mode, dense_k, sparse_k, drugs, sections)
+        if self.reranker is None:
+            raise ValueError("This Retriever was created without a reranker (rerank=True)")
+
+        n = max(k, self.rerank_candidates)
+        docs = self._first_stage(question, n, mode, dense_k, sparse_k, drugs, sections)
+        keep = set()
+        if drugs:
+            # The best reranked chunk of every requested drug survives the cut
+            rows = {d["row"]: d for d in docs}
+            scores = dict(zip(rows, self.reranker.score(question, docs)))
+            for name in drugs:
+                labelled = [r for r in self.drug_rows(name).tolist() if r in rows]
+                if labelled:
+                    keep.add(rows[max(labelled, key=scores.get)]["id"])
+        return self.reranker.rerank(question, docs, k, self.rerank_min_k, self.rerank_threshold,
+                                    self.rerank_gap, keep)
+
+    def _first_stage(self, question, k, mode, dense_k, sparse_k, drugs, sections):
+        if drugs:
+            found = self._drug_search(question, k, drugs, sections)
+            if found is not None:
+                return self._to_documents(*found)
+        if sections:
+            found = self._section_search(question, k, sections)
+            if found is not None:
+                return self._to_documents(*found)
+
+        mode = mode or self.retrieval_mode
+        dense_k = k if dense_k is None else dense_k
+        sparse_k = k if sparse_k is None else sparse_k
+        if mode == "hybrid" and not sparse_k:
+            mode = "dense"
+        elif mode == "hybrid" and not dense_k:
+            mode = "sparse"
+
+        if mode == "dense":
+            idxs, scores = self._dense_search(question, k)
+            return self._to_documents(idxs, scores)
+
+        if mode == "sparse":
+            idxs, _ = self._sparse_search(question, k)
+            return self._to_documents(idxs, self._cosine_scores(question, idxs))
+
+        if mode != "hybrid":
+            raise ValueError(f"Unknown retrieval mode {mode!r}")
+
+        dense_rows, dense_scores = self._dense_search(question, dense_k)
+        sparse_rows, _ = self._sparse_search(question, sparse_k)
+        fused = rrf_fuse([dense_rows.tolist(), sparse_rows.tolist()], k=k, rrf_k=self.rrf_k)
+
+        cosine = dict(zip(dense_rows.tolist(), dense_scores.tolist()))
+        missing = [row for row, _ in fused if row not in cosine]
+        cosine.update(zip(missing, self._cosine_scores(question, missing)))
 
-        scores, idxs = self.index.search(q_emb, k)
+        rows = [row for row, _ in fused]
+        docs = self._to_documents(rows, [cosine[row] for row in rows])
+        rrf = dict(fused)
+        for d in docs:
+            d["rrf_score"] = rrf[d["row"]]
+        return docs
 
+    def _to_documents(self, idxs, scores):
         results = []
-        for score, i in zip(scores[0], idxs[0]):
-            if i >= len(self.metadatas):
+        for score, i in zip(scores, idxs):
+            doc = self.metadatas.get(int(i))
+            if doc is None:
                continue
-            doc = self.metadatas[i]
-            results.append({
+            result = {
+                "row": int(i),
+                "id": doc["id"],
                 "title": doc["title"],
                 "content": doc["content"],
                 "score": float(score)
-        })
+            }
+            for field in ("section", "set_id"):
+                if field in doc:
+                    result[field] = doc[field]
+            results.append(result)
 
+        count("docs_retrieved", len(results))
         return results
@@ -0,0 +1,81 @@
+import os
+import re
+import sys
+import json
+import zlib
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.utils import Retriever  # noqa: E402
+
+
+class HashEmbedder:
+    """Bag-of-words stand-in for MiniLM: every word hashes to one of `dim` dimensions.
+    Deterministic and offline, so tests never download a model."""
+
+    def __init__(self, dim=64):
+        self.dim = dim
+        self.texts = 0
+
+    def encode(self, texts, batch_size=64, convert_to_numpy=True, show_progress_bar=False, **kwargs):
+        if isinstance(texts, str):
+            texts = [texts]
+        self.texts += len(texts)
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        out[:, 0] = 0.1
+        for i, text in enumerate(texts):
+            for word in re.findall(r"[a-z0-9]+", text.lower()):
+                out[i, 1 + zlib.crc32(word.encode()) % (self.dim - 1)] += 1.0
+        return out
+
+
+def chunk(id, title, content, section=None, drugs=None):
+    c = {"id": id, "title": title, "content": content, "drugs": drugs or [title]}
+    if section:
+        c["section"] = section
+    return c
+
+
+def write_chunks(chunk_dir, fname, chunks):
+    os.makedirs(chunk_dir, exist_ok=True)
+    with open(os.path.join(chunk_dir, fname), "w", encoding="utf-8") as f:
+        for c in chunks:
+            f.write(json.dumps(c) + "\n")
+
+
+@pytest.fixture
+def chunk_dir(tmp_path):
+    d = str(tmp_path / "openfda" / "chunk")
+    write_chunks(d, "a.jsonl", [
+        chunk("a_0", "Warfarin", "[Indications]: warfarin prevents blood clots", "indications_and_usage"),
+        chunk("a_1", "Warfarin", "[Drug Interactions]: aspirin increases warfarin bleeding risk",
+              "drug_interactions"),
+        chunk("a_2", "Warfarin", "[Adverse Reactions]: bleeding bruising", "adverse_reactions"),
+    ])
+    write_chunks(d, "b.jsonl", [
+        chunk("b_0", "Metformin", "[Indications]: metformin lowers blood glucose", "indications_and_usage"),
+        chunk("b_1", "Metformin", "[Adverse Reactions]: metformin nausea diarrhea", "adverse_reactions"),
+        chunk("b_2", "Metformin", "[Dosage]: metformin 500 mg twice daily with meals",
+              "dosage_and_administration"),
+    ])
+    return d
+
+
+@pytest.fixture
+def make_retriever():
+    def make(chunk_dir, **kwargs):
+        kwargs.setdefault("batch_window", None)
+        kwargs.setdefault("index_type", "flat")
+        r = Retriever(chunk_dir, lazy=True, **kwargs)
+        r._model = HashEmbedder()
+        return r
+    return make
+
+
+@pytest.fixture
+def retriever(chunk_dir, make_retriever):
+    r = make_retriever(chunk_dir)
+    r.update_index()
+    return r
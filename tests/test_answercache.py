@@ -0,0 +1,60 @@
+import time
+import numpy as np
+from src.answercache import SemanticAnswerCache
+
+
+def emb(*values):
+    v = np.zeros(4, dtype=np.float32)
+    v[:len(values)] = values
+    return v / np.linalg.norm(v)
+
+
+DOCS = [{"id": "a_1"}, {"id": "a_2"}]
+
+
+def test_similar_question_with_same_evidence_hits():
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.put(emb(1, 0.1), "warfarin aspirin", DOCS, "answer", version=1)
+    queries = []
+
+    def retrieve(cq):
+        queries.append(cq)
+        return list(reversed(DOCS))
+
+    assert cache.get(emb(1, 0.12), 1, retrieve) == ("answer", "warfarin aspirin", [DOCS[1], DOCS[0]])
+    assert queries == ["warfarin aspirin"]
+    # Dissimilar question: no candidate, no retrieval
+    assert cache.get(emb(0, 1), 1, retrieve) == (None, None, None)
+    assert queries == ["warfarin aspirin"]
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_changed_evidence_is_a_miss():
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.put(emb(1), "warfarin aspirin", DOCS, "answer", version=1)
+    assert cache.get(emb(1), 1, lambda cq: [{"id": "a_1"}, {"id": "c_0"}]) == (None, None, None)
+    assert cache.stats()["evidence_misses"] == 1
+
+
+def test_new_index_version_drops_entries_and_old_requests_are_ignored():
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.put(emb(1), "q", DOCS, "answer", version=1)
+    assert cache.get(emb(1), 2, lambda cq: DOCS) == (None, None, None)
+    assert len(cache) == 0
+    # A request that started before the reload must not repopulate the cache
+    cache.put(emb(1), "q", DOCS, "stale", version=1)
+    assert len(cache) == 0
+
+
+def test_lru_and_ttl_eviction(monkeypatch):
+    cache = SemanticAnswerCache(maxsize=2, threshold=0.9, ttl=10)
+    for i, v in enumerate([emb(1), emb(0, 1), emb(0, 0, 1)]):
+        cache.put(v, f"q{i}", DOCS, f"answer{i}", version=1)
+    assert len(cache) == 2
+    assert cache.get(emb(1), 1, lambda cq: DOCS)[0] is None
+    assert cache.get(emb(0, 0, 1), 1, lambda cq: DOCS)[0] == "answer2"
+
+    now = time.monotonic()
+    monkeypatch.setattr("src.answercache.time.monotonic", lambda: now + 11)
+    assert cache.get(emb(0, 0, 1), 1, lambda cq: DOCS)[0] is None
+    assert len(cache) == 1
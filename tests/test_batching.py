@@ -0,0 +1,52 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from src.batcher import MicroBatcher
+
+
+def test_concurrent_calls_share_one_batch():
+    gate = threading.Event()
+    sizes = []
+
+    def fn(items):
+        gate.wait(5)
+        sizes.append(len(items))
+        return [x * 2 for x in items]
+
+    batcher = MicroBatcher(fn, window=0.05, max_batch=8)
+    first = batcher.submit(0)  # the gate holds the worker on this batch while the rest queue up
+    futures = [batcher.submit(i) for i in range(1, 6)]
+    gate.set()
+    assert first.result() == 0
+    assert [f.result() for f in futures] == [2, 4, 6, 8, 10]
+    # The worker may or may not have picked up the first item alone before the rest arrived
+    assert sizes in ([6], [1, 5])
+    batcher.close()
+    with pytest.raises(RuntimeError):
+        batcher.submit(1)
+
+
+def test_a_failing_batch_fails_every_caller():
+    def fn(items):
+        raise ValueError("boom")
+
+    batcher = MicroBatcher(fn, window=0.01)
+    futures = [batcher.submit(i) for i in range(3)]
+    for f in futures:
+        with pytest.raises(ValueError, match="boom"):
+            f.result()
+    batcher.close()
+
+
+def test_batched_retrieval_matches_serial(chunk_dir, make_retriever):
+    questions = ["warfarin bleeding", "metformin nausea", "blood glucose", "aspirin warfarin",
+                 "metformin dosage meals", "blood clots"] * 3
+    serial = make_retriever(chunk_dir)
+    serial.update_index()
+    expected = [serial.get_relevant_documents(q, 3) for q in questions]
+
+    batched = make_retriever(chunk_dir, batch_window=0.01, allow_build=False)
+    with ThreadPoolExecutor(8) as pool:
+        got = list(pool.map(lambda q: batched.get_relevant_documents(q, 3), questions))
+    assert got == expected
+    assert batched._batcher.stats()["items"] >= len(set(questions))
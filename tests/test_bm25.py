@@ -0,0 +1,70 @@
+import os
+import shutil
+import pytest
+from conftest import chunk, write_chunks
+from src.bm25 import rrf_fuse
+from src.trace import trace
+
+
+class FakeBM25:
+    """Stands in for the Lucene searcher: returns fixed rows, best first."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = 0
+
+    def search(self, query, k):
+        self.calls += 1
+        rows = self.rows[:k]
+        return rows, [float(len(rows) - i) for i in range(len(rows))]
+
+    def close(self):
+        pass
+
+
+def fake_lucene_build(collection_dir, index_dir, threads=4):
+    # The "index" is a copy of the collection, so tests can see what it was built from
+    shutil.rmtree(index_dir, ignore_errors=True)
+    shutil.copytree(collection_dir, index_dir)
+
+
+def test_hybrid_fuses_both_legs_with_rrf(retriever):
+    retriever.bm25 = FakeBM25([5, 2, 4])
+    dense_rows, _ = retriever._dense_search("metformin nausea", 3)
+
+    with trace() as t:
+        docs = retriever.get_relevant_documents("metformin nausea", 3, mode="hybrid")
+        again = retriever.get_relevant_documents("metformin nausea", 3, mode="hybrid")
+
+    fused = rrf_fuse([dense_rows.tolist(), [5, 2, 4]], k=3)
+    assert [(d["row"], d["rrf_score"]) for d in docs] == fused
+    # Rows only BM25 found still get a dense cosine score
+    assert all(isinstance(d["score"], float) for d in docs)
+    assert again == docs and retriever.bm25.calls == 1
+    # The dense leg was cached by the search above; the sparse leg misses once
+    assert t.counters["result_cache_hits"] == 3 and t.counters["result_cache_misses"] == 1
+
+
+def test_sparse_without_bm25_index_raises(retriever):
+    with pytest.raises(RuntimeError, match="No BM25 index"):
+        retriever.get_relevant_documents("warfarin", 2, mode="sparse")
+
+
+def test_bm25_only_snapshot_survives_pruning(chunk_dir, make_retriever, monkeypatch):
+    monkeypatch.setattr("src.utils.build_lucene_index", fake_lucene_build)
+    r = make_retriever(chunk_dir, keep_snapshots=1)
+    r.update_index()
+
+    # Turning on the sparse leg later only builds BM25, in a snapshot of its own
+    r.sparse = True
+    assert r.update_index() == {"added": [], "removed": []}
+    assert r.snapshot == "v000002" and os.listdir(r.snapshots_dir) == ["v000002"]
+    assert sorted(os.listdir(r.bm25_dir)) == ["a.jsonl", "b.jsonl"]
+    assert os.path.dirname(r.metadatas.bin_path) == r.snapshot_dir
+    assert r.get_relevant_documents("metformin nausea diarrhea adverse reactions", 1)[0]["id"] == "b_1"
+
+    # The next update copies the served metadata: it must not live in the pruned snapshot
+    write_chunks(chunk_dir, "c.jsonl", [chunk("c_0", "Simvastatin", "simvastatin myopathy")])
+    assert r.update_index() == {"added": ["c.jsonl"], "removed": []}
+    assert sorted(os.listdir(r.bm25_dir)) == ["a.jsonl", "b.jsonl", "c.jsonl"]
+    assert r.get_relevant_documents("simvastatin myopathy", 1)[0]["id"] == "c_0"
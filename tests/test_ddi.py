@@ -0,0 +1,79 @@
+import os
+import json
+import asyncio
+import pytest
+from src.medrag import MedRAG
+
+
+@pytest.fixture
+def rag(retriever):
+    m = MedRAG(llm_name="stub", rag=False, lazy=True, concept_cache_size=0, answer_cache_size=0)
+    m.retrieval_system = retriever
+    return m
+
+
+@pytest.mark.parametrize("question", [
+    "What are the adverse reactions of metformin?",
+    "metformin vs placebo",
+    "metformin versus placebo",
+    "dosage of metformin in CVS pharmacy",
+    "Should metformin be taken together with meals?",
+])
+def test_single_drug_questions_are_not_filtered_to_interactions(rag, question):
+    assert not rag._is_ddi_query(question, [], question)
+    assert rag._drug_filters(question, question) is None
+
+
+@pytest.mark.parametrize("question", [
+    "Does warfarin interact with alcohol?",
+    "Any interactions of warfarin?",
+    "Can warfarin be co-administered with NSAIDs?",
+])
+def test_single_drug_interaction_questions_search_interaction_sections(rag, question):
+    assert rag._is_ddi_query(question, [], question)
+    assert rag._drug_filters(question, question) == {"drugs": ["warfarin"], "sections": ("drug_interactions",)}
+
+
+def test_two_drugs_always_filter_to_both(rag):
+    q = "warfarin and metformin"
+    assert rag._drug_filters(q, q) == {"drugs": ["warfarin", "metformin"], "sections": ("drug_interactions",)}
+    # Metformin's labels have no interaction section: its other chunks stand in
+    docs = rag._retrieve(q, 2, q)
+    assert {d["section"] for d in docs if d["title"] == "Warfarin"} == {"drug_interactions"}
+    assert any(d["title"] == "Metformin" for d in docs)
+
+
+def test_adverse_reactions_question_keeps_adverse_reaction_chunks(rag):
+    q = "What are the adverse reactions of metformin?"
+    assert "adverse_reactions" in {d.get("section") for d in rag._retrieve(q, 5, q)}
+
+
+@pytest.mark.parametrize("question", [
+    "Does warfarin interact with aspirin?",
+    "warfarin and metformin",
+    "What are the adverse reactions of metformin?",
+])
+def test_async_retrieval_matches_sync_when_concepts_fall_back_to_the_question(rag, question):
+    # A failed or no-op concept extraction returns the question itself
+    async def concepts(q):
+        return q
+    rag._aextract_medical_concepts = concepts
+
+    docs, concept_query = asyncio.run(rag._aretrieve(question, 3))
+    assert concept_query == question
+    assert [d["id"] for d in docs] == [d["id"] for d in rag._retrieve_merged(question, 3, question)]
+    if rag._drug_filters(question, question):
+        assert [d["id"] for d in docs] == [d["id"] for d in rag._retrieve(question, 3, question)]
+
+
+def test_common_word_brand_names_do_not_trigger_drug_filters(chunk_dir, make_retriever):
+    # Ingestion lexicons contain OTC brand names that are ordinary words
+    with open(os.path.join(os.path.dirname(chunk_dir), "lexicon.json"), "w", encoding="utf-8") as f:
+        json.dump(["Warfarin", "Metformin", "Cold", "Pain Relief"], f)
+    r = make_retriever(chunk_dir)
+    r.update_index()
+    m = MedRAG(llm_name="stub", rag=False, lazy=True, concept_cache_size=0, answer_cache_size=0)
+    m.retrieval_system = r
+
+    q = "Is warfarin safe to take with a cold or for pain relief?"
+    assert m._drug_filters(q, q) is None
@@ -0,0 +1,41 @@
+import os
+import numpy as np
+import pytest
+from conftest import HashEmbedder
+from src.embedding import encode_files
+from src.utils import concat
+
+
+def test_encode_files_in_process(chunk_dir, tmp_path):
+    jobs = [(os.path.join(chunk_dir, f), str(tmp_path / f"{f}.npy")) for f in ("a.jsonl", "b.jsonl")]
+    model = HashEmbedder()
+
+    out = list(encode_files(jobs, concat, model=model, workers=1, batch_size=2))
+
+    assert out == [(jobs[0][0], 3), (jobs[1][0], 3)]
+    assert model.texts == 6
+    for _, path in jobs:
+        emb = np.load(path)
+        assert emb.shape == (3, model.dim)
+        assert not os.path.exists(path + ".tmp")
+    expected = model.encode([concat("Warfarin", "[Indications]: warfarin prevents blood clots")])
+    np.testing.assert_allclose(np.load(jobs[0][1])[0], expected[0])
+
+
+@pytest.mark.parametrize("workers, n_files, loads_model", [(1, 2, True), (2, 1, True), (2, 2, False)])
+def test_parent_loads_the_model_only_to_encode_in_process(chunk_dir, make_retriever, monkeypatch,
+                                                          workers, n_files, loads_model):
+    r = make_retriever(chunk_dir, encode_workers=workers)
+    r._model = None
+    monkeypatch.setattr("src.utils.make_embedder", lambda *args, **kwargs: HashEmbedder())
+    calls = []
+
+    def fake_encode_files(jobs, text_fn, model=None, **kwargs):
+        calls.append(model)
+        return iter(())
+    monkeypatch.setattr("src.utils.encode_files", fake_encode_files)
+
+    files = ["a.jsonl", "b.jsonl"][:n_files]
+    r._encode_checkpoints(files, {f: {"sha1": "0" * 40} for f in files})
+    assert (calls[0] is not None) == loads_model
+    assert (r._model is not None) == loads_model
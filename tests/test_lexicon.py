@@ -0,0 +1,9 @@
+from src.lexicon import DrugMatcher
+
+
+def test_common_word_brand_names_never_match():
+    matcher = DrugMatcher(["Warfarin", "Cold", "Pain Relief", "Cold and Flu Relief", "12 Hour Nasal",
+                           "Tylenol Cold", "Folic Acid"])
+    assert len(matcher) == 3
+    assert matcher.find("Can I take warfarin for a cold and pain relief?") == ["warfarin"]
+    assert matcher.find("Tylenol Cold with folic acid") == ["tylenol cold", "folic acid"]
@@ -0,0 +1,95 @@
+import json
+import asyncio
+import pytest
+from src import trace
+from src.server import MedRAGService, create_app, MAX_K
+
+
+class SlowModel:
+    """Answers once `release` is set; enough of MedRAG for the service."""
+
+    retrieval_system = None
+    answer_cache = None
+
+    def __init__(self):
+        self.release = asyncio.Event()
+
+    async def amedrag_answer(self, question, k=5, timeout=None):
+        await self.release.wait()
+        return f"answer to {question}"
+
+
+async def call(app, path, body):
+    messages = [{"type": "http.request", "body": json.dumps(body).encode(), "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+    await app({"type": "http", "method": "POST", "path": path}, receive, send)
+    return sent[0]["status"], json.loads(sent[1]["body"])
+
+
+def serve(test, **kwargs):
+    async def run():
+        model = SlowModel()
+        service = MedRAGService(model, **kwargs)
+        await service.start()
+        try:
+            return await test(create_app(service), model)
+        finally:
+            await service.stop()
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("body", [
+    {"question": "warfarin", "k": 0},
+    {"question": "warfarin", "k": -3},
+    {"question": "warfarin", "k": MAX_K + 1},
+    {"question": "warfarin", "k": "many"},
+    {"question": "warfarin", "timeout": 0},
+    {"question": "warfarin", "timeout": -1},
+    {"question": "warfarin", "timeout": "soon"},
+    {"question": "warfarin", "timeout": "nan"},
+    {"question": "   "},
+    {},
+])
+def test_bad_requests_are_400(body):
+    async def test(app, model):
+        return await call(app, "/v1/answer", body)
+    status, payload = serve(test)
+    assert status == 400 and payload["error"].startswith("bad request")
+
+
+def test_full_queue_is_429_and_queued_requests_still_finish():
+    async def test(app, model):
+        running = asyncio.create_task(call(app, "/v1/answer", {"question": "a"}))
+        await asyncio.sleep(0.05)  # a worker picks it up
+        queued = asyncio.create_task(call(app, "/v1/answer", {"question": "b"}))
+        await asyncio.sleep(0.05)  # the queue is now full
+        shed = await call(app, "/v1/answer", {"question": "c"})
+        model.release.set()
+        return shed, await running, await queued
+    shed, running, queued = serve(test, answer_workers=1, answer_queue=1)
+    assert shed[0] == 429
+    assert running[0] == 200 and running[1]["answer"] == "answer to a"
+    assert queued[0] == 200 and queued[1]["answer"] == "answer to b"
+
+
+def test_missed_deadline_is_504():
+    async def test(app, model):
+        return await call(app, "/v1/answer", {"question": "a", "timeout": 0.05})
+    status, payload = serve(test)
+    assert status == 504 and payload["error"] == "deadline exceeded"
+
+
+def test_service_unregisters_its_metrics_exporter():
+    before = list(trace._exporters)
+
+    async def test(app, model):
+        return list(trace._exporters)
+    during = serve(test)
+    assert len(during) == len(before) + 1
+    assert trace._exporters == before
@@ -0,0 +1,99 @@
+import os
+import json
+import time
+import threading
+import pytest
+from conftest import HashEmbedder, chunk, write_chunks
+
+
+def read_current(r):
+    with open(r.current_path, encoding="utf-8") as f:
+        return f.read()
+
+
+def test_update_publishes_new_snapshot(retriever, chunk_dir):
+    assert retriever.snapshot == "v000001"
+    write_chunks(chunk_dir, "c.jsonl", [chunk("c_0", "Simvastatin", "simvastatin grapefruit juice myopathy")])
+
+    assert retriever.update_index() == {"added": ["c.jsonl"], "removed": []}
+    assert read_current(retriever) == retriever.snapshot == "v000002"
+    assert retriever.index.ntotal == 7
+    assert retriever.get_relevant_documents("simvastatin grapefruit", 1)[0]["id"] == "c_0"
+    with open(retriever.manifest_path, encoding="utf-8") as f:
+        assert json.load(f)["snapshot"] == "v000002"
+
+
+def test_failed_update_leaves_served_snapshot_untouched(retriever, chunk_dir):
+    before = retriever.get_relevant_documents("aspirin warfarin bleeding", 3)
+    files = dict(retriever.manifest["files"])
+    index = retriever.index
+
+    # a.jsonl changes (its rows are removed first) and the encoder dies half way
+    write_chunks(chunk_dir, "a.jsonl", [chunk("a_0", "Warfarin", "warfarin changed label text")])
+
+    def crash(*args, **kwargs):
+        raise RuntimeError("encoder crashed")
+    retriever.model.encode = crash
+    retriever.result_cache.clear()
+
+    with pytest.raises(RuntimeError, match="encoder crashed"):
+        retriever.update_index()
+
+    assert read_current(retriever) == retriever.snapshot == "v000001"
+    assert os.listdir(retriever.snapshots_dir) == ["v000001"]
+    assert retriever.index is index and retriever.index.ntotal == 6
+    assert retriever.manifest["files"] == files
+    assert retriever.get_relevant_documents("aspirin warfarin bleeding", 3) == before
+
+
+def test_reader_picks_up_published_snapshot(retriever, chunk_dir, make_retriever):
+    reader = make_retriever(chunk_dir, allow_build=False)
+    reader._ready()
+    os.remove(os.path.join(chunk_dir, "b.jsonl"))
+    retriever.update_index()
+
+    assert reader.reload_if_changed()
+    assert reader.snapshot == "v000002"
+    assert all(d["title"] == "Warfarin" for d in reader.get_relevant_documents("metformin", 3))
+
+
+def test_first_build_is_a_single_flat_build(chunk_dir, make_retriever):
+    # What buildindex.py does: a lazy Retriever that never builds on its own
+    r = make_retriever(chunk_dir, index_type=None, allow_build=False)
+    assert r.update_index(rebuild=True) == {"added": ["a.jsonl", "b.jsonl"], "removed": []}
+    assert r.model.texts == 6
+    assert r.manifest["index_type"] == "flat"
+    assert os.listdir(r.snapshots_dir) == ["v000001"]
+
+
+def test_reload_while_a_query_loads_the_lazy_model(retriever, chunk_dir, make_retriever, monkeypatch):
+    reader = make_retriever(chunk_dir, allow_build=False)
+    reader._ready()
+    reader._model = None
+    monkeypatch.setattr("src.utils.make_embedder", lambda *args: HashEmbedder())
+
+    # Hold the query inside the read lock, just before it needs the model
+    in_query, go = threading.Event(), threading.Event()
+    cache_get = reader.embedding_cache.get
+
+    def get(key, *args):
+        in_query.set()
+        go.wait(5)
+        return cache_get(key, *args)
+    reader.embedding_cache.get = get
+
+    query = threading.Thread(target=reader.get_relevant_documents, args=("warfarin", 2), daemon=True)
+    query.start()
+    assert in_query.wait(5)
+    write_chunks(chunk_dir, "c.jsonl", [chunk("c_0", "Simvastatin", "simvastatin myopathy")])
+    retriever.update_index()
+    reload = threading.Thread(target=reader.reload_if_changed, daemon=True)
+    reload.start()
+    while not reader._swap_lock._waiting and reload.is_alive():
+        time.sleep(0.001)
+    go.set()
+
+    query.join(5)
+    reload.join(5)
+    assert not query.is_alive() and not reload.is_alive()
+    assert reader.snapshot == "v000002"
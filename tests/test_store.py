@@ -0,0 +1,37 @@
+import os
+from src.store import MetadataStore, MetadataStoreWriter
+
+
+def build(prefix, records, base=None, removed=()):
+    writer = MetadataStoreWriter(prefix, base=base)
+    writer.remove(list(removed))
+    for row, record in records.items():
+        writer.add(row, record)
+    writer.commit()
+    return MetadataStore(prefix)
+
+
+def test_small_updates_append_without_rewriting(tmp_path):
+    prefix = str(tmp_path / "meta")
+    store = build(prefix, {i: {"id": f"r{i}"} for i in range(20)})
+    size = os.path.getsize(store.bin_path)
+
+    store = build(prefix, {20: {"id": "r20"}}, base=store, removed=[0])
+    assert os.path.getsize(store.bin_path) > size
+    assert store.get(0) is None and store.get(1) == {"id": "r1"} and store.get(20) == {"id": "r20"}
+
+
+def test_repeated_replacements_keep_the_blob_bounded(tmp_path):
+    prefix = str(tmp_path / "meta")
+    store = build(prefix, {i: {"id": f"r{i}", "v": 0} for i in range(20)})
+    size = os.path.getsize(store.bin_path)
+
+    # Each round replaces half of the rows, as an update of a changed chunk file does
+    for v in range(1, 11):
+        rows = range(10) if v % 2 else range(10, 20)
+        store = build(prefix, {i: {"id": f"r{i}", "v": v} for i in rows}, base=store, removed=rows)
+        assert os.path.getsize(store.bin_path) < 2 * size
+
+    assert [store.get(i)["v"] for i in (0, 19)] == [9, 10]
+    assert list(store.rows()) == list(range(20))
+    assert not os.path.exists(f"{prefix}.bin.compact.tmp")
@@ -0,0 +1,44 @@
+import re
+import pytest
+from src.answercache import SemanticAnswerCache
+from src.medrag import AnswerStream, MedRAG
+
+
+def run_stream(text, size):
+    stream = AnswerStream()
+    out = list(stream.start())
+    for i in range(0, len(text), size):
+        out += stream.feed(text[i:i + size])
+    out += stream.finish()
+    return "".join(out), stream.severity_score
+
+
+@pytest.mark.parametrize("text", [
+    "**Summary**\n• Warfarin and aspirin.\n\nSEVERITY_SCORE: 8",
+    "Report.  \n\nSEVERITY_SCORE: 7\n\nMore text SEVERITY_SCORE: 3 trailing.",
+    "Report SEVERITY_SCORE: high, not a number",
+    "SEVERITY_SCORE: 2 only a tag first",
+    "No tag at all, ends with spaces   \n",
+])
+@pytest.mark.parametrize("size", [1, 3, 7, 1000])
+def test_stream_strips_severity_tags_like_extract_severity(text, size):
+    rag = MedRAG(llm_name="stub", rag=False, lazy=True, concept_cache_size=0, answer_cache_size=0)
+    expected, score = rag._extract_severity(text.strip())
+    streamed, streamed_score = run_stream(text, size)
+    assert streamed == re.sub(r"\n{3,}", "\n\n", expected)
+    assert streamed_score == score
+    assert "SEVERITY_SCORE: 3" not in streamed
+
+
+def test_stream_answers_stay_out_of_the_answer_cache(retriever):
+    rag = MedRAG(llm_name="stub", rag=False, lazy=True, concept_cache_size=0)
+    rag.retrieval_system = retriever
+    rag.answer_cache = SemanticAnswerCache()
+    q = "Does warfarin interact with aspirin?"
+
+    streamed = "".join(rag.medrag_stream(q, 3))
+    assert len(rag.answer_cache) == 0
+    answer = rag.medrag_answer(q, 3)
+    assert len(rag.answer_cache) == 1
+    # A later stream may serve medrag_answer's cached answer
+    assert "".join(rag.medrag_stream(q, 3)) == answer != streamed
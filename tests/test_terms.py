@@ -0,0 +1,49 @@
+import threading
+import numpy as np
+from src.terms import TermIndex, TermIndexWriter, key_terms, term_ids
+
+
+def build(tmp_path, texts):
+    prefix = str(tmp_path / "key_terms")
+    writer = TermIndexWriter(prefix)
+    for row, text in enumerate(texts):
+        writer.add(row, text)
+    writer.commit(n_rows=len(texts))
+    return TermIndex(prefix)
+
+
+def test_overlap_counts_with_repeated_terms_across_rows(tmp_path):
+    index = build(tmp_path, ["warfarin bleeding"] * 3)
+    query = term_ids({f"unrelated{i}" for i in range(16)})
+    assert index.overlap_counts([0, 1, 2], query).tolist() == [0, 0, 0]
+
+
+def test_overlap_counts_match_set_intersection(tmp_path):
+    texts = [
+        "warfarin increases bleeding risk with aspirin",
+        "metformin lowers glucose; nausea and diarrhea",
+        "aspirin bleeding warfarin bruising bleeding",
+        "",
+    ]
+    index = build(tmp_path, texts)
+    q = key_terms("aspirin warfarin bleeding glucose " + " ".join(f"filler{i}" for i in range(20)))
+    rows = [2, 0, 1, 3, 0, 99]
+    expected = [len(q & key_terms(texts[r])) if r < len(texts) else 0 for r in rows]
+    assert index.overlap_counts(rows, term_ids(q)).tolist() == expected
+    assert index.overlap_counts(rows, np.empty(0, dtype=np.int64)).tolist() == [0] * len(rows)
+
+
+def test_retriever_reads_term_overlaps_under_the_swap_lock(retriever):
+    rows = [int(r) for r in retriever.metadatas.rows()]
+    terms = key_terms("warfarin bleeding")
+    expected = [len(terms & key_terms(retriever.metadatas.get(r)["content"])) for r in rows]
+    assert retriever.term_overlaps(rows, terms).tolist() == expected
+
+    # A swap in progress holds the reader back until the new snapshot is in place
+    done = threading.Event()
+    with retriever._swap_lock.write():
+        t = threading.Thread(target=lambda: (retriever.term_overlaps(rows, terms), done.set()))
+        t.start()
+        assert not done.wait(0.1)
+    t.join(5)
+    assert done.is_set()